@@ -0,0 +1,44 @@
+# bench_pricing_models.py
+# Throughput of every registered pricing model on the same batch of options.
+# Run from the repo root:  python benchmarks/bench_pricing_models.py [n_options]
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from models import PRICING_MODELS  # noqa: E402
+
+
+def make_batch(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        "opt_type": np.where(rng.random(n) < 0.5, "Call", "Put"),
+        "K": rng.uniform(700.0, 1000.0, n),
+        "T": rng.uniform(7 / 365.0, 1.0, n),
+        "sigma": rng.uniform(0.10, 0.40, n),
+        "underlying": rng.uniform(750.0, 950.0, n),
+    }
+
+
+def bench(fn, batch, rf=0.015, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(batch["opt_type"], batch["K"], batch["T"], batch["sigma"], batch["underlying"], rf)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(n=20_000):
+    batch = make_batch(n)
+    print(f"{'model':<28}{'best (s)':>10}{'options/s':>14}")
+    for name, entry in PRICING_MODELS.items():
+        t = bench(entry["price"], batch)
+        print(f"{name:<28}{t:>10.4f}{n / t:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
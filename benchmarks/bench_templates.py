@@ -0,0 +1,133 @@
+# bench_templates.py
+# Template resolution: the pages' DataFrame cascade against templates.TemplateResolver, over every
+# template in st_template.json at every ATM strike / expiry anchor of the chain. Checks that both
+# pick the same legs, then times them. A thinned copy of the chain (random rows dropped) drives
+# the fallback steps too.
+# Run from the repo root:  python benchmarks/bench_templates.py [market.json] [future.json] [template.json]
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from market_data import load_future_market, load_option_market  # noqa: E402
+from templates import TemplateResolver  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+def cascade_resolve(df_market, df_market_Future, comps, unique_strikes, unique_exp, atm_strike_idx, atm_exp_idx, spot_ref):
+    # the template loop of pages/1_SET50.py before TemplateResolver
+    used, out = set(), []
+    for comp in comps:
+        typ = comp.get("type")
+        rs = int(comp.get("relative_strike", 0))
+        re = int(comp.get("relative_expiry", 0))
+        chosen = target_strike = target_exp = None
+        if atm_strike_idx is not None and unique_strikes.size:
+            target_idx = atm_strike_idx + rs
+            if 0 <= target_idx < len(unique_strikes):
+                target_strike = unique_strikes[target_idx]
+        if atm_exp_idx is not None and unique_exp.size:
+            try:
+                base_pos = int(np.where(unique_exp == atm_exp_idx)[0][0])
+                targ_pos = base_pos + re
+                if 0 <= targ_pos < len(unique_exp):
+                    target_exp = unique_exp[targ_pos]
+            except Exception:
+                candidate = atm_exp_idx + re
+                if candidate in unique_exp:
+                    target_exp = candidate
+        if typ in ("Call", "Put") and target_strike is not None and target_exp is not None:
+            cands = df_market[(np.isclose(df_market["Strike"], target_strike)) & (df_market["TypeParsed"] == typ) & (df_market["ExpiryIndex"] == target_exp)]
+            if not cands.empty:
+                chosen = cands.iloc[0]["Series"]
+        if chosen is None and typ in ("Call", "Put") and target_exp is not None:
+            cands_same_exp = df_market[df_market["ExpiryIndex"] == target_exp].copy()
+            if not cands_same_exp.empty:
+                base = target_strike if target_strike is not None else spot_ref
+                cands_same_exp["strike_dist"] = np.abs(cands_same_exp["Strike"].fillna(base) - base)
+                if rs < 0:
+                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) <= base, 0, 1)
+                else:
+                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) >= base, 0, 1)
+                for s in cands_same_exp.sort_values(["strike_dist", "pref"])["Series"].tolist():
+                    if s not in used:
+                        chosen = s
+                        break
+        if chosen is None and typ in ("Call", "Put") and target_strike is not None:
+            cands_same_strike = df_market[np.isclose(df_market["Strike"], target_strike)].copy()
+            if not cands_same_strike.empty and atm_exp_idx is not None:
+                cands_same_strike["exp_dist"] = np.abs(cands_same_strike["ExpiryIndex"].fillna(atm_exp_idx) - (target_exp if target_exp is not None else atm_exp_idx))
+                for s in cands_same_strike.sort_values("exp_dist")["Series"].tolist():
+                    if s not in used:
+                        chosen = s
+                        break
+        if chosen is None and typ == "Future" and not df_market_Future.empty and target_exp is not None:
+            for s in df_market_Future[df_market_Future["ExpiryIndex"] == target_exp]["Series"].tolist():
+                if s not in used:
+                    chosen = s
+                    break
+        if chosen is None and typ in ("Call", "Put"):
+            cands_any = df_market[df_market["TypeParsed"] == typ].copy()
+            if not cands_any.empty:
+                base_strike = target_strike if target_strike is not None else spot_ref
+                base_exp = target_exp if target_exp is not None else (atm_exp_idx if atm_exp_idx is not None else 0)
+                cands_any["score"] = np.abs(cands_any["Strike"].fillna(base_strike) - base_strike) + np.abs(cands_any["ExpiryIndex"].fillna(base_exp) - base_exp)
+                for s in cands_any.sort_values("score")["Series"].tolist():
+                    if s not in used:
+                        chosen = s
+                        break
+        if chosen and chosen not in used:
+            used.add(chosen)
+        out.append((chosen, target_strike, target_exp))
+    return out
+
+
+def anchors(df_market):
+    # (atm_strike_idx, atm_exp_idx, spot_ref) for every strike of the chain and every expiry
+    strikes = np.array(sorted(df_market["Strike"].dropna().unique()))
+    expiries = np.array(sorted(df_market["ExpiryIndex"].dropna().unique()))
+    return [(i, int(e), float(k)) for i, k in enumerate(strikes) for e in expiries]
+
+
+def run(df_market, df_future, templates, label):
+    strikes = np.array(sorted(df_market["Strike"].dropna().unique()))
+    expiries = np.array(sorted(df_market["ExpiryIndex"].dropna().unique()))
+    cases = [(comps, a) for comps in templates for a in anchors(df_market)]
+
+    t0 = time.perf_counter()
+    expected = [cascade_resolve(df_market, df_future, comps, strikes, expiries, *a) for comps, a in cases]
+    t_cascade = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    resolver = TemplateResolver(df_market, df_future)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    got = [resolver.resolve(comps, *a) for comps, a in cases]
+    t_resolve = time.perf_counter() - t0
+
+    mismatches = sum(g != e for g, e in zip(got, expected))
+    print(f"{label}: {len(cases):,} template instantiations, {mismatches} mismatches")
+    print(f"  cascade  {t_cascade:8.3f} s")
+    print(f"  resolver {t_resolve:8.3f} s  (+ {t_build * 1e3:.1f} ms build)  {t_cascade / t_resolve:,.0f}x")
+    return mismatches
+
+
+def main(market=DATA_DIR / "market_data_S50OPTION.json", future=DATA_DIR / "market_data_future.json",
+         template=DATA_DIR / "st_template.json"):
+    df_market = load_option_market(market)
+    df_future = load_future_market(future)
+    templates = [t.get("components", []) for t in json.loads(Path(template).read_text(encoding="utf-8")).values()]
+    bad = run(df_market, df_future, templates, "full chain")
+    # drop a third of the rows so exact hits fail and the fallbacks run
+    thinned = df_market.sample(frac=2 / 3, random_state=0).sort_index()
+    bad += run(thinned.reset_index(drop=True), df_future, templates, "thinned chain")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,275 @@
+# feed_sim.py
+# Local stand-in for a market feed, for load-testing live mark-to-market without a broker.
+#   server   - asyncio TCP server streaming ticks as NDJSON lines
+#              {"s": series, "p": last, "b": bid, "o": offer, "t": send time (ns)}
+#              either random-walk ticks over the current data/ instruments or a replay of
+#              archived snapshots from the history store (history.py)
+#   consumer - applies each batch of ticks to a private copy of the instrument index and
+#              recomputes P/L only for the strategies holding a ticked series, recording the
+#              tick-to-refresh latency
+# Run both in one process and print latency / throughput:
+#   python feed_sim.py bench [--products S50 GF ...] [--rate 2000] [--seconds 10] [--strategies 500]
+# or separately:  python feed_sim.py serve ...   /   python feed_sim.py consume ...
+import argparse
+import asyncio
+import copy
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from history import read_history
+from instruments import InstrumentIndex, quote_price
+from market_data import load_frame
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+HOST, PORT = "127.0.0.1", 8765
+# product -> market files (relative to data/)
+PRODUCT_FILES = {
+    "S50": ("market_data_S50OPTION.json", "market_data_S50.json"),
+    "SVF": ("market_data_SVF.json",),
+    "GF": ("market_data_GF.json",),
+    "GF10": ("market_data_GF10.json",),
+    "GO": ("market_data_GO.json",),
+}
+TICK_VOL = 0.002  # relative standard deviation of one random-walk tick
+DEFAULT_TICK_SIZE = 0.1
+
+
+def load_universe(products, data_dir=DATA_DIR):
+    # one row per series of the chosen products: Series, Product, Price, TickSize, Multiplier
+    frames = []
+    for product in products:
+        for name in PRODUCT_FILES[product]:
+            df = load_frame(Path(data_dir) / name)
+            if df.empty:
+                continue
+            frames.append(pd.DataFrame({
+                "Series": df["Series"].to_numpy(dtype=object),
+                "Product": product,
+                "Price": quote_price(df),
+                "TickSize": pd.to_numeric(df["SPREAD"], errors="coerce") if "SPREAD" in df.columns else np.nan,
+                "Multiplier": pd.to_numeric(df["MULTIPLER"], errors="coerce") if "MULTIPLER" in df.columns else np.nan,
+            }))
+    df = pd.concat(frames, ignore_index=True).drop_duplicates("Series").reset_index(drop=True)
+    df["TickSize"] = df["TickSize"].fillna(DEFAULT_TICK_SIZE)
+    df["Multiplier"] = df["Multiplier"].fillna(1.0)
+    # unquoted series start a walk from a few ticks instead of NaN
+    df["Price"] = df["Price"].where(df["Price"] > 0, df["TickSize"] * 10)
+    return df
+
+
+def random_walk_ticks(universe, rate, seed=0):
+    # endless batches of (series, last, bid, offer), `rate` ticks per second in 10 ms batches
+    rng = np.random.default_rng(seed)
+    series = universe["Series"].to_numpy(dtype=object)
+    price = universe["Price"].to_numpy(dtype=float).copy()
+    tick = universe["TickSize"].to_numpy(dtype=float)
+    per_batch = max(1, int(round(rate / 100)))
+    while True:
+        idx = rng.integers(0, len(series), per_batch)
+        price[idx] = np.maximum(np.round(price[idx] * np.exp(TICK_VOL * rng.standard_normal(per_batch)) / tick[idx]) * tick[idx], tick[idx])
+        yield [(series[i], price[i], price[i] - tick[i], price[i] + tick[i]) for i in idx], 0.01
+
+
+def replay_ticks(store_dir, tables, start=None, end=None, speed=60.0):
+    # archived snapshots in time order; a series ticks when its quote differs from the previous
+    # snapshot. `speed`: replay seconds per real second.
+    frames = [read_history(store_dir, t, start, end, columns=["Series", "Last", "Bid", "Offer"]) for t in tables]
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return
+    hist = pd.concat(frames, ignore_index=True).sort_values("AsOf", kind="stable")
+    hist["Price"] = quote_price(hist)
+    last, prev_t = {}, None
+    for t, snap in hist.groupby("AsOf", sort=True):
+        ticks = [(s, p, b, o) for s, p, b, o in zip(snap["Series"], snap["Price"], snap["Bid"], snap["Offer"])
+                 if last.get(s) != p]
+        last.update(zip(snap["Series"], snap["Price"]))
+        wait = 0.0 if prev_t is None else (t - prev_t).total_seconds() / speed
+        prev_t = t
+        yield ticks, wait
+
+
+async def serve(ticks, host=HOST, port=PORT, started=None):
+    # stream `ticks` (an iterator of (batch, wait seconds)) to every connected client, starting
+    # when the first one connects
+    clients = set()
+    connected = asyncio.Event()
+
+    async def on_client(reader, writer):
+        clients.add(writer)
+        connected.set()
+        try:
+            await reader.read()  # until the client disconnects
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # client dropped, or the server is shutting down
+        finally:
+            clients.discard(writer)
+
+    server = await asyncio.start_server(on_client, host, port)
+    if started is not None:
+        started.set()
+    async with server:
+        await connected.wait()
+        for batch, wait in ticks:
+            await asyncio.sleep(wait)
+            if not clients or not batch:
+                continue
+            now = time.time_ns()
+            payload = "".join(json.dumps({"s": s, "p": float(p), "b": float(b), "o": float(o), "t": now}) + "\n"
+                              for s, p, b, o in batch).encode()
+            for writer in list(clients):
+                writer.write(payload)
+                await writer.drain()
+
+
+def random_strategies(universe, n, legs=(2, 4), seed=1):
+    # n strategies of 2-4 legs on one product's series, entered at the current price
+    rng = np.random.default_rng(seed)
+    series = universe["Series"].to_numpy(dtype=object)
+    product = universe["Product"].to_numpy(dtype=object)
+    out = []
+    for _ in range(n):
+        pool = np.flatnonzero(product == product[rng.integers(len(series))])
+        pick = rng.choice(pool, size=min(len(pool), rng.integers(legs[0], legs[1] + 1)), replace=False)
+        out.append([{"Series": series[i], "Qty": int(rng.choice([-2, -1, 1, 2])), "TradePrice": float(universe["Price"].iloc[i])}
+                    for i in pick])
+    return out
+
+
+class LiveBook:
+    # strategies marked to market off a private instrument index; apply() reprices only the
+    # strategies with a leg in the ticked series
+
+    def __init__(self, index, strategies, multipliers):
+        self.index = copy.deepcopy(index)
+        leg_sid, leg_pos, leg_qty, leg_entry = [], [], [], []
+        for sid, legs in enumerate(strategies):
+            for leg in legs:
+                pos = self.index.get(leg["Series"])
+                if pos is None:
+                    continue
+                leg_sid.append(sid); leg_pos.append(pos)
+                leg_qty.append(leg["Qty"]); leg_entry.append(leg["TradePrice"])
+        self.leg_sid = np.asarray(leg_sid, dtype=np.intp)
+        self.leg_pos = np.asarray(leg_pos, dtype=np.intp)
+        self.leg_qty = np.asarray(leg_qty, dtype=float) * np.asarray(multipliers, dtype=float)[self.leg_pos]
+        self.leg_entry = np.asarray(leg_entry, dtype=float)
+        # instrument position -> legs holding it
+        order = np.argsort(self.leg_pos, kind="stable")
+        bounds = np.searchsorted(self.leg_pos[order], np.arange(len(self.index.series) + 1))
+        self.legs_of = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.index.series))]
+        self.pnl = np.zeros(len(strategies))
+        self.reprice(np.arange(len(strategies)))
+
+    def reprice(self, sids):
+        mask = np.isin(self.leg_sid, sids)
+        value = (self.index.price[self.leg_pos[mask]] - self.leg_entry[mask]) * self.leg_qty[mask]
+        self.pnl[sids] = np.bincount(self.leg_sid[mask], weights=np.nan_to_num(value), minlength=len(self.pnl))[sids]
+
+    def apply(self, ticks):
+        # ticks: [(series, last, bid, offer)]; returns the repriced strategy ids
+        pos = np.array([self.index.pos.get(s, -1) for s, *_ in ticks], dtype=np.intp)
+        known = pos >= 0
+        if not known.any():
+            return np.empty(0, dtype=np.intp)
+        self.index.set_prices(pos[known], np.array([t[1] for t in ticks], dtype=float)[known])
+        legs = np.concatenate([self.legs_of[p] for p in np.unique(pos[known])])
+        sids = np.unique(self.leg_sid[legs])
+        if sids.size:
+            self.reprice(sids)
+        return sids
+
+
+async def consume(book, host=HOST, port=PORT, seconds=None):
+    # read ticks until the feed closes (or for `seconds`), applying each available batch at once;
+    # returns (tick latencies in ms, ticks applied, strategy repricings)
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies, n_ticks, n_repriced = [], 0, 0
+    deadline = None if seconds is None else time.perf_counter() + seconds
+    pending = b""
+    try:
+        while deadline is None or time.perf_counter() < deadline:
+            try:
+                # everything that has arrived so far, so one repricing covers the whole batch
+                data = await asyncio.wait_for(reader.read(1 << 16), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b"\n")
+            if not lines:
+                continue
+            ticks = [json.loads(x) for x in lines]
+            n_repriced += book.apply([(t["s"], t["p"], t["b"], t["o"]) for t in ticks]).size
+            done = time.time_ns()
+            latencies.extend((done - t["t"]) / 1e6 for t in ticks)
+            n_ticks += len(ticks)
+    finally:
+        writer.close()
+    return np.asarray(latencies), n_ticks, n_repriced
+
+
+def report(latencies, n_ticks, n_repriced, seconds):
+    if not n_ticks:
+        print("no ticks received")
+        return
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"ticks {n_ticks:,} ({n_ticks / seconds:,.0f}/s), strategy repricings {n_repriced:,}")
+    print(f"tick -> refresh latency ms: p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}  max {latencies.max():.2f}")
+
+
+def _ticks_for(args, universe):
+    if args.replay:
+        tables = [Path(f).stem for p in args.products for f in PRODUCT_FILES[p]]
+        return replay_ticks(args.replay, tables, args.start, args.end, args.speed)
+    return random_walk_ticks(universe, args.rate)
+
+
+def _book_for(args, universe):
+    index = InstrumentIndex(universe)
+    return LiveBook(index, random_strategies(universe, args.strategies), universe["Multiplier"].to_numpy())
+
+
+async def _bench(args, universe):
+    book = _book_for(args, universe)
+    started = asyncio.Event()
+    server = asyncio.create_task(serve(_ticks_for(args, universe), args.host, args.port, started))
+    await started.wait()
+    t0 = time.perf_counter()
+    result = await consume(book, args.host, args.port, args.seconds)
+    server.cancel()
+    report(*result, time.perf_counter() - t0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated tick feed and live P/L consumer")
+    parser.add_argument("mode", choices=["serve", "consume", "bench"])
+    parser.add_argument("--products", nargs="+", default=list(PRODUCT_FILES), choices=list(PRODUCT_FILES))
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--rate", type=float, default=2000.0, help="random-walk ticks per second")
+    parser.add_argument("--replay", metavar="STORE_DIR", help="replay the history store instead of a random walk")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--speed", type=float, default=60.0, help="replay seconds per real second")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--strategies", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    universe = load_universe(args.products)
+    if args.mode == "serve":
+        asyncio.run(serve(_ticks_for(args, universe), args.host, args.port))
+    elif args.mode == "consume":
+        t0 = time.perf_counter()
+        result = asyncio.run(consume(_book_for(args, universe), args.host, args.port, args.seconds))
+        report(*result, time.perf_counter() - t0)
+    else:
+        asyncio.run(_bench(args, universe))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# history.py
+# Append-only store of past market / margin snapshots.
+# Every archived file version becomes one compressed chunk (np.savez_compressed, one typed array
+# per column, typed like snapshot.py) in a month partition of its table, and the table's
+# index.json lists the chunks in date order with their row offsets. A date-range query reads
+# only the chunks whose date falls in the range, and only the requested columns of those.
+#
+#   data/history/<table>/index.json              {"chunks": [{"date", "taken", "file", "rows", "offset", ...}]}
+#   data/history/<table>/<YYYY-MM>/<taken>.npz   one archived snapshot
+#
+# Tables are named after the JSON file stems (market_data_S50OPTION, margin_data_option, ...).
+# Archive the current data/ folder with:  python history.py [data_dir]
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from market_data import file_key, guess_kind, load_frame
+from snapshot import column_values, typed_column
+
+HISTORY_DIRNAME = "history"
+ARCHIVE_GLOBS = ("market_data_*.json", "margin_data_*.json")
+
+
+def history_dir(data_dir):
+    return Path(data_dir) / HISTORY_DIRNAME
+
+
+def read_index(table_dir):
+    path = Path(table_dir) / "index.json"
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {"chunks": []}
+
+
+def _write_index(table_dir, index):
+    # write-then-rename, so readers never see a half-written index
+    path = Path(table_dir) / "index.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(index, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def append_snapshot(store_dir, table, df, kind="raw", taken=None, source=None):
+    # archive one snapshot of `table`; taken: datetime of the snapshot (default now). A snapshot
+    # whose source (mtime_ns, size) is already archived is skipped. Returns the chunk entry or None.
+    taken = (taken or datetime.now()).replace(microsecond=0)
+    table_dir = Path(store_dir) / table
+    index = read_index(table_dir)
+    chunks = index["chunks"]
+    if source is not None and any(c.get("source") == list(source) for c in chunks):
+        return None
+
+    rel = Path(taken.strftime("%Y-%m")) / f"{taken.strftime('%Y-%m-%dT%H%M%S')}.npz"
+    (table_dir / rel.parent).mkdir(parents=True, exist_ok=True)
+    n = 1
+    while (table_dir / rel).exists():
+        rel = rel.with_name(f"{taken.strftime('%Y-%m-%dT%H%M%S')}-{n}.npz")
+        n += 1
+    arrays, columns = {}, []
+    for i, name in enumerate(df.columns):
+        values, tag = typed_column(name, df[name])
+        arrays[f"c{i}"] = values
+        columns.append({"name": name, "type": tag})
+    np.savez_compressed(table_dir / rel, **arrays)
+
+    entry = {
+        "date": taken.date().isoformat(), "taken": taken.isoformat(), "file": rel.as_posix(),
+        "rows": int(len(df)), "kind": kind, "columns": columns,
+        "source": list(source) if source is not None else None,
+    }
+    # chunks stay sorted by time; offsets are each chunk's first row in the table's full history
+    chunks.append(entry)
+    chunks.sort(key=lambda c: c["taken"])
+    offset = 0
+    for c in chunks:
+        c["offset"] = offset
+        offset += c["rows"]
+    _write_index(table_dir, index)
+    return entry
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def select_chunks(index, start=None, end=None):
+    # chunks dated within [start, end] (inclusive; None = open), found by bisection on the dates
+    chunks = index["chunks"]
+    dates = [c["date"] for c in chunks]
+    lo = bisect_left(dates, _as_date(start).isoformat()) if start is not None else 0
+    hi = bisect_right(dates, _as_date(end).isoformat()) if end is not None else len(chunks)
+    return chunks[lo:hi]
+
+
+def _read_chunk(table_dir, chunk, columns=None):
+    data = {}
+    with np.load(Path(table_dir) / chunk["file"], allow_pickle=False) as npz:
+        for i, col in enumerate(chunk["columns"]):
+            if columns is None or col["name"] in columns:
+                # NpzFile decompresses a member only when it is accessed
+                data[col["name"]] = column_values(npz[f"c{i}"], col["type"])
+    df = pd.DataFrame(data)
+    df.insert(0, "AsOf", pd.Timestamp(chunk["taken"]))
+    return df
+
+
+def read_history(store_dir, table, start=None, end=None, columns=None, series=None):
+    # archived rows of `table` between two dates, oldest first, with an AsOf column (snapshot
+    # time). columns: subset to read (Series is always read when filtering by series).
+    table_dir = Path(store_dir) / table
+    if columns is not None:
+        columns = set(columns) | ({"Series"} if series is not None else set())
+    frames = []
+    for chunk in select_chunks(read_index(table_dir), start, end):
+        df = _read_chunk(table_dir, chunk, columns)
+        if series is not None:
+            df = df[df["Series"].isin([series] if isinstance(series, str) else series)]
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=["AsOf"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def history_dates(store_dir, table):
+    # distinct archived dates of `table`
+    return sorted({date.fromisoformat(c["date"]) for c in read_index(Path(store_dir) / table)["chunks"]})
+
+
+def daily_log_returns(store_dir, table, column="UNDERLYING PRICE", start=None, end=None):
+    # log returns between consecutive archived dates of one price column (median over the
+    # table's rows of the last snapshot taken each date), e.g. for montecarlo's bootstrap
+    df = read_history(store_dir, table, start, end, columns=[column])
+    if column not in df.columns or df.empty:
+        return np.empty(0)
+    df = df.assign(price=pd.to_numeric(df[column], errors="coerce"), day=df["AsOf"].dt.date)
+    last = df[df["AsOf"] == df.groupby("day")["AsOf"].transform("max")]
+    prices = last.groupby("day")["price"].median().dropna()
+    prices = prices[prices > 0].to_numpy(dtype=float)
+    return np.diff(np.log(prices))
+
+
+def archive_data_dir(data_dir, store_dir=None, taken=None):
+    # append the current version of every market / margin file in data_dir, stamped with the
+    # file's mtime unless `taken` is given; versions already archived are skipped. Returns the
+    # new chunk entries by table.
+    store_dir = store_dir or history_dir(data_dir)
+    added = {}
+    for pattern in ARCHIVE_GLOBS:
+        for path in sorted(Path(data_dir).glob(pattern)):
+            try:
+                kind = guess_kind(load_frame(path))
+                df = load_frame(path, kind)
+            except ValueError:
+                continue
+            source = file_key(path)[1:]
+            stamp = taken or datetime.fromtimestamp(source[0] / 1e9)
+            entry = append_snapshot(store_dir, path.stem, df, kind, stamp, source)
+            if entry is not None:
+                added[path.stem] = entry
+    return added
+
+
+if __name__ == "__main__":
+    import sys
+
+    data_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent / "data"
+    for table, entry in archive_data_dir(data_dir).items():
+        print(f"{table}: {entry['rows']} rows @ {entry['taken']}")
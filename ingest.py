@@ -0,0 +1,120 @@
+# ingest.py
+# Streaming reader for large market files: a JSON array of records or NDJSON (one record per
+# line). Records are decoded incrementally from fixed-size text blocks and collected CHUNK_ROWS
+# at a time into typed columns, so only one chunk of Python dicts is alive at once; the result
+# is the frame pd.DataFrame(json.loads(text)) would give.
+import json
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 20_000
+READ_BYTES = 1 << 20
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
+
+
+def _iter_array(f, read_bytes, path):
+    # records of a top-level JSON array, decoded one at a time from a text buffer that is
+    # refilled read_bytes at a time
+    decoder = json.JSONDecoder()
+    buf, pos, started = "", 0, False
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            buf, pos = f.read(read_bytes), 0
+            if not buf:
+                raise ValueError(f"{path}: unexpected end of JSON array")
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError(f"{path}: not a list of records")
+            started, pos = True, pos + 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # record cut at the end of the buffer: read on (a real syntax error fails at EOF)
+            more = f.read(read_bytes)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield record
+        pos = end
+
+
+def iter_records(path, read_bytes=READ_BYTES):
+    # one dict per record, without reading the whole file into memory
+    with open(path, encoding="utf-8") as f:
+        if str(path).endswith(NDJSON_SUFFIXES):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_array(f, read_bytes, path)
+
+
+def iter_chunks(path, rows=CHUNK_ROWS, read_bytes=READ_BYTES, check=None):
+    # DataFrames of up to `rows` records each; check(records, start) sees every chunk's records
+    # first (e.g. validation.record_checker) and raises to reject the file
+    chunk, start = [], 0
+    for record in iter_records(path, read_bytes):
+        chunk.append(record)
+        if len(chunk) >= rows:
+            if check is not None:
+                check(chunk, start)
+            yield pd.DataFrame(chunk)
+            chunk, start = [], start + len(chunk)
+    if chunk:
+        if check is not None:
+            check(chunk, start)
+        yield pd.DataFrame(chunk)
+
+
+def _intern(col, memo):
+    # string column (object or str dtype) with one shared object per distinct value across
+    # chunks (decoded JSON strings are all separate objects; market columns repeat a handful of
+    # values); missing entries keep their original None / NaN
+    codes, uniques = pd.factorize(col)
+    values = np.array([memo.setdefault(u, u) for u in uniques] + [None], dtype=object)[codes]
+    missing = codes < 0
+    values[missing] = col.to_numpy(dtype=object)[missing]
+    return pd.Series(pd.array(values, dtype=col.dtype), index=col.index, name=col.name)
+
+
+def _join_column(parts):
+    # chunks that agree on a dtype concatenate as they are; otherwise the column is inferred
+    # again from all of its values, as pd.DataFrame would over the whole file
+    if len({p.dtype for p in parts}) == 1:
+        return pd.concat(parts, ignore_index=True)
+    values = np.concatenate([p.to_numpy(dtype=object) for p in parts]).tolist()
+    return pd.Series(values)
+
+
+def read_frame(path, rows=CHUNK_ROWS, read_bytes=READ_BYTES, check=None):
+    # the file's records as one DataFrame, built column by column from typed chunks
+    columns, lengths, memos = {}, [], {}
+    for df in iter_chunks(path, rows, read_bytes, check):
+        for name in df.columns:
+            if name not in columns:
+                # rows of earlier chunks that lacked this key
+                columns[name] = [pd.Series([None] * n, dtype=object) for n in lengths]
+            col = df[name]
+            # object columns count only when every value is a string (pandas >= 2.0)
+            if pd.api.types.is_string_dtype(col):
+                col = _intern(col, memos.setdefault(name, {}))
+            columns[name].append(col)
+        lengths.append(len(df))
+        for name, parts in columns.items():
+            if len(parts) < len(lengths):
+                parts.append(pd.Series([None] * len(df), dtype=object))
+    # join one column at a time, dropping its chunks as it goes, so the chunks and the joined
+    # columns are never all alive together
+    out = {}
+    for name in list(columns):
+        out[name] = _join_column(columns.pop(name))
+    return pd.DataFrame(out, copy=False)
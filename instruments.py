@@ -0,0 +1,128 @@
+# instruments.py
+# Series-keyed index over one market / margin table, built once per snapshot, and the
+# instrument master that pre-joins market quotes, parsed fields and margins into one table.
+# Membership and row lookups are dict hits instead of `df[df["Series"] == s]` scans, and the
+# fields the leg loops read (price, strike, expiry, IV, IM, MM) are positional arrays, so a
+# batch of series resolves with one take.
+import copy
+
+import numpy as np
+import pandas as pd
+
+MISSING = ("", "-", "NA", "NaN", "--")
+MARGIN_COLUMNS = ("IM", "MM", "IntradayForceCloseMargin")
+INDEX_FIELDS = ("kind", "price", "strike", "expiry", "iv", "im", "mm")
+
+
+def _numeric(df, name):
+    # parse_num for a whole column: strings lose thousands separators, blanks become NaN
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    col = df[name]
+    if col.dtype == object or pd.api.types.is_string_dtype(col):
+        col = col.astype(str).str.strip().str.replace(",", "", regex=False).where(col.notna())
+        col = col.where(~col.isin(MISSING))
+    return pd.to_numeric(col, errors="coerce").to_numpy(dtype=float)
+
+
+def quote_price(df):
+    # choose_price_from_row for every row: Last, else Bid/Offer mid, else Bid, else Offer
+    last, bid, offer = _numeric(df, "Last"), _numeric(df, "Bid"), _numeric(df, "Offer")
+    mid = (bid + offer) / 2.0
+    return np.where(~np.isnan(last), last, np.where(~np.isnan(mid), mid, np.where(~np.isnan(bid), bid, offer)))
+
+
+def _master_part(market, margin, kind):
+    # one market table left-joined with its margin table on Series (first row per series wins)
+    if market.empty or "Series" not in market.columns:
+        return None
+    df = market.drop(columns=[c for c in MARGIN_COLUMNS if c in market.columns]).drop_duplicates("Series")
+    if not margin.empty and "Series" in margin.columns:
+        cols = ["Series"] + [c for c in MARGIN_COLUMNS if c in margin.columns]
+        df = df.merge(margin[cols].drop_duplicates("Series"), on="Series", how="left", validate="one_to_one")
+    df.insert(1, "Kind", kind)
+    return df.reset_index(drop=True)
+
+
+def build_master(option_market, option_margin, future_market=None, future_margin=None):
+    # Instrument master: one row per tradable series (options first, then futures not already
+    # listed), carrying every market column plus its margin row and the numeric fields the leg
+    # builders read:
+    #   Kind ("Option" / "Future"), Price (Last, else mid, else Bid, else Offer), IV (IV LAST),
+    #   IM, MM, IntradayForceCloseMargin, Multiplier (MULTIPLER), TickSize (SPREAD)
+    empty = pd.DataFrame()
+    parts = [_master_part(option_market, option_margin, "Option"),
+             _master_part(future_market if future_market is not None else empty,
+                          future_margin if future_margin is not None else empty, "Future")]
+    parts = [df for df in parts if df is not None]
+    if not parts:
+        return pd.DataFrame(columns=["Series", "Kind", "Price", "IV", *MARGIN_COLUMNS, "Multiplier", "TickSize"])
+    df = pd.concat(parts, ignore_index=True).drop_duplicates("Series").reset_index(drop=True)
+    df["Price"] = quote_price(df)
+    df["IV"] = _numeric(df, "IV LAST")
+    for col in MARGIN_COLUMNS:
+        df[col] = _numeric(df, col)
+    df["Multiplier"] = _numeric(df, "MULTIPLER")
+    df["TickSize"] = _numeric(df, "SPREAD")
+    return df
+
+
+class InstrumentIndex:
+    # positions refer to the table's row order (iloc); the first row wins for duplicate series,
+    # matching the pages' `.iloc[0]`. Over an instrument master the precomputed Price / IV / Kind
+    # columns are used as they are.
+
+    def __init__(self, df):
+        series = df["Series"].tolist() if "Series" in df.columns else []
+        self.pos = {}
+        for i, s in enumerate(series):
+            self.pos.setdefault(s, i)
+        self.series = np.asarray(series, dtype=object)
+        self.kind = df["Kind"].to_numpy(dtype=object) if "Kind" in df.columns else np.full(len(df), None, dtype=object)
+        self.price = _numeric(df, "Price") if "Price" in df.columns else quote_price(df)
+        self.strike = _numeric(df, "Strike")
+        self.expiry = df["ExpiryDate"].to_numpy(dtype=object) if "ExpiryDate" in df.columns else np.full(len(df), None, dtype=object)
+        self.iv = _numeric(df, "IV") if "IV" in df.columns else _numeric(df, "IV LAST")
+        self.im = _numeric(df, "IM")
+        self.mm = _numeric(df, "MM")
+
+    def __len__(self):
+        return len(self.pos)
+
+    def __contains__(self, series):
+        return series in self.pos
+
+    def get(self, series, default=None):
+        return self.pos.get(series, default)
+
+    def positions(self, series_list):
+        # -1 for series not in the table
+        return np.array([self.pos.get(s, -1) for s in series_list], dtype=np.intp)
+
+    def patched(self, df, rows):
+        # index for df, a newer version of this table with the same series in the same order
+        # where only the rows at positions `rows` changed: only those rows are re-read, the
+        # rest of every field array is copied over (this index is left untouched)
+        out = copy.copy(self)
+        rows = np.asarray(rows, dtype=np.intp)
+        sub = InstrumentIndex(df.iloc[rows])
+        for field in INDEX_FIELDS:
+            values = getattr(self, field).copy()
+            values[rows] = getattr(sub, field)
+            setattr(out, field, values)
+        return out
+
+    def set_prices(self, positions, prices):
+        # live quote update in place (e.g. from a tick feed); use it on a private copy
+        # (copy.deepcopy) of a cached index, never on the shared one
+        if not self.price.flags.writeable:
+            self.price = self.price.copy()
+        self.price[np.asarray(positions, dtype=np.intp)] = prices
+
+    def take(self, field, series_list):
+        # field values for many series at once; NaN (None for expiry) where a series is missing
+        values = getattr(self, field)
+        pos = self.positions(series_list)
+        fill = None if values.dtype == object else np.nan
+        out = np.where(pos >= 0, values[np.maximum(pos, 0)] if len(values) else fill, fill)
+        return out.astype(values.dtype) if values.dtype != object else out
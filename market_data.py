@@ -0,0 +1,490 @@
+# market_data.py
+# Shared loader for the market / margin / template JSON files.
+# Parsed and enriched DataFrames are cached process-wide on (path, mtime, size), so every
+# page and every session reuses one parse per file version; a rewritten file (new mtime or
+# size) is picked up on the next call. Callers get their own copy (see _caller_copy) and may add
+# columns or edit values in place without touching the cached frame.
+# When a compiled snapshot (see snapshot.py) of the same file version exists, it is opened
+# memory-mapped instead of parsing the JSON.  Compile with:  python market_data.py data/*.json
+#
+# Refreshes are incremental: a rewritten JSON file is diffed against the previous version by
+# Series (record by record), only new or changed rows are re-enriched, and the instrument
+# indexes patch just those rows. Each (path, kind) keeps a version counter that moves only when
+# rows change, plus the version at which each series last changed (market_version /
+# series_version), for downstream caches that want to invalidate per series.
+#
+# NDJSON files and JSON files of STREAM_MIN_BYTES or more are read with ingest.read_frame, which
+# streams records into typed columns chunk by chunk instead of building the whole list of dicts
+# (those reload in full; the record diff needs the dicts).
+#
+# Every file version is checked against its JSON schema (validation.py) once, when it is first
+# read and before it is cached; a malformed version raises ValueError instead of being served.
+import calendar
+import json
+import logging
+import os
+import threading
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ingest import NDJSON_SUFFIXES
+from ingest import read_frame as stream_frame
+from instruments import InstrumentIndex, build_master
+from snapshot import read_meta, read_snapshot, snapshot_dir, write_snapshot
+from templates import CompiledTemplates, TemplateMatcher, TemplateResolver
+from validation import record_checker, validate_file_data
+
+log = logging.getLogger(__name__)
+
+CACHE_SIZE = 64
+STREAM_MIN_BYTES = 32 << 20
+
+# expiry parsing (month letter + 2-digit year)
+EXPIRY_ORDER = "FGHJKMNQUVXZ"
+MONTH_MAP = {"F":1,"G":2,"H":3,"J":4,"K":5,"M":6,"N":7,"Q":8,"U":9,"V":10,"X":11,"Z":12}
+
+
+def leg_type_from_series(series):
+    if not isinstance(series,str): return (None, np.nan)
+    if 'C' in series:
+        idx = series.rfind('C'); opt = 'Call'
+    elif 'P' in series:
+        idx = series.rfind('P'); opt = 'Put'
+    else:
+        return (None, np.nan)
+    strike_part = series[idx+1:]
+    try:
+        strike = float(strike_part)
+    except:
+        digits = ''.join(ch for ch in series if ch.isdigit())
+        strike = float(digits) if digits else np.nan
+    return (opt, strike)
+
+
+@lru_cache(maxsize=None)
+def expiry_date_for(year, month):
+    # 3rd Friday of the month, else the 15th; memoized so each (year, month) is scanned once
+    cal = calendar.Calendar(firstweekday=0)
+    fridays = [d for d in cal.itermonthdates(year, month) if d.month == month and d.weekday() == 4]
+    return fridays[2] if len(fridays) >= 3 else date(year, month, min(15,28))
+
+
+def parse_expiry_code(series):
+    if not isinstance(series,str): return (None, np.nan, None)
+    if len(series) <= 7:
+        #future
+        letter = series[-3]
+        year2 = series[-2:]
+    else:
+        #option series
+        clean_series = series[:-4]
+        letter = clean_series[-3]
+        year2 = clean_series[-2:]
+    month = MONTH_MAP.get(letter, 1)
+    year = 2000 + int(year2)
+    expiry_date = expiry_date_for(year, month)
+    idx = EXPIRY_ORDER.index(letter) + int(year2) * 12
+    return (letter + year2, idx, expiry_date)
+
+
+# Fast path for well-formed codes, one regex pass over the column:
+#   option: <root without 'C'><month letter><yy><C|P><3-digit strike>  (len > 7)
+#   future: <root without 'C'/'P', <= 4 chars><month letter><yy>         (len <= 7)
+# Within these shapes the last 'C' / 'P' is the one before the strike, so the result is what
+# leg_type_from_series / parse_expiry_code give; every other code goes through those functions.
+SERIES_PATTERN = (r"^(?:[^C]+?(?P<opt_month>[" + EXPIRY_ORDER + r"])(?P<opt_year>\d\d)(?P<cp>[CP])(?P<strike>\d{3})"
+                  r"|[^CP]{0,4}(?P<fut_month>[" + EXPIRY_ORDER + r"])(?P<fut_year>\d\d))$")
+EXPIRY_INDEX = {letter: i for i, letter in enumerate(EXPIRY_ORDER)}
+
+
+def _parse_series_slow(value):
+    opt, strike = leg_type_from_series(value)
+    try:
+        code, idx, _ = parse_expiry_code(value)
+    except (ValueError, IndexError):
+        code, idx = None, np.nan
+    return opt, strike, code, idx
+
+
+def parse_series_frame(series):
+    # Vectorized leg_type_from_series + parse_expiry_code for a whole Series column, replacing
+    # the per-row .apply calls and their tuple unpacking. Returns TypeParsed, Strike, ExpiryCode,
+    # ExpiryIndex aligned with series. Codes whose month / year don't parse (parse_expiry_code
+    # raises on them, e.g. 4-digit strikes) get None / NaN and are logged as a warning, so one
+    # odd series does not fail the whole file. Missing values are None in the object columns
+    # and NaN in the numeric ones on both paths.
+    m = series.astype(object).str.extract(SERIES_PATTERN)
+    is_opt = m["cp"].notna()
+    month = m["opt_month"].where(is_opt, m["fut_month"])
+    year = m["opt_year"].where(is_opt, m["fut_year"])
+    out = pd.DataFrame({
+        "TypeParsed": m["cp"].map({"C": "Call", "P": "Put"}).astype(object).where(is_opt, None),
+        "Strike": pd.to_numeric(m["strike"], errors="coerce").astype(float),
+        "ExpiryCode": (month + year).astype(object),
+        "ExpiryIndex": month.map(EXPIRY_INDEX) + pd.to_numeric(year, errors="coerce") * 12,
+    }, index=series.index)
+    slow = month.isna()
+    if slow.any():
+        out.loc[slow, :] = [_parse_series_slow(v) for v in series[slow]]
+        bad = series[slow & out["ExpiryCode"].isna() & series.map(lambda v: isinstance(v, str))]
+        if len(bad):
+            log.warning("%d series codes without a parsable expiry (ExpiryIndex NaN): %s",
+                        len(bad), ", ".join(bad.head(10)) + (", ..." if len(bad) > 10 else ""))
+    # same dtypes the .apply path inferred (string columns, int64 index when complete)
+    for col in ("TypeParsed", "ExpiryCode"):
+        out[col] = pd.Series(out[col].tolist(), index=out.index)
+    if out["ExpiryIndex"].notna().all():
+        out["ExpiryIndex"] = out["ExpiryIndex"].astype("int64")
+    return out
+
+
+def file_key(path):
+    # (resolved path, mtime_ns, size): changes whenever the file is rewritten
+    path = Path(path).resolve()
+    st = os.stat(path)
+    return (str(path), st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _read_json_cached(key):
+    # validated against the file's schema (validation.py) before it is cached: a malformed
+    # version raises ValueError and is read and checked again on the next call
+    doc = json.loads(Path(key[0]).read_text(encoding="utf-8"))
+    validate_file_data(doc, key[0])
+    return doc
+
+
+def read_json(path):
+    # parsed JSON, shared between callers: treat the result as read-only
+    return _read_json_cached(file_key(path))
+
+
+def _streamed(key):
+    return key[0].endswith(NDJSON_SUFFIXES) or key[2] >= STREAM_MIN_BYTES
+
+
+def _raw_frame(key):
+    # unenriched records of one file version as a DataFrame
+    if _streamed(key):
+        return stream_frame(key[0], check=record_checker(key[0]))
+    records = _read_json_cached(key)
+    if not isinstance(records, list):
+        raise ValueError(f"{key[0]}: not a list of records")
+    return pd.DataFrame(records)
+
+
+def _enrich_expiry(df, parsed):
+    df["ExpiryCode"] = parsed["ExpiryCode"]
+    df["ExpiryIndex"] = parsed["ExpiryIndex"]
+    df["ExpiryDate"] = pd.to_datetime(df["ExpiryDate"]).dt.date
+    return df
+
+
+def _enrich(df, kind):
+    if df.empty:
+        return df
+    df.columns = [c.strip() for c in df.columns]
+    if kind in ("option", "future"):
+        parsed = parse_series_frame(df["Series"])
+    if kind == "option":
+        # TypeParsed, Strike, ExpiryCode, ExpiryIndex, ExpiryDate
+        df["TypeParsed"] = parsed["TypeParsed"]
+        df["Strike"] = parsed["Strike"]
+        df = _enrich_expiry(df, parsed)
+    elif kind == "future":
+        df = _enrich_expiry(df, parsed)
+    return df
+
+
+def _fresh_snapshot(key, kind):
+    out_dir = snapshot_dir(key[0])
+    meta = read_meta(out_dir)
+    if meta and tuple(meta["source"]) == key[1:] and meta["kind"] == kind:
+        return out_dir
+    return None
+
+
+# latest refresh per (resolved path, kind): {"key", "records", "pos", "frame", "version",
+# "changed", "series_version"}; "records" (the parsed JSON list) is None for snapshot frames
+_LIVE = {}
+_LIVE_LOCK = threading.Lock()
+
+
+def _patch_frame(prev, records, kind):
+    # enriched frame for records reusing prev's rows whose record is unchanged (same Series, equal
+    # dict); returns (frame, positions of the re-enriched records), or None when the changed
+    # records don't have the previous columns and only a full enrichment gives the right frame
+    old, pos = prev["records"], prev["pos"]
+    old_pos = np.array([pos.get(r.get("Series"), -1) for r in records], dtype=np.intp)
+    same = np.array([p >= 0 and old[p] == r for p, r in zip(old_pos, records)], dtype=bool)
+    fresh = np.flatnonzero(~same)
+    if not fresh.size and len(records) == len(old) and np.array_equal(old_pos, np.arange(len(old))):
+        return prev["frame"], fresh
+    kept = prev["frame"].iloc[old_pos[same]].set_axis(np.flatnonzero(same))
+    if not fresh.size:
+        return kept.reset_index(drop=True), fresh
+    part = _enrich(pd.DataFrame([records[i] for i in fresh]), kind).set_axis(fresh)
+    if set(part.columns) != set(kept.columns):
+        return None
+    frame = pd.concat([kept, part[kept.columns]]).sort_index() if len(kept) else part
+    for col in frame.columns:
+        # a column the fresh rows leave empty keeps its previous dtype (as a full load would infer)
+        if len(kept) and frame[col].dtype != kept[col].dtype and part[col].isna().all():
+            frame[col] = frame[col].astype(kept[col].dtype)
+    return frame, fresh
+
+
+def _refresh(key, kind, records=None, frame=None):
+    # record a new version of (path, kind) from its JSON records or a ready frame (snapshot or
+    # streamed). Records are patched from the previous version where possible, everything else
+    # is enriched in full.
+    with _LIVE_LOCK:
+        prev = _LIVE.get((key[0], kind))
+        if prev is not None and prev["key"] == key:
+            return prev["frame"]
+        patched = None
+        if (frame is None and prev is not None and prev["records"] and isinstance(records, list) and records
+                and all(isinstance(r, dict) for r in records)):
+            patched = _patch_frame(prev, records, kind)
+        if patched is not None:
+            frame, fresh = patched
+            new_series = {r.get("Series") for r in records}
+            changed = {records[i].get("Series") for i in fresh} | (set(prev["pos"]) - new_series)
+        else:
+            frame = frame if frame is not None else _enrich(pd.DataFrame(records), kind)
+            changed = None
+        pos = {}
+        for i, s in enumerate(frame["Series"].tolist() if "Series" in frame.columns else []):
+            pos.setdefault(s, i)
+        version = (prev["version"] if prev else 0) + (1 if changed is None or changed else 0)
+        series_version = dict(prev["series_version"]) if prev and changed is not None else {}
+        for s in (pos if changed is None else changed):
+            series_version[s] = version
+        _LIVE[(key[0], kind)] = {
+            "key": key, "records": records if isinstance(records, list) else None,
+            "pos": pos, "frame": frame, "version": version,
+            "changed": None if changed is None else frozenset(changed), "series_version": series_version,
+        }
+        return frame
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _frame_cached(key, kind):
+    out_dir = _fresh_snapshot(key, kind)
+    if out_dir is not None:
+        return _refresh(key, kind, frame=read_snapshot(out_dir))
+    if _streamed(key):
+        return _refresh(key, kind, frame=_enrich(stream_frame(key[0], check=record_checker(key[0])), kind))
+    return _refresh(key, kind, records=_read_json_cached(key))
+
+
+def market_version(path, kind="raw"):
+    # refresh counter of (path, kind): moves when a reload changed, added or removed rows; 0 if never loaded
+    state = _LIVE.get((str(Path(path).resolve()), kind))
+    return state["version"] if state else 0
+
+
+def series_version(path, series, kind="raw"):
+    # version at which `series` last changed in (path, kind), or 0 if it is unknown
+    state = _LIVE.get((str(Path(path).resolve()), kind))
+    return state["series_version"].get(series, 0) if state else 0
+
+
+def last_changes(path, kind="raw"):
+    # series changed, added or removed by the last refresh of (path, kind); None after a full reload
+    state = _LIVE.get((str(Path(path).resolve()), kind))
+    return state["changed"] if state else None
+
+
+def _state_for(key, kind):
+    state = _LIVE.get((key[0], kind))
+    return state if state and state["key"] == key else None
+
+
+def _read_only(col):
+    values = col.to_numpy(copy=False) if isinstance(col.dtype, np.dtype) else None
+    return values is not None and not values.flags.writeable
+
+
+def _caller_copy(df):
+    # a frame callers may edit in place without writing into the cached one. Under pandas
+    # copy-on-write (always on from pandas 3) a shallow copy is enough; without it, only
+    # read-only columns (memory-mapped snapshot columns, which raise on writes) stay shared and
+    # every other column is copied
+    if pd.options.mode.copy_on_write is True:
+        return df.copy(deep=False)
+    return pd.DataFrame({name: col if _read_only(col) else col.copy() for name, col in df.items()}, copy=False)
+
+
+def load_frame(path, kind="raw"):
+    # kind: "option" (series parsed into type / strike / expiry), "future" (expiry fields) or "raw".
+    # Raises like json.loads(Path(path).read_text()) would, so pages keep their own error handling.
+    return _caller_copy(_frame_cached(file_key(path), kind))
+
+
+def load_option_market(path):
+    return load_frame(path, "option")
+
+
+def load_future_market(path):
+    return load_frame(path, "future")
+
+
+# last index built per table (or master) with the versions of its source tables, patched
+# instead of rebuilt on the next refresh
+_LAST_INDEX = {}
+
+
+def _patched_index(frame, sources):
+    # sources: (key, kind) of every table the frame was built from (key None = no file)
+    slot = tuple((key and key[0], kind) for key, kind in sources)
+    states = [_state_for(key, kind) if key is not None else None for key, kind in sources]
+    versions = tuple(state["version"] if state else None for state in states)
+    series = frame["Series"].to_numpy(dtype=object) if "Series" in frame.columns else np.empty(0, dtype=object)
+    prev, prev_versions = _LAST_INDEX.get(slot, (None, None))
+    index = None
+    if prev is not None and all(v is not None for v, (key, _) in zip(versions, sources) if key is not None) \
+            and np.array_equal(prev.series, series):
+        # rows of series that changed in any source since prev was built (series added or
+        # removed change the order and rebuild instead)
+        changed = set()
+        for state, built in zip(states, prev_versions):
+            if state is not None:
+                changed.update(s for s, v in state["series_version"].items() if built is None or v > built)
+        index = prev.patched(frame, sorted(prev.pos[s] for s in changed if s in prev.pos))
+    if index is None:
+        index = InstrumentIndex(frame)
+    _LAST_INDEX[slot] = (index, versions)
+    return index
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _index_cached(key, kind):
+    return _patched_index(_frame_cached(key, kind), [(key, kind)])
+
+
+def load_index(path, kind="raw"):
+    # Series -> row index over load_frame(path, kind), shared like the frame itself. Positions
+    # match the rows of load_frame(path, kind). A file that can't be read gives an empty index
+    # (the page reports the load error itself).
+    try:
+        return _index_cached(file_key(path), kind)
+    except (OSError, ValueError):
+        return InstrumentIndex(pd.DataFrame())
+
+
+# (kind, ...) of the four files behind an instrument master, in load_master's argument order
+MASTER_KINDS = ("option", "raw", "future", "raw")
+
+
+def _key_or_none(path):
+    if path is None:
+        return None
+    try:
+        return file_key(path)
+    except OSError:
+        return None
+
+
+def _frame_or_empty(key, kind):
+    if key is None:
+        return pd.DataFrame()
+    try:
+        return _frame_cached(key, kind)
+    except (OSError, ValueError):
+        return pd.DataFrame()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _master_cached(keys):
+    return build_master(*(_frame_or_empty(key, kind) for key, kind in zip(keys, MASTER_KINDS)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _master_index_cached(keys):
+    return _patched_index(_master_cached(keys), list(zip(keys, MASTER_KINDS)))
+
+
+def _master_keys(option_market, option_margin, future_market, future_margin):
+    return tuple(_key_or_none(p) for p in (option_market, option_margin, future_market, future_margin))
+
+
+def load_master(option_market, option_margin, future_market=None, future_margin=None):
+    # instruments.build_master over the four files, merged once per combination of file versions.
+    # Missing or unreadable files contribute no rows / no margins (the pages report those themselves).
+    return _caller_copy(_master_cached(_master_keys(option_market, option_margin, future_market, future_margin)))
+
+
+def load_master_index(option_market, option_margin, future_market=None, future_margin=None):
+    # InstrumentIndex over load_master(...) with the same arguments; positions match its rows
+    return _master_index_cached(_master_keys(option_market, option_margin, future_market, future_margin))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _resolver_cached(keys):
+    return TemplateResolver(_frame_or_empty(keys[0], "option"), _frame_or_empty(keys[1], "future"))
+
+
+def load_template_resolver(option_market, future_market=None):
+    # templates.TemplateResolver over load_option_market / load_future_market, built once per
+    # pair of file versions; unreadable files resolve no legs (the pages report those themselves)
+    return _resolver_cached((_key_or_none(option_market), _key_or_none(future_market)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compiled_templates_cached(key):
+    return CompiledTemplates(_read_json_cached(key))
+
+
+def load_compiled_templates(path):
+    # templates.CompiledTemplates of a template file, compiled once per file version; an
+    # unreadable file compiles to no templates. Shared, not copied: callers must not modify it.
+    try:
+        return _compiled_templates_cached(file_key(path))
+    except (OSError, ValueError):
+        return CompiledTemplates({})
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _matcher_cached(key):
+    return TemplateMatcher(_compiled_templates_cached(key))
+
+
+def load_template_matcher(path):
+    # templates.TemplateMatcher over a template file, built once per file version (and keeping its
+    # detections across reruns); an unreadable file matches nothing
+    try:
+        return _matcher_cached(file_key(path))
+    except (OSError, ValueError):
+        return TemplateMatcher(CompiledTemplates({}))
+
+
+def guess_kind(df):
+    # market files carry ExpiryDate; option chains have series longer than 7 characters
+    # (same rule as parse_expiry_code). Margin files and anything else stay "raw".
+    if df.empty or "Series" not in df.columns or "ExpiryDate" not in df.columns:
+        return "raw"
+    return "option" if df["Series"].astype(str).str.len().max() > 7 else "future"
+
+
+def compile_snapshot(path, kind=None):
+    # typed columnar snapshot of one JSON file, enriched like load_frame(path, kind)
+    key = file_key(path)
+    df = _raw_frame(key)
+    kind = kind or guess_kind(df)
+    df = _enrich(df, kind)
+    return write_snapshot(df, snapshot_dir(key[0]), key[1:], kind)
+
+
+if __name__ == "__main__":
+    import sys
+
+    for arg in sys.argv[1:]:
+        try:
+            print(compile_snapshot(arg))
+        except ValueError as e:
+            print(f"skipped {e}")
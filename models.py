@@ -0,0 +1,149 @@
+# models.py
+# Registry of batched option pricing models. Every model takes the same arrays
+# (type, strike, T, sigma, underlying) plus a scalar rf and returns prices with the
+# broadcast shape of its inputs, so the pages can swap models without touching the
+# position code:
+#   Black-Scholes  - European, underlying = spot (pricing.bs_price)
+#   Black-76       - European on the futures price; SET50 options settle against the
+#                    index, so the S50 futures give the market forward for each expiry
+#   Binomial (CRR) - American exercise on spot, a vectorized Cox-Ross-Rubinstein tree
+# spot_pricer() adapts a model to the spot-based signature used by pricing.position_payoff.
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+from pricing import bs_price, chain_quote_price, intrinsic_value, years_to_expiry
+
+BINOMIAL_STEPS = 100
+CRR_CHUNK = 1024
+
+PRICING_MODELS = {}
+
+
+def register_model(name, on_forward=False):
+    # on_forward: the model's underlying is the futures price for the leg's expiry, not spot
+    def deco(fn):
+        PRICING_MODELS[name] = {"price": fn, "on_forward": on_forward}
+        return fn
+    return deco
+
+
+@register_model("Black-Scholes")
+def black_scholes(opt_type, K, T, sigma, underlying, rf):
+    return bs_price(opt_type, underlying, K, T, rf, sigma)
+
+
+@register_model("Black-76", on_forward=True)
+def black_76(opt_type, K, T, sigma, underlying, rf):
+    # e^{-rT} [w F N(w d1) - w K N(w d2)]; T <= 0 or no vol -> intrinsic on F
+    is_call, F, K, T, sigma = np.broadcast_arrays(
+        np.asarray(opt_type) == "Call", np.asarray(underlying, dtype=float),
+        np.asarray(K, dtype=float), np.asarray(T, dtype=float), np.asarray(sigma, dtype=float))
+    live = ~((T <= 0) | (sigma <= 0) | np.isnan(sigma))
+    T_ = np.where(live, T, 1.0)
+    sig = np.where(live, sigma, 1.0)
+    vol = sig * np.sqrt(T_)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(F / K) + 0.5 * vol**2) / vol
+    w = np.where(is_call, 1.0, -1.0)
+    price = np.exp(-rf * T_) * w * (F * ndtr(w * d1) - K * ndtr(w * (d1 - vol)))
+    out = np.where(live, price, intrinsic_value(np.where(is_call, "Call", "Put"), F, K))
+    return float(out) if out.ndim == 0 else out
+
+
+def _crr_tree(S, K, w, T, sigma, rf, steps):
+    # 1-D option arrays in, root values out. The lattice is laid out (nodes, options) so every
+    # backward step works on contiguous leading rows, updated in place. Node j at step i sits
+    # at S u^(i - 2j), which is node j + 1 of step i + 1 times u, so the asset rows roll back
+    # without an exp per node.
+    dt = T / steps
+    u = np.exp(sigma * np.sqrt(dt))
+    inv_u = 1.0 / u
+    disc = np.exp(-rf * dt)
+    p_up = disc * (np.exp(rf * dt) - inv_u) / (u - inv_u)
+    p_dn = disc - p_up
+    asset = S * np.exp(np.outer(steps - 2 * np.arange(steps + 1), np.log(u)))
+    values = np.maximum(w * (asset - K), 0.0)
+    tmp = np.empty_like(values)
+    for i in range(steps - 1, -1, -1):
+        a, v, t = asset[1:i + 2], values[:i + 1], tmp[:i + 1]
+        a *= u
+        np.multiply(p_dn, values[1:i + 2], out=t)
+        v *= p_up
+        v += t
+        np.subtract(a, K, out=t)
+        t *= w
+        np.maximum(v, t, out=v)
+        asset = asset[1:]
+    return values[0]
+
+
+@register_model("Binomial (CRR, American)")
+def binomial_crr(opt_type, K, T, sigma, underlying, rf, steps=BINOMIAL_STEPS):
+    # every option in the batch walks its own tree at once: backward induction is one
+    # vectorized pass per time step across the whole batch. Averaging the steps and
+    # steps + 1 trees cancels CRR's odd/even oscillation, which keeps bumped Greeks smooth.
+    shape = np.broadcast(np.asarray(opt_type), np.asarray(underlying), np.asarray(K), np.asarray(T), np.asarray(sigma)).shape
+    is_call, S, K, T, sigma = (np.ravel(a) for a in np.broadcast_arrays(
+        np.asarray(opt_type) == "Call", np.asarray(underlying, dtype=float),
+        np.asarray(K, dtype=float), np.asarray(T, dtype=float), np.asarray(sigma, dtype=float)))
+    w = np.where(is_call, 1.0, -1.0)
+    out = np.maximum(w * (S - K), 0.0)
+    live = np.flatnonzero(~((T <= 0) | (sigma <= 0) | np.isnan(sigma)))
+    # chunks of CRR_CHUNK options keep each lattice cache-sized
+    for start in range(0, live.size, CRR_CHUNK):
+        idx = live[start:start + CRR_CHUNK]
+        args = (S[idx], K[idx], w[idx], T[idx], sigma[idx], rf)
+        out[idx] = 0.5 * (_crr_tree(*args, steps) + _crr_tree(*args, steps + 1))
+    out = out.reshape(shape)
+    return float(out) if out.ndim == 0 else out
+
+
+def futures_basis(df_futures, today=None):
+    # (T, ln(F / S)) per listed futures expiry, sorted by T; quotes as in chain_quote_price
+    if df_futures is None or df_futures.empty:
+        return np.empty(0), np.empty(0)
+    F, _ = chain_quote_price(df_futures)
+    S = pd.to_numeric(df_futures["UNDERLYING PRICE"], errors="coerce").to_numpy(dtype=float)
+    T = years_to_expiry(df_futures["ExpiryDate"].to_numpy(dtype=object), today)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_basis = np.log(F / S)
+    ok = np.isfinite(log_basis) & (T > 0)
+    order = np.argsort(T[ok])
+    return T[ok][order], log_basis[ok][order]
+
+
+def forward_ratio(basis, T, rf):
+    # F / S for times T: futures basis interpolated from zero at T = 0 (flat beyond the last
+    # listed expiry), or cost of carry e^{rT} when no futures are available
+    T = np.asarray(T, dtype=float)
+    basis_T, log_basis = basis if basis is not None else (np.empty(0), np.empty(0))
+    if not basis_T.size:
+        return np.exp(rf * T)
+    return np.exp(np.interp(T, np.concatenate([[0.0], basis_T]), np.concatenate([[0.0], log_basis])))
+
+
+def spot_pricer(model, basis=None):
+    # price_fn(opt_type, S, K, T, rf, sigma) for the chosen model, as expected by pricing.position_payoff;
+    # forward-based models see S scaled by the futures basis for each leg's T.
+    # The same (model, basis) always returns the same function object, so per-leg caches keyed
+    # on price_fn keep hitting across reruns.
+    basis_key = None if basis is None else tuple(np.asarray(b, dtype=float).tobytes() for b in basis)
+    return _spot_pricer(model, basis_key)
+
+
+@lru_cache(maxsize=32)
+def _spot_pricer(model, basis_key):
+    entry = PRICING_MODELS[model]
+    if model == "Black-Scholes":
+        return bs_price
+    basis = None if basis_key is None else tuple(np.frombuffer(b, dtype=float) for b in basis_key)
+    if entry["on_forward"]:
+        def price_fn(opt_type, S, K, T, rf, sigma):
+            return entry["price"](opt_type, K, T, sigma, np.asarray(S, dtype=float) * forward_ratio(basis, T, rf), rf)
+    else:
+        def price_fn(opt_type, S, K, T, rf, sigma):
+            return entry["price"](opt_type, K, T, sigma, S, rf)
+    return price_fn
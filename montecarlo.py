@@ -0,0 +1,165 @@
+# montecarlo.py
+# Monte Carlo P/L engine for a df_legs position: simulates the underlying (lognormal or
+# bootstrapped from historical returns), marks every leg on every path and monitoring date,
+# and reports the P/L distribution and margin-breach probabilities.
+# Paths are generated chunk by chunk, CHUNK_CELLS paths x monitoring dates at a time, so memory
+# stays bounded for 1M+ paths whatever the number of dates. On each
+# monitoring date the value of the still-live option legs depends on spot only, so it is
+# priced once on a dense uniform spot grid and paths are interpolated onto it instead of
+# running Black-Scholes per path. Futures and legs without vol are piecewise linear and are
+# evaluated exactly on every path. Option expiries inside the horizon are added to the
+# monitoring dates; from its expiry on, a leg keeps the payoff it settled at on that path.
+
+import numpy as np
+import pandas as pd
+
+from pricing import bs_price, leg_arrays, years_to_expiry
+
+GRID_POINTS = 2048
+CHUNK_CELLS = 2_000_000  # paths x monitoring dates per chunk (16 MB per float array)
+
+
+def _horizon_years(df_legs, today=None):
+    # default horizon: first expiry among the legs (30 days if none is known)
+    exp = df_legs.loc[df_legs["Type"].isin(("Call", "Put", "Future")), "Expiry"].dropna()
+    if exp.empty:
+        return 30 / 365.0
+    T = years_to_expiry(exp.to_numpy(dtype=object), today)
+    T = T[T > 0]
+    return float(T.min()) if T.size else 1 / 365.0
+
+
+def _lognormal_chunk(rng, n, S0, drift, sigma, dt, antithetic):
+    # paths are laid out (dates, n) so each monitoring date is a contiguous row; dt: year
+    # fraction from the previous date, per date
+    half = (n + 1) // 2 if antithetic else n
+    z = rng.standard_normal((dt.size, half))
+    if antithetic:
+        z = np.concatenate([z, -z], axis=1)[:, :n]
+    log_steps = (drift - 0.5 * sigma**2) * dt[:, None] + sigma * np.sqrt(dt)[:, None] * z
+    return S0 * np.exp(np.cumsum(log_steps, axis=0))
+
+
+def _bootstrap_chunk(rng, n, S0, returns, days, antithetic):
+    # each monitoring step sums days[j] daily log returns drawn with replacement; the
+    # antithetic twin mirrors the draws around the historical mean
+    half = (n + 1) // 2 if antithetic else n
+    draws = np.empty((days.size, n))
+    for j, d in enumerate(days):
+        step = returns[rng.integers(0, returns.size, size=(half, d))].sum(axis=1)
+        if antithetic:
+            step = np.concatenate([step, 2.0 * returns.mean() * d - step])[:n]
+        draws[j] = step
+    return S0 * np.exp(np.cumsum(draws, axis=0))
+
+
+def _intrinsic(opt_type, S, K):
+    return np.maximum(S - K, 0.0) if opt_type == "Call" else np.maximum(K - S, 0.0)
+
+
+def _live_value_grid(legs, multiplier, rf, T_left, live, lo, hi):
+    # P/L of the live (smooth) option legs on a uniform spot grid for every monitoring date
+    grid = np.linspace(lo, hi, GRID_POINTS)
+    prices = bs_price(legs["type"].reshape(-1, 1, 1), grid.reshape(1, 1, -1), legs["strike"].reshape(-1, 1, 1),
+                      T_left[:, :, None], rf, legs["sigma"].reshape(-1, 1, 1))
+    weight = np.where(live, legs["qty"].reshape(-1, 1) * multiplier, 0.0)[:, :, None]
+    return ((prices - legs["premium"].reshape(-1, 1, 1)) * weight).sum(axis=0)
+
+
+def _interp_uniform(x, lo, hi, values):
+    # linear interpolation on a uniform grid by direct indexing (no binary search)
+    pos = (x - lo) * ((values.size - 1) / (hi - lo)) if hi > lo else np.zeros_like(x)
+    i = np.clip(pos.astype(np.intp), 0, values.size - 2)
+    return values[i] + (pos - i) * (values[i + 1] - values[i])
+
+
+def simulate_position(df_legs, S0, multiplier, rf, sigma=None, returns=None,
+                      init_balance=0.0, total_IM=0.0, total_MM=0.0,
+                      n_paths=100_000, n_steps=20, horizon=None, drift=None,
+                      vol_shift_pct=0.0, chunk_cells=CHUNK_CELLS, antithetic=True, seed=42, today=None):
+    # sigma: annual vol for lognormal paths; returns: daily historical log returns -> bootstrap.
+    # horizon (years) defaults to the first leg expiry. n_steps equally spaced monitoring dates,
+    # plus every option expiry before the horizon. Equity on each monitoring date is
+    # init_balance + mark-to-market P/L; a path "breaches" MM / IM if equity drops below it on
+    # any date up to the horizon (same thresholds as the page's Broke-point Analysis).
+    if sigma is None and returns is None:
+        raise ValueError("need either sigma (lognormal) or returns (bootstrap)")
+    horizon = _horizon_years(df_legs, today) if horizon is None else float(horizon)
+    drift = rf if drift is None else drift
+    legs = leg_arrays(df_legs, 1.0, vol_shift_pct, today)
+    expiring = legs["T"][(legs["T"] > 0) & (legs["T"] < horizon)]
+    t_steps = np.unique(np.concatenate([horizon / n_steps * np.arange(1, n_steps + 1), expiring]))
+    dt = np.diff(t_steps, prepend=0.0)
+    if returns is not None:
+        returns = np.asarray(returns, dtype=float)
+        returns = returns[np.isfinite(returns)]
+        if not returns.size:
+            raise ValueError("returns has no finite values")
+        # trading days per step, carried over so the steps add up to the horizon's days
+        days = np.diff(np.round(t_steps * 252).astype(np.intp), prepend=0)
+        cells = max(int(days.max()), 1)
+    else:
+        cells = 1
+    chunk_size = max(1, chunk_cells // (t_steps.size * cells))
+
+    futs = df_legs[df_legs["Type"] == "Future"]
+    fut_qty = float(futs["Qty"].sum()) if not futs.empty else 0.0
+    fut_cost = float((futs["Qty"] * pd.to_numeric(futs["TradePrice"], errors="coerce")).sum()) if not futs.empty else 0.0
+    # remaining time per (leg, monitoring date); legs with no time or no vol are priced at intrinsic
+    T_left = np.maximum(legs["T"].reshape(-1, 1) - t_steps.reshape(1, -1), 0.0)
+    live = (T_left > 0) & (legs["sigma"].reshape(-1, 1) > 0)
+    # monitoring date each leg settles on (legs already expired settle at S0, before date 0)
+    settle = np.where(legs["T"] > 0, np.searchsorted(t_steps, legs["T"]), -1)
+    intrinsic_legs = np.flatnonzero(~live.all(axis=1))
+
+    rng = np.random.default_rng(seed)
+    pnl_terminal = np.empty(n_paths)
+    worst_equity = np.empty(n_paths)
+    done = 0
+    while done < n_paths:
+        n = min(chunk_size, n_paths - done)
+        if returns is None:
+            paths = _lognormal_chunk(rng, n, S0, drift, sigma, dt, antithetic)
+        else:
+            paths = _bootstrap_chunk(rng, n, S0, returns, days, antithetic)
+
+        lo, hi = float(paths.min()), float(paths.max())
+        smooth = _live_value_grid(legs, multiplier, rf, T_left, live, lo, hi) if live.any() else None
+        settled = {i: np.broadcast_to(_intrinsic(legs["type"][i], float(S0), legs["strike"][i]), (n,))
+                   for i in intrinsic_legs if settle[i] < 0}
+        worst = np.full(n, np.inf)
+        for j in range(t_steps.size):
+            S_j = paths[j]
+            pnl_j = (S_j * fut_qty - fut_cost) * multiplier
+            if smooth is not None:
+                pnl_j += _interp_uniform(S_j, lo, hi, smooth[j])
+            for i in intrinsic_legs:
+                if live[i, j]:
+                    continue
+                if i in settled:
+                    value = settled[i]
+                else:
+                    value = _intrinsic(legs["type"][i], S_j, legs["strike"][i])
+                    if j == settle[i]:
+                        settled[i] = value
+                pnl_j += (value - legs["premium"][i]) * legs["qty"][i] * multiplier
+            np.minimum(worst, pnl_j, out=worst)
+
+        pnl_terminal[done:done + n] = pnl_j
+        worst_equity[done:done + n] = init_balance + worst
+        done += n
+
+    losses = np.sort(pnl_terminal)
+    tail = max(1, int(np.ceil(0.05 * n_paths)))
+    return {
+        "pnl": pnl_terminal,
+        "horizon_days": horizon * 365.0,
+        "mean": float(pnl_terminal.mean()),
+        "std": float(pnl_terminal.std()),
+        "prob_profit": float((pnl_terminal > 0).mean()),
+        "var_95": float(-losses[tail - 1]),
+        "es_95": float(-losses[:tail].mean()),
+        "percentiles": dict(zip((1, 5, 25, 50, 75, 95, 99), np.percentile(pnl_terminal, [1, 5, 25, 50, 75, 95, 99]))),
+        "prob_margin_call": float((worst_equity < total_MM).mean()),
+        "prob_stop_out": float((worst_equity < total_IM).mean()),
+    }
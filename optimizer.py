@@ -0,0 +1,195 @@
+# optimizer.py
+# Strike-combination optimizer: searches leg combinations of one expiry of the loaded chain for
+# the best expected expiry P/L per unit of capital under a market view, within a margin budget
+# and a max-loss cap.
+# A view is a spot grid with probability weights (range_view: uniform over a price range;
+# lognormal_view: lognormal around a target price). Expected P/L is linear in the legs, so each
+# signed leg's expectation is computed once and a combination's is a sum. Combinations are grown
+# one leg at a time in series order (one qty per series); a partial combination is dropped when
+# its IM already exceeds the budget (IM only grows) or when even the best remaining legs cannot
+# lift its expectation above min_expected. At most MAX_FRONTIER partial combinations are carried
+# to the next depth: past that, the parents with the highest optimistic expectation (own plus the
+# best remaining legs) are kept and the rest counted in stats["truncated"], so very wide searches
+# become a beam search instead of exhausting memory; searches above MAX_SPACE are refused.
+# Survivors get max loss / breakevens from scanner.expiry_metrics in batches; the cap and the
+# budget are applied on those exact values.
+# Capital is IM plus the net premium paid (long options carry no IM here, their cost is cash).
+# Short options and futures with no margin record cannot be costed and are left out as legs, and
+# only series with a last or two-sided quote are candidates (ChainScan.price, zero = no quote).
+
+import numpy as np
+import pandas as pd
+
+from scanner import expiry_metrics
+
+GRID_POINTS = 201
+EVAL_BATCH = 50_000  # combinations per expiry_metrics call
+MAX_FRONTIER = 200_000  # partial combinations carried from one depth to the next
+MAX_SPACE = 10**9  # largest search space accepted
+RESULT_COLUMNS = ["Legs", "ExpectedPL", "Capital", "ExpectedReturn", "ProbProfit", "NetPremium", "MaxProfit",
+                  "MaxLoss", "Breakevens", "IM", "MM", "Fees"]
+
+
+def range_view(low, high, points=GRID_POINTS):
+    # (spots, weights): the underlying equally likely anywhere in [low, high]
+    low, high = sorted((float(low), float(high)))
+    return np.linspace(low, high, points), np.full(points, 1.0 / points)
+
+
+def lognormal_view(target, vol, days, points=GRID_POINTS, width=4.0):
+    # (spots, weights): lognormal expiry price with median `target` and annual vol `vol`
+    # (fraction) over `days`, on a grid of +-width standard deviations
+    sd = max(float(vol) * np.sqrt(max(days, 0) / 365.0), 1e-6)
+    z = np.linspace(-width, width, points)
+    weights = np.exp(-0.5 * z**2)
+    return float(target) * np.exp(sd * z), weights / weights.sum()
+
+
+def _candidate_positions(chain, exp_pos, center, strike_window, use_futures):
+    # master positions of the quoted series (price > 0) of one expiry: options within
+    # strike_window strikes of center (all strikes when None), then its future
+    lo, hi = 0, len(chain.strikes)
+    if strike_window is not None:
+        mid = int(np.searchsorted(chain.strikes, center))
+        lo, hi = max(mid - strike_window, 0), min(mid + strike_window, hi)
+    rows = chain.exact[:, lo:hi, exp_pos].T.ravel() if chain.exact.size else np.empty(0, dtype=np.intp)
+    pos = chain.option_pos[rows[rows >= 0]]
+    if use_futures and chain.future_pos.size and chain.future_pos[exp_pos] >= 0:
+        pos = np.append(pos, chain.future_pos[exp_pos])
+    pos = pos[pos >= 0]
+    return pos[np.nan_to_num(chain.price[pos]) > 0]
+
+
+def _space(legs_per_series, max_legs):
+    # combinations of 1..max_legs legs on distinct series (elementary symmetric sums)
+    e = [1] + [0] * max_legs
+    for c in legs_per_series:
+        for k in range(max_legs, 0, -1):
+            e[k] += e[k - 1] * int(c)
+    return sum(e[1:])
+
+
+def _suffix_best(best, max_legs):
+    # out[r, p]: sum of the r largest values of best[p:]
+    out = np.zeros((max_legs + 1, len(best) + 1))
+    for p in range(len(best)):
+        top = np.sort(best[p:])[::-1][:max_legs]
+        out[1:len(top) + 1, p] = np.cumsum(top)
+        out[len(top) + 1:, p] = out[len(top), p]
+    return out
+
+
+def optimize_strikes(chain, view, expiry, budget, max_loss=None, max_legs=4, max_qty=1, strike_window=8,
+                     use_futures=False, min_expected=0.0, top=50):
+    # best leg combinations of the chain's expiry `expiry` under view = (spots, weights), ranked
+    # by ExpectedReturn (expected P/L net of fees / capital), columns RESULT_COLUMNS.
+    # chain: scanner.ChainScan. budget: capital ceiling (the page's init_balance). max_loss: cap
+    # on the expiry loss as a positive amount (None: any bounded or unbounded loss). Legs hold
+    # 1..max_qty contracts long or short, at most one qty per series. Returns (frame, stats)
+    # with stats = {"space": combinations in the search space, "evaluated": scored exactly,
+    # "truncated": partial combinations dropped by the frontier cap, "no_margin": series whose
+    # charged legs were left out for a missing IM}. Raises ValueError when space > MAX_SPACE.
+    spots, weights = (np.asarray(a, dtype=float) for a in view)
+    exp_pos = int(np.searchsorted(chain.expiries, expiry))
+    empty = pd.DataFrame(columns=RESULT_COLUMNS), {"space": 0, "evaluated": 0, "truncated": 0, "no_margin": 0}
+    if exp_pos >= len(chain.expiries) or chain.expiries[exp_pos] != expiry or not spots.size:
+        return empty
+    pos = _candidate_positions(chain, exp_pos, float(np.dot(spots, weights)), strike_window, use_futures)
+    if not pos.size:
+        return empty
+    types, price = chain.type[pos], chain.price[pos]
+    is_opt = types != 2
+    strike = np.where(is_opt, chain.strike[pos], 0.0)
+    fee = np.where(is_opt, chain.fee_option, chain.fee_future) * 2
+
+    # per series: P/L of one long contract on the spot grid (before fees) and its expectation
+    S = spots[None, :]
+    unit = chain.multiplier * (np.where(types[:, None] == 0, np.maximum(S - strike[:, None], 0.0),
+                               np.where(types[:, None] == 1, np.maximum(strike[:, None] - S, 0.0), S)) - price[:, None])
+    unit_mean = unit @ weights
+
+    # signed legs, grouped by series; charged legs (short options, futures) need a known IM
+    qtys = np.array([q for q in range(-max_qty, max_qty + 1) if q], dtype=float)
+    leg_series = np.repeat(np.arange(len(pos)), len(qtys))
+    leg_qty = np.tile(qtys, len(pos))
+    charged = ~is_opt[leg_series] | (leg_qty < 0)
+    priced = ~charged | np.isfinite(chain.im[pos][leg_series])
+    no_margin = int(np.unique(leg_series[~priced]).size)
+    leg_series, leg_qty, charged = leg_series[priced], leg_qty[priced], charged[priced]
+    leg_mean = leg_qty * unit_mean[leg_series] - np.abs(leg_qty) * fee[leg_series]
+    leg_im = np.where(charged, np.abs(leg_qty) * chain.im[pos][leg_series], 0.0)
+    space = _space(np.bincount(leg_series, minlength=len(pos)), max_legs)
+    if space > MAX_SPACE:
+        raise ValueError(f"search space of {space:,} combinations exceeds {MAX_SPACE:,}; "
+                         "narrow the strike window or lower max legs / max qty")
+    best = np.zeros(len(pos))
+    np.maximum.at(best, leg_series, np.maximum(leg_mean, 0.0))
+    bound = _suffix_best(best, max_legs)
+    # legs on a later series than each series, i.e. children of a partial combination ending there
+    after = len(leg_series) - np.searchsorted(leg_series, np.arange(len(pos)), side="right")
+
+    # grow combinations one leg at a time; finished[k]: (legs, expectation) of every k-leg
+    # combination within budget whose expectation clears min_expected
+    combos = np.arange(len(leg_series))[:, None]
+    mean, im, last = leg_mean.copy(), leg_im.copy(), leg_series.copy()
+    finished, truncated = [], 0
+    for k in range(1, max_legs + 1):
+        within = im <= budget
+        done = within & (mean > min_expected)
+        finished.append((combos[done], mean[done]))
+        if k == max_legs:
+            break
+        reach = mean + bound[max_legs - k, last + 1]
+        alive = np.flatnonzero(within & (reach > min_expected))
+        if after[last[alive]].sum() > MAX_FRONTIER:
+            order = alive[np.argsort(-reach[alive], kind="stable")]
+            keep = int(np.searchsorted(np.cumsum(after[last[order]]), MAX_FRONTIER, side="right"))
+            truncated += len(order) - keep
+            alive = np.sort(order[:keep])
+        combos, mean, im, last = combos[alive], mean[alive], im[alive], last[alive]
+        parent, leg = np.nonzero(leg_series[None, :] > last[:, None])
+        combos = np.column_stack([combos[parent], leg])
+        mean, im, last = mean[parent] + leg_mean[leg], im[parent] + leg_im[leg], leg_series[leg]
+
+    # exact expiry metrics for the survivors, legs padded to max_legs with qty 0
+    legs = np.vstack([np.pad(c, ((0, 0), (0, max_legs - c.shape[1])), constant_values=-1) for c, _ in finished])
+    mean = np.concatenate([m for _, m in finished])
+    stats = {"space": space, "evaluated": len(legs), "truncated": truncated, "no_margin": no_margin}
+    if not len(legs):
+        return pd.DataFrame(columns=RESULT_COLUMNS), stats
+    pad = legs < 0
+    series = np.where(pad, 0, leg_series[np.maximum(legs, 0)])
+    qty = np.where(pad, 0.0, leg_qty[np.maximum(legs, 0)])
+    batch = [np.where(pad, -1, types[series]), np.where(pad, 0.0, strike[series]), qty, np.where(pad, 0.0, price[series])]
+    parts = [expiry_metrics(*(a[i:i + EVAL_BATCH] for a in batch), chain.multiplier) for i in range(0, len(legs), EVAL_BATCH)]
+    max_profit, worst, premium = (np.concatenate([p[j] for p in parts]) for j in range(3))
+    breakevens = [row for p in parts for row in p[3]]
+    im = np.sum(np.where(pad, 0.0, leg_im[np.maximum(legs, 0)]), axis=1)
+    capital = im + np.maximum(premium, 0.0)
+    ok = (capital <= budget) & (capital > 0) & np.isfinite(worst)
+    if max_loss is not None:
+        ok &= worst >= -max_loss
+    ok = np.flatnonzero(ok)
+    ret = mean[ok] / capital[ok]
+    pick = ok[np.argsort(-ret, kind="stable")[:top]] if top else ok[np.argsort(-ret, kind="stable")]
+
+    # probability of a net profit under the view, for the reported combinations only
+    pnl = np.einsum("ij,ijk->ik", qty[pick], unit[series[pick]]) - np.sum(np.abs(qty[pick]) * fee[series[pick]], axis=1)[:, None]
+    mm = np.sum(np.where(pad[pick] | ~charged[np.maximum(legs[pick], 0)], 0.0,
+                         np.abs(qty[pick]) * np.nan_to_num(chain.mm[pos][series[pick]])), axis=1)
+    names = chain.series[pos]
+    return pd.DataFrame({
+        "Legs": [" / ".join(f"{int(q):+d} {names[s]}" for s, q, p in zip(srow, qrow, prow) if not p)
+                 for srow, qrow, prow in zip(series[pick], qty[pick], pad[pick])],
+        "ExpectedPL": mean[pick],
+        "Capital": capital[pick],
+        "ExpectedReturn": mean[pick] / capital[pick],
+        "ProbProfit": (pnl > 0) @ weights,
+        "NetPremium": premium[pick],
+        "MaxProfit": max_profit[pick],
+        "MaxLoss": worst[pick],
+        "Breakevens": [tuple(float(b) for b in breakevens[i][~np.isnan(breakevens[i])]) for i in pick],
+        "IM": im[pick],
+        "MM": mm,
+        "Fees": np.sum(np.abs(qty[pick]) * fee[series[pick]], axis=1),
+    }, columns=RESULT_COLUMNS), stats
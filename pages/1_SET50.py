@@ -5,16 +5,23 @@ import json
 from pathlib import Path
 
 import re
-import calendar
 from datetime import date
 import streamlit as st
 import matplotlib.pyplot as plt
-from scipy.stats import norm
-import itertools
 import sys
 from supabase import create_client
 # Add parent directory (app/) to Python path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from market_data import file_key, load_frame, load_future_market, load_master, load_master_index, load_option_market, load_compiled_templates, load_template_matcher, load_template_resolver, market_version, read_json
+from pricing import GREEKS, chain_implied_vols, position_payoff_greeks, position_pnl_grid
+from models import PRICING_MODELS, futures_basis, spot_pricer
+from history import daily_log_returns, history_dir
+from montecarlo import simulate_position
+from payoff import PiecewisePayoff
+from optimizer import lognormal_view, optimize_strikes, range_view
+from scanner import RESULT_COLUMNS, ChainScan, rank_instances, scan_chain
+from scenarios import scenario_cube
+from vol_surface import fit_vol_surface, surface_iv
 # --- Setup Supabase ---
 # --- Setup Supabase ---
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
@@ -56,81 +63,6 @@ def parse_num(x):
         except: return np.nan
     return np.nan
 
-def leg_type_from_series(series):
-    if not isinstance(series,str): return (None, np.nan)
-    if 'C' in series:
-        idx = series.rfind('C'); opt = 'Call'
-    elif 'P' in series:
-        idx = series.rfind('P'); opt = 'Put'
-    else:
-        return (None, np.nan)
-    strike_part = series[idx+1:]
-    try:
-        strike = float(strike_part)
-    except:
-        digits = ''.join(ch for ch in series if ch.isdigit())
-        strike = float(digits) if digits else np.nan
-    return (opt, strike)
-
-def choose_price_from_row(row):
-    last = parse_num(row.get('Last')) if isinstance(row, dict) else parse_num(row.Last)
-    bid = parse_num(row.get('Bid')) if isinstance(row, dict) else parse_num(getattr(row, "Bid", None))
-    offer = parse_num(row.get('Offer')) if isinstance(row, dict) else parse_num(getattr(row, "Offer", None))
-    if not np.isnan(last): return last
-    if not np.isnan(bid) and not np.isnan(offer): return (bid + offer) / 2.0
-    if not np.isnan(bid): return bid
-    if not np.isnan(offer): return offer
-    return np.nan
-
-def payoff_for_leg_intrinsic(opt_type, K, qty, premium, multiplier, S_arr):
-    if opt_type == 'Call':
-        intrinsic = np.maximum(S_arr - K, 0.0)
-    elif opt_type == 'Put':
-        intrinsic = np.maximum(K - S_arr, 0.0)
-    else:  # Future
-        intrinsic = S_arr
-    return (intrinsic - premium) * qty * multiplier
-
-def bs_price(opt_type, S, K, T, rf, sigma):
-    if T <= 0 or sigma <= 0 or np.isnan(sigma):
-        return max(S - K, 0.0) if opt_type == 'Call' else max(K - S, 0.0)
-    d1 = (np.log(S / K) + (rf + 0.5 * sigma**2) * T) / (sigma * np.sqrt(T))
-    d2 = d1 - sigma * np.sqrt(T)
-    if opt_type == 'Call':
-        return S * norm.cdf(d1) - K * np.exp(-rf * T) * norm.cdf(d2)
-    else:
-        return K * np.exp(-rf * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
-
-def payoff_for_leg_bs(opt_type, K, qty, premium, multiplier, S_arr, T, rf, sigma):
-    prices = np.array([bs_price(opt_type, s, K, T, rf, sigma) for s in S_arr])
-    return (prices - premium) * qty * multiplier
-
-# expiry parsing (month letter + 2-digit year)
-EXPIRY_ORDER = "FGHJKMNQUVXZ"
-MONTH_MAP = {"F":1,"G":2,"H":3,"J":4,"K":5,"M":6,"N":7,"Q":8,"U":9,"V":10,"X":11,"Z":12}
-def parse_expiry_code(series):
-    if not isinstance(series,str): return (None, np.nan, None)
-    if len(series) <= 7:
-        #future
-        letter = series[-3]
-        year2 = series[-2:]
-    else:
-        #option series
-        clean_series = series[:-4]
-        letter = clean_series[-3]
-        year2 = clean_series[-2:]
-    # m = re.search(r'([FGHJKMNQUVXZ])(\d{2})', series)
-    # if not m: return (None, np.nan, None)
-    # letter, year2 = m.group(1), m.group(2)
-    month = MONTH_MAP.get(letter, 1)
-    year = 2000 + int(year2)
-    cal = calendar.Calendar(firstweekday=0)
-    fridays = [d for d in cal.itermonthdates(year, month) if d.month == month and d.weekday() == 4]
-    # pick 3rd Friday if present else fallback to middle of month
-    expiry_date = fridays[2] if len(fridays) >= 3 else date(year, month, min(15,28))
-    idx = EXPIRY_ORDER.index(letter) + int(year2) * 12
-    return (letter + year2, idx, expiry_date)
-
 def years_to_expiry(expiry_date, today=None):
     if expiry_date is None or pd.isna(expiry_date): return np.nan
     today = today or date.today()
@@ -159,58 +91,43 @@ with st.sidebar.expander("Data file paths (change if needed)"):
 
 # load strategy json
 try:
-    STRATEGY_TEMPLATES = json.loads(TEMPLATE_PATH.read_text(encoding="utf-8"))
+    STRATEGY_TEMPLATES = read_json(TEMPLATE_PATH)
 except Exception as e:
     STRATEGY_TEMPLATES = {}
     st.warning(f"Couldn't load strategy JSON: {e}")
 
 # load option market
 try:
-    df_market = pd.DataFrame(json.loads(OPTION_MARKET_PATH.read_text(encoding="utf-8")))
-    df_market.columns = [c.strip() for c in df_market.columns]
+    # parsed once per file version and shared across sessions (TypeParsed, Strike, ExpiryCode, ExpiryIndex, ExpiryDate)
+    df_market = load_option_market(OPTION_MARKET_PATH)
 except Exception as e:
     st.error(f"Cannot read option market JSON: {e}")
     st.stop()
 
-# parse numeric-ish columns where present
-# for col in df_market.columns:
-#     if col not in ("Series","Name","Contract Month","Contract Year"):
-#         df_market[col] = df_market[col].apply(parse_num)
-
-# add parsed fields: TypeParsed, Strike, ExpiryIndex, ExpiryDate
-parsed = df_market["Series"].apply(leg_type_from_series)
-df_market["TypeParsed"] = parsed.apply(lambda x: x[0])
-df_market["Strike"] = parsed.apply(lambda x: x[1])
-eparse = df_market["Series"].apply(parse_expiry_code)
-df_market["ExpiryCode"] = eparse.apply(lambda x: x[0])
-df_market["ExpiryIndex"] = eparse.apply(lambda x: x[1])
-# df_market["ExpiryDate"] = eparse.apply(lambda x: x[2])
-df_market['ExpiryDate'] = pd.to_datetime(df_market['ExpiryDate']).dt.date
-
 # load future market (optional)
 try:
-    df_market_Future = pd.DataFrame(json.loads(FUTURE_MARKET_PATH.read_text(encoding="utf-8")))
-    # for col in df_market_Future.columns:
-    #     if col != "Series":
-    #         df_market_Future[col] = df_market_Future[col].apply(parse_num)
-    eparse_f = df_market_Future["Series"].apply(parse_expiry_code)
-    df_market_Future["ExpiryCode"] = eparse_f.apply(lambda x: x[0])
-    df_market_Future["ExpiryIndex"] = eparse_f.apply(lambda x: x[1])
-    # df_market_Future["ExpiryDate"] = eparse_f.apply(lambda x: x[2])
-    df_market_Future['ExpiryDate'] = pd.to_datetime(df_market_Future['ExpiryDate']).dt.date
+    df_market_Future = load_future_market(FUTURE_MARKET_PATH)
 except Exception:
     df_market_Future = pd.DataFrame()
 
 # margins
 try:
-    df_margin = pd.DataFrame(json.loads(OPTION_MARGIN_PATH.read_text(encoding="utf-8")))
+    df_margin = load_frame(OPTION_MARGIN_PATH)
 except Exception:
     df_margin = pd.DataFrame()
 try:
-    df_margin_Future = pd.DataFrame(json.loads(FUTURE_MARGIN_PATH.read_text(encoding="utf-8")))
+    df_margin_Future = load_frame(FUTURE_MARGIN_PATH)
 except Exception:
     df_margin_Future = pd.DataFrame()
 
+# instrument master: one row per tradable series with quotes, parsed fields and margins joined
+# once per file version; the leg loop gathers rows from it through the Series index
+df_master = load_master(OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+master_index = load_master_index(OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+template_resolver = load_template_resolver(OPTION_MARKET_PATH, FUTURE_MARKET_PATH)
+compiled_templates = load_compiled_templates(TEMPLATE_PATH)
+template_matcher = load_template_matcher(TEMPLATE_PATH)
+
 # JSON preview for templates (stringify nested fields so Streamlit doesn't crash)
 try:
     df_temp_preview = pd.DataFrame.from_dict(STRATEGY_TEMPLATES, orient="index")
@@ -254,7 +171,21 @@ with st.sidebar.expander("⚙️ option"):
     T_scale = float(st.slider("Scale per-leg time to expiry (0.1x..2x)", 0.1, 2.0, 1.0, step=0.05))
     rf = float(st.number_input("Risk-free rate (annual decimal)", value=0.015, step=0.001, format="%.3f"))
     vol_shift_pct = float(st.slider("Global IV shift (%)", -80, 200, 0, step=1))
-
+    use_vol_surface = st.checkbox("Price legs off fitted vol smile", value=False)
+    pricing_model = st.selectbox("Pricing model (before expiry)", list(PRICING_MODELS), index=0)
+
+# implied vols for the whole chain, solved in one batch per market snapshot (used where IV LAST is missing)
+# keyed on the market file's refresh version instead of hashing the whole frame on every rerun
+@st.cache_data(show_spinner=False, max_entries=8)
+def solve_chain_iv(_df_market, market_path, market_version, rf, today):
+    return chain_implied_vols(_df_market, rf, today)
+
+df_market = df_market.join(solve_chain_iv(df_market, str(OPTION_MARKET_PATH), market_version(OPTION_MARKET_PATH, "option"), rf, date.today()))
+df_master = df_master.merge(df_market[["Series", "IV SOLVED", "IV SOURCE"]].drop_duplicates("Series"), on="Series", how="left")
+# per-expiry smile fitted once per snapshot (cached inside vol_surface, shared across sessions)
+vol_surface = fit_vol_surface(df_market, rf, date.today()) if use_vol_surface else {}
+# S50 futures basis per expiry, the forward for Black-76
+fut_basis = futures_basis(df_market_Future, date.today())
 
 # ------------------- Build useful arrays and ATM references -------------------
 unique_strikes = np.array(sorted(df_market["Strike"].dropna().unique())) if "Strike" in df_market.columns else np.array([])
@@ -328,95 +259,15 @@ else:
     # build from template
     base_series = []
     comps = STRATEGY_TEMPLATES.get(template_choice, {}).get("components", [])
+    # legs resolved from lookup tables built once per chain snapshot (templates.TemplateResolver,
+    # same seven-step fallback as before: exact match, nearest strike, nearest expiry, future, score)
+    resolved = template_resolver.resolve_template(compiled_templates, template_choice, atm_strike_idx, atm_exp_idx, spot_ref)
     used = set()
-    for comp in comps:
+    for comp, (chosen, target_strike, target_exp) in zip(comps, resolved):
         typ = comp.get("type")
         rs = int(comp.get("relative_strike", 0))
         re = int(comp.get("relative_expiry", 0))
 
-        chosen = None
-        target_strike = None
-        target_exp = None
-
-        # 1) compute target strike using index offsets on unique_strikes (ensures distinct offsets)
-        if atm_strike_idx is not None and unique_strikes.size:
-            target_idx = atm_strike_idx + rs
-            if 0 <= target_idx < len(unique_strikes):
-                target_strike = unique_strikes[target_idx]
-
-        # 2) compute target expiry by index (offset in unique_exp)
-        if atm_exp_idx is not None and unique_exp.size:
-            try:
-                base_pos = int(np.where(unique_exp == atm_exp_idx)[0][0])
-                targ_pos = base_pos + re
-                if 0 <= targ_pos < len(unique_exp):
-                    target_exp = unique_exp[targ_pos]
-            except Exception:
-                # fallback: try atm_exp_idx + re if present
-                candidate = atm_exp_idx + re
-                if candidate in unique_exp:
-                    target_exp = candidate
-
-        # 3) exact match: strike + expiry + type
-        if typ in ("Call", "Put") and target_strike is not None and target_exp is not None:
-            cands = df_market[
-                (np.isclose(df_market["Strike"], target_strike)) &
-                (df_market["TypeParsed"] == typ) &
-                (df_market["ExpiryIndex"] == target_exp)
-            ]
-            if not cands.empty:
-                chosen = cands.iloc[0]["Series"]
-
-        # 4) fallback: nearest strike on same expiry (bias downward for negative rs)
-        if chosen is None and typ in ("Call", "Put") and target_exp is not None:
-            cands_same_exp = df_market[df_market["ExpiryIndex"] == target_exp].copy()
-            if not cands_same_exp.empty:
-                base = target_strike if target_strike is not None else spot_ref
-                cands_same_exp["strike_dist"] = np.abs(cands_same_exp["Strike"].fillna(base) - base)
-                # tie-breaker preference: for negative rs prefer lower strike, for positive prefer higher
-                if rs < 0:
-                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) <= base, 0, 1)
-                else:
-                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) >= base, 0, 1)
-                cands_sorted = cands_same_exp.sort_values(["strike_dist", "pref"])
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 5) fallback: same strike different expiry (nearest expiry)
-        if chosen is None and typ in ("Call", "Put") and target_strike is not None:
-            cands_same_strike = df_market[np.isclose(df_market["Strike"], target_strike)].copy()
-            if not cands_same_strike.empty and atm_exp_idx is not None:
-                cands_same_strike["exp_dist"] = np.abs(cands_same_strike["ExpiryIndex"].fillna(atm_exp_idx) - (target_exp if target_exp is not None else atm_exp_idx))
-                cands_sorted = cands_same_strike.sort_values("exp_dist")
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 6) Future matching by expiry
-        if chosen is None and typ == "Future" and not df_market_Future.empty and target_exp is not None:
-            cands = df_market_Future[df_market_Future["ExpiryIndex"] == target_exp]
-            if not cands.empty:
-                for s in cands["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 7) last resort: any candidate by type, nearest by strike+expiry score
-        if chosen is None and typ in ("Call", "Put"):
-            cands_any = df_market[df_market["TypeParsed"] == typ].copy()
-            if not cands_any.empty:
-                base_strike = target_strike if target_strike is not None else spot_ref
-                base_exp = target_exp if target_exp is not None else (atm_exp_idx if atm_exp_idx is not None else 0)
-                cands_any["score"] = np.abs(cands_any["Strike"].fillna(base_strike) - base_strike) + np.abs(cands_any["ExpiryIndex"].fillna(base_exp) - base_exp)
-                cands_sorted = cands_any.sort_values("score")
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
         if chosen: base_series.append(chosen)
 
         # if load_state:
@@ -470,8 +321,10 @@ k = 0
 for s in selected_series:
     col1, col2, col3, col4 = st.columns([4, 2, 2, 2])
     # option series
-    if s in df_market["Series"].values:
-        row = df_market[df_market["Series"] == s].iloc[0]
+    pos = master_index.get(s)
+    kind = master_index.kind[pos] if pos is not None else None
+    if kind == "Option":
+        row = df_master.iloc[pos]
         opt = row["TypeParsed"]
         strike = row["Strike"]
         expiry = row["ExpiryDate"]
@@ -481,10 +334,16 @@ for s in selected_series:
             default_price = df_legs_loaded[df_legs_loaded["Series"] == s]["TradePrice"].values[0]
             default_qty = df_legs_loaded[df_legs_loaded["Series"] == s]["Qty"].values[0]
         else:              
-            default_price = choose_price_from_row(row.to_dict() if hasattr(row, "to_dict") else row)
+            default_price = row["Price"]
             default_qty = qty_defaults[k] if (template_choice != "Custom" and k < len(qty_defaults)) else 1        
         
-        iv = parse_num(row.get("IV LAST"))
+        iv = row["IV"]
+        iv_solved = np.isnan(iv) and not np.isnan(parse_num(row.get("IV SOLVED")))
+        if iv_solved:
+            iv = parse_num(row.get("IV SOLVED"))
+        iv_smile = surface_iv(vol_surface, [expiry], [strike], rf, spot_ref)[0] if vol_surface else np.nan
+        if not np.isnan(iv_smile):
+            iv, iv_solved = iv_smile, False
         THEORETICAL = parse_num(row.get("THEORETICAL"))
         INTRINSICVALUE = parse_num(row.get("INTRINSIC VALUE"))
         MONEYNESS = row.get("MONEYNESS")
@@ -511,17 +370,16 @@ for s in selected_series:
             if load_state or template_choice == "Saved":
                 st.write("")
             else:        
-                st.write(f"IV: {iv:.2f}%")
+                st.write(f"IV: {iv:.2f}%" + (f" (solved from {row.get('IV SOURCE')})" if iv_solved else "") + (" (smile)" if not np.isnan(iv_smile) else ""))
 
         # margin lookup
 
         margin_IM=margin_MM=np.nan
-        mrow=df_margin[df_margin.Series==s]
-        if not mrow.empty:
+        if not np.isnan(row["IM"]):
             if(qty>0):
                 margin_IM=0; margin_MM=0
             else:
-                margin_IM=parse_num(mrow.iloc[0].get("IM")); margin_MM=parse_num(mrow.iloc[0].get("MM"))
+                margin_IM=row["IM"]; margin_MM=row["MM"]
         # margin_IM = margin_MM = np.nan
         # if not df_margin.empty and "Series" in df_margin.columns:
         #     mrow = df_margin[df_margin["Series"] == s]
@@ -551,13 +409,13 @@ for s in selected_series:
         })
 
     # future series
-    elif (not df_market_Future.empty) and (s in df_market_Future["Series"].values):
-        row = df_market_Future[df_market_Future["Series"] == s].iloc[0]
+    elif kind == "Future":
+        row = df_master.iloc[pos]
         expiry = row["ExpiryDate"]
         expiry_idx = row.get("ExpiryIndex", np.nan)
-        default_price = choose_price_from_row(row.to_dict() if hasattr(row, "to_dict") else row)
+        default_price = row["Price"]
         default_qty = qty_defaults[k] if (template_choice != "Custom" and k < len(qty_defaults)) else 1
-        iv = parse_num(row.get("IV LAST"))
+        iv = row["IV"]
         THEORETICAL = parse_num(row.get("THEORETICAL"))
         INTRINSICVALUE = parse_num(row.get("INTRINSIC VALUE"))
         MONEYNESS = row.get("MONEYNESS")
@@ -572,10 +430,7 @@ for s in selected_series:
         with col4:
             st.write("Future")
 
-        mrow=df_margin_Future[df_margin_Future.Series==s]
-        margin_IM=margin_MM=np.nan
-        if not mrow.empty:
-            margin_IM=parse_num(mrow.iloc[0].get("IM")); margin_MM=parse_num(mrow.iloc[0].get("MM"))
+        margin_IM=row["IM"]; margin_MM=row["MM"]
 
         # margin_IM = margin_MM = np.nan
         # if not df_margin_Future.empty and "Series" in df_margin_Future.columns:
@@ -656,28 +511,21 @@ if S_manual and S_manual > 0:
     spread = max(mid * 0.4, 50)
     S_range = np.linspace(max(0.1, mid - spread), mid + spread, 401)
 
-total_pnl_expiry = np.zeros_like(S_range)
-total_pnl_before = np.zeros_like(S_range)
-for _, r in df_legs.iterrows():
-    qty = int(r["Qty"])
-    trade_price = parse_num(r["TradePrice"])
-    if r["Type"] in ("Call", "Put"):
-        total_pnl_expiry += payoff_for_leg_intrinsic(r["Type"], r["Strike"], qty, trade_price, multiplier, S_range)
-        sigma = (r["IV"] / 100.0) if (not pd.isna(r["IV"]) and r["IV"] != 0) else np.nan
-        if not np.isnan(sigma):
-            sigma = max(1e-6, sigma * (1.0 + vol_shift_pct / 100.0))
-        T_leg = years_to_expiry(r["Expiry"]) * T_scale if pd.notna(r["Expiry"]) else 0.25
-        total_pnl_before += payoff_for_leg_bs(r["Type"], r["Strike"], qty, trade_price, multiplier, S_range, T_leg, rf, sigma)
-    elif r["Type"] == "Future":
-        total_pnl_expiry += payoff_for_leg_intrinsic("Future", 0, qty, trade_price, multiplier, S_range)
-        total_pnl_before += payoff_for_leg_intrinsic("Future", 0, qty, trade_price, multiplier, S_range)
-    else:
-        # Missing placeholder (qty == 0) -> skip contributions
-        pass
+# payoff and Greeks are priced together and cached, so toggling the Greeks chart doesn't reprice
+@st.cache_data(show_spinner=False, max_entries=64)
+def compute_position_curves(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, today, model, basis):
+    return position_payoff_greeks(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, today, spot_pricer(model, basis))
 
-# breakevens and intercepts
-sign_changes = np.where(np.diff(np.sign(total_pnl_expiry)) != 0)[0]
-breakevens = [float(S_range[i]) for i in sign_changes]
+total_pnl_expiry, total_pnl_before, position_greeks = compute_position_curves(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, date.today(), pricing_model, fut_basis)
+
+# spot x days-elapsed P/L surface, memoized on the leg set and settings
+@st.cache_data(show_spinner=False, max_entries=32)
+def compute_pnl_heatmap(df_legs, S_range, days_grid, multiplier, rf, vol_shift_pct, today, model, basis):
+    return position_pnl_grid(df_legs, S_range, days_grid, multiplier, rf, vol_shift_pct, today, spot_pricer(model, basis))
+
+# breakevens and extremes from the exact piecewise-linear expiry payoff (grid is for drawing only)
+expiry_payoff = PiecewisePayoff.from_legs(df_legs, multiplier)
+breakevens = expiry_payoff.breakevens
 y_intercept = float(total_pnl_expiry[0])
 # summary stats
 count_option = int((((((df_legs["Type"]=="Call") | (df_legs["Type"]=="Put"))).mul(df_legs["Qty"].abs()))).sum())
@@ -688,13 +536,16 @@ total_IM = (df_legs["Qty"].abs() * df_legs["IM"].fillna(0)).sum() if "IM" in df_
 total_MM = (df_legs["Qty"].abs() * df_legs["MM"].fillna(0)).sum() if "MM" in df_legs.columns else 0.0
 total_fee = fee_option * count_option * 2 + fee_future * count_future * 2
 
-est_pl = float(np.interp(est_price, S_range,total_pnl_expiry))
+est_pl = float(expiry_payoff(est_price))
 equity = init_balance + est_pl
 broke = equity < total_IM
 
 
 # ------------------- Plot -------------------
 st.subheader("Payoff chart")
+option_expiries = df_legs.loc[df_legs["Type"].isin(["Call", "Put"]), "Expiry"].dropna()
+multi_expiry = option_expiries.nunique() > 1 or "Calendar" in template_choice or "Diagonal" in template_choice
+chart_view = st.radio("Chart view", ["Payoff curves", "P/L heatmap (spot x days)"], index=1 if multi_expiry else 0, horizontal=True)
 fig, ax = plt.subplots(figsize=(10, 6))
 
 # Main payoff lines
@@ -702,7 +553,7 @@ ax.plot(S_range, total_pnl_expiry, label="At Expiry (intrinsic)", linewidth=2)
 ax.plot(
     S_range,
     total_pnl_before,
-    label=f"Before Expiry (vol shift {vol_shift_pct:+.0f}%)",
+    label=f"Before Expiry ({pricing_model}, vol shift {vol_shift_pct:+.0f}%)",
     linestyle="--",
     linewidth=2,
 )
@@ -713,7 +564,7 @@ ax.fill_between(S_range, total_pnl_expiry, 0, where=(total_pnl_expiry < 0), colo
 
 # Breakeven lines
 ax.axhline(0, linestyle="--", color="black")
-for bx in breakevens:
+for bx in (b for b in breakevens if S_range[0] <= b <= S_range[-1]):
     ax.axvline(bx, color="red", linestyle="--", alpha=0.6)
     ax.text(bx, 0, f"{bx:.1f}", color="red", ha="center", va="bottom")
 
@@ -725,18 +576,166 @@ ax.set_ylabel("Profit / Loss")
 ax.grid(True)
 ax.legend()
 
-st.pyplot(fig)
+if chart_view == "Payoff curves":
+    st.pyplot(fig)
+else:
+    leg_days = (pd.to_datetime(option_expiries) - pd.Timestamp(date.today())).dt.days.clip(lower=1).tolist()
+    max_days = max(leg_days + [2])
+    # default horizon = first option expiry, where calendars and diagonals are decided
+    horizon = st.slider("Heatmap horizon (days from today)", 1, max_days, min(leg_days) if leg_days else max_days)
+    days_grid = np.linspace(0, horizon, 60)
+    pnl_grid = compute_pnl_heatmap(df_legs, S_range, days_grid, multiplier, rf, vol_shift_pct, date.today(), pricing_model, fut_basis)
+
+    # own figure: "Save outputs" keeps writing the payoff chart above as payoff_chart.png
+    fig_heat, ax_heat = plt.subplots(figsize=(10, 6))
+    vlim = max(float(np.nanmax(np.abs(pnl_grid), initial=0.0)), 1.0)
+    mesh = ax_heat.pcolormesh(S_range, days_grid, pnl_grid, cmap="RdYlGn", vmin=-vlim, vmax=vlim, shading="auto")
+    ax_heat.contour(S_range, days_grid, pnl_grid, levels=[0], colors="black", linewidths=1)
+    if S_manual and S_manual > 0:
+        ax_heat.axvline(S_manual, color="gray", linestyle=":", alpha=0.8)
+    fig_heat.colorbar(mesh, ax=ax_heat, label="Profit / Loss")
+    ax_heat.set_xlabel("Underlying price")
+    ax_heat.set_ylabel("Days from today")
+    st.pyplot(fig_heat)
+
+# ------------------- Greeks -------------------
+if st.checkbox("Show position Greeks (before expiry)"):
+    fig_g, axes_g = plt.subplots(len(GREEKS), 1, figsize=(10, 12), sharex=True)
+    greek_labels = {"delta": "Delta", "gamma": "Gamma", "vega": "Vega (per 1 vol pt)", "theta": "Theta (per day)", "rho": "Rho (per 1% rate)"}
+    for ax_g, g in zip(axes_g, GREEKS):
+        ax_g.plot(S_range, position_greeks[g], linewidth=1.5)
+        ax_g.axhline(0, linestyle="--", color="black", linewidth=0.8)
+        ax_g.set_ylabel(greek_labels[g])
+        ax_g.grid(True)
+        if S_manual and S_manual > 0:
+            ax_g.axvline(S_manual, color="gray", linestyle=":", alpha=0.8)
+    axes_g[-1].set_xlabel("Underlying price")
+    fig_g.tight_layout()
+    st.pyplot(fig_g)
+    if S_manual and S_manual > 0:
+        st.write("- Greeks @ spot " + ", ".join(f"{greek_labels[g].split(' ')[0]}: {np.interp(S_manual, S_range, position_greeks[g]):,.2f}" for g in GREEKS))
+
+
+# ------------------- Scenario cube -------------------
+with st.expander("🧊 Scenario cube (spot x IV shift x time)"):
+    sc_col1, sc_col2 = st.columns(2)
+    vol_lo, vol_hi = sc_col1.slider("IV shift range (%)", -80, 200, (-50, 100), step=5)
+    ts_lo, ts_hi = sc_col2.slider("Time-to-expiry scale range", 0.05, 2.0, (0.1, 1.0), step=0.05)
+    vol_axis = np.arange(vol_lo, vol_hi + 1, 5, dtype=float)
+    ts_axis = np.round(np.arange(ts_lo, ts_hi + 1e-9, 0.05), 2)
+    # one vectorized evaluation per leg set / axes; the sliders below only slice the cached tensor.
+    # Priced with the sidebar model and only on request: the expander body runs on every rerun,
+    # and a lattice model takes tens of seconds per leg set (Black-Scholes / Black-76: ~0.1 s).
+    if st.checkbox("Compute the cube", value=False, key="cube_on"):
+        with st.spinner(f"Pricing the cube ({pricing_model})..."):
+            cube = scenario_cube(df_legs, S_range, vol_axis, ts_axis, multiplier, rf, date.today(), spot_pricer(pricing_model, fut_basis))
+        sl_col1, sl_col2 = st.columns(2)
+        vol_pick = sl_col1.select_slider("IV shift slice (%)", options=vol_axis.tolist(), value=float(vol_axis[np.argmin(np.abs(vol_axis))]))
+        ts_pick = sl_col2.select_slider("Time scale slice", options=ts_axis.tolist(), value=float(ts_axis[-1]))
+        vi, ti = vol_axis.tolist().index(vol_pick), ts_axis.tolist().index(ts_pick)
+
+        fig_sc, ax_sc = plt.subplots(figsize=(10, 5))
+        ax_sc.plot(S_range, total_pnl_expiry, label="At Expiry (intrinsic)", linewidth=1.5)
+        ax_sc.plot(S_range, cube[:, vi, ti], label=f"IV shift {vol_pick:+.0f}%, time x{ts_pick:.2f}", linestyle="--", linewidth=2)
+        ax_sc.axhline(0, linestyle="--", color="black")
+        ax_sc.set_xlabel("Underlying price")
+        ax_sc.set_ylabel("Profit / Loss")
+        ax_sc.grid(True)
+        ax_sc.legend()
+        st.pyplot(fig_sc)
+
+        spot_pick = S_manual if S_manual > 0 else spot_ref
+        at_spot = np.array([[np.interp(spot_pick, S_range, cube[:, i, j]) for j in range(ts_axis.size)] for i in range(vol_axis.size)])
+        st.write(f"P/L at spot {spot_pick:,.2f} (rows: IV shift %, columns: time scale)")
+        st.dataframe(pd.DataFrame(at_spot, index=[f"{v:+.0f}%" for v in vol_axis], columns=[f"x{t:.2f}" for t in ts_axis]).style.format("{:,.0f}"))
+
+
+# ------------------- Strategy scanner (every template over the whole chain) -------------------
+# all instances ranked in one pass per set of file versions; the filters only re-slice the result
+@st.cache_data(show_spinner="Scanning the chain...", max_entries=8)
+def run_chain_scan(_resolver, _master, _templates, files, multiplier, fee_option, fee_future):
+    return scan_chain(_resolver, _master, _templates, multiplier, fee_option, fee_future)
+
+with st.expander("🔎 Strategy scanner (all templates over the chain)"):
+    try:
+        scan_files = tuple(file_key(p) for p in (OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH, TEMPLATE_PATH))
+        df_scan = run_chain_scan(template_resolver, df_master, compiled_templates, scan_files, multiplier, fee_option, fee_future)
+    except OSError as e:
+        st.warning(f"Scanner needs every data file: {e}")
+        df_scan = pd.DataFrame(columns=RESULT_COLUMNS)
+    sc_col1, sc_col2, sc_col3 = st.columns(3)
+    scan_group = sc_col1.selectbox("Group", ["All"] + sorted(df_scan["Group"].dropna().unique().tolist()))
+    scan_expiry = sc_col2.selectbox("Expiry index", ["All"] + sorted(df_scan["ExpiryIndex"].unique().tolist()))
+    scan_by = sc_col3.selectbox("Rank by", ["ReturnOnMargin", "MaxProfit", "MaxLoss", "NetPremium", "IM", "Capital"],
+                                help="ReturnOnMargin: (max profit - fees) / (IM + premium paid); unbounded-profit rows rank last")
+    scan_credit = st.checkbox("Credit only (net premium received)", value=False)
+    df_ranked = rank_instances(df_scan, scan_by, ascending=scan_by in ("NetPremium", "IM", "Capital"),
+                               group=None if scan_group == "All" else scan_group,
+                               expiry=None if scan_expiry == "All" else scan_expiry, credit_only=scan_credit)
+    st.write(f"{len(df_ranked):,} of {len(df_scan):,} instances")
+    st.dataframe(df_ranked, height=350)
+
+
+# ------------------- Strike optimizer (best legs for a market view) -------------------
+# searched in one call per view / constraint set; a rerun with the same inputs reuses the result
+@st.cache_data(show_spinner="Searching leg combinations...", max_entries=16)
+def run_strike_optimizer(_resolver, _master, files, multiplier, fee_option, fee_future, view, expiry, budget, max_loss, max_legs, max_qty, strike_window, use_futures):
+    chain = ChainScan(_resolver, _master, multiplier, fee_option, fee_future)
+    return optimize_strikes(chain, view, expiry, budget, max_loss=max_loss, max_legs=max_legs, max_qty=max_qty,
+                            strike_window=strike_window, use_futures=use_futures)
+
+with st.expander("🎯 Strike optimizer (best legs for your view)"):
+    opt_exps = [int(e) for e in template_resolver.expiries]
+    if not opt_exps:
+        st.info("No option expiries in the loaded chain.")
+    else:
+        op_col1, op_col2, op_col3 = st.columns(3)
+        opt_expiry = op_col1.selectbox("Expiry index", opt_exps, index=opt_exps.index(atm_exp_idx) if atm_exp_idx in opt_exps else 0, key="opt_expiry")
+        opt_view_kind = op_col2.radio("Market view", ["Price range", "Target price (lognormal)"])
+        opt_center = S_manual if S_manual > 0 else spot_ref
+        if opt_view_kind == "Price range":
+            opt_low = op_col3.number_input("Low", value=float(round(opt_center * 0.97, 1)), step=1.0, format="%.1f")
+            opt_high = op_col3.number_input("High", value=float(round(opt_center * 1.03, 1)), step=1.0, format="%.1f")
+            opt_view = range_view(opt_low, opt_high)
+        else:
+            opt_target = op_col3.number_input("Target price", value=float(round(opt_center, 1)), step=1.0, format="%.1f")
+            opt_vol = op_col3.number_input("Vol to expiry (%)", value=20.0, step=0.5, format="%.2f")
+            opt_days = op_col3.number_input("Days to expiry", value=30, min_value=1, step=1)
+            opt_view = lognormal_view(opt_target, opt_vol / 100.0, opt_days)
+        op_col4, op_col5, op_col6, op_col7 = st.columns(4)
+        opt_max_loss = op_col4.number_input("Max loss cap (THB)", value=float(round(init_balance * 0.2, 2)), min_value=0.0, step=1000.0, format="%.2f")
+        opt_legs = op_col5.slider("Max legs", 1, 4, 4)
+        opt_qty = op_col6.slider("Max qty per leg", 1, 3, 1)
+        # 12 strikes each side keeps 4 legs x qty 3 under the optimizer's MAX_SPACE
+        opt_window_max = min(max(len(template_resolver.strikes), 1), 12)
+        opt_window = op_col7.slider("Strikes each side of the view", 1, opt_window_max, min(8, opt_window_max))
+        opt_futures = st.checkbox("Allow the future of that expiry as a leg", value=False)
+        st.caption(f"Ranked by expected P/L net of fees per THB of capital (IM + net premium paid), capital within the initial balance ({init_balance:,.2f}).")
+        if st.button("Optimize"):
+            try:
+                opt_files = tuple(file_key(p) for p in (OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH))
+                df_opt, opt_stats = run_strike_optimizer(template_resolver, df_master, opt_files, multiplier, fee_option, fee_future,
+                                                         opt_view, opt_expiry, float(init_balance), float(opt_max_loss),
+                                                         int(opt_legs), int(opt_qty), int(opt_window), opt_futures)
+            except OSError as e:
+                st.warning(f"Optimizer needs every data file: {e}")
+            except ValueError as e:
+                st.warning(f"Optimizer: {e}")
+            else:
+                st.write(f"{opt_stats['space']:,} combinations in the search space, {opt_stats['evaluated']:,} scored exactly after pruning")
+                if opt_stats["truncated"]:
+                    st.caption(f"Search capped: {opt_stats['truncated']:,} less promising partial combinations were not extended; narrow the strike window or max qty for an exhaustive search.")
+                if opt_stats["no_margin"]:
+                    st.caption(f"{opt_stats['no_margin']} series have no margin record and are only used as long options.")
+                if df_opt.empty:
+                    st.info("No combination meets the budget and loss cap with a positive expected P/L under this view.")
+                else:
+                    st.dataframe(df_opt.style.format({"ExpectedReturn": "{:.2%}", "ProbProfit": "{:.1%}"}), height=350)
 
 
 # ------------------- Strategy detection (use relative expiry + strike-step by index) -------------------
 
 
-def _normalize_offsets(items):
-    if not items:
-        return items
-    min_exp = min([e for (_,_,_,e) in items])
-    return [(t,q,rs,e-min_exp) for (t,q,rs,e) in items]
-
 def _build_actual_pattern(df_legs_local, spot, strike_step_guess=None, atm_exp_idx_guess=None):
     strikes_present = df_legs_local["Strike"].dropna().unique()
     if len(strikes_present) == 0:
@@ -780,43 +779,8 @@ def detect_strategy(df_legs_local, spot, strike_step_guess=None, atm_exp_idx_gue
     if not actual:
         return None
 
-    actual_norm = _normalize_offsets(actual)
-
-    best_match = None
-    best_score = float("inf")
-
-    for name, template in STRATEGY_TEMPLATES.items():
-        comps = template.get("components", [])
-        tpl = [(leg.get("type"),
-                int(np.sign(int(leg.get("qty",0)))),
-                int(leg.get("relative_strike",0)),
-                int(leg.get("relative_expiry",0)))
-                for leg in comps]
-        tpl_norm = _normalize_offsets(tpl)
-
-        if len(tpl_norm) != len(actual_norm):
-            continue
-
-        best_tpl_score = float("inf")
-        for actual_perm in itertools.permutations(actual_norm, len(tpl_norm)):
-            score = 0
-            ok = True
-            for t_leg, a_leg in zip(tpl_norm, actual_perm):
-                t_type,t_sign,t_rs,t_re = t_leg
-                a_type,a_sign,a_rs,a_re = a_leg
-                if t_type != a_type or t_sign != a_sign:
-                    ok = False; break
-                # allow strike mismatch of ±1 (score = diff)
-                score += abs(t_rs - a_rs)
-                # allow expiry mismatch of ±1 (score = diff)
-                score += abs(t_re - a_re)
-            if ok and score < best_tpl_score:
-                best_tpl_score = score
-        if best_tpl_score < best_score:
-            best_score = best_tpl_score
-            best_match = name
-
-    return best_match
+    # best template by min-cost pairing of legs, remembered per leg set (templates.TemplateMatcher)
+    return template_matcher.detect(actual)
 
 
 
@@ -839,25 +803,23 @@ st.write(f"- Net premium (sum premium * qty * multiplier): {total_premium:,.2f}"
 st.write(f"- Total Initial Margin (IM) estimate: {total_IM:,.2f}")
 st.write(f"- Total Maintenance Margin (MM) estimate: {total_MM:,.2f}")
 st.write(f"- Estimated fees (round trip): {total_fee:,.2f}")
-st.write(f"- Max profit @ expiry: {total_pnl_expiry.max():,.2f}")
-st.write(f"- Max loss @ expiry: {total_pnl_expiry.min():,.2f}")
+st.write(f"- Max profit @ expiry: {'Unlimited' if np.isinf(expiry_payoff.max_profit) else f'{expiry_payoff.max_profit:,.2f}'}")
+st.write(f"- Max loss @ expiry: {'Unlimited' if np.isinf(expiry_payoff.max_loss) else f'{expiry_payoff.max_loss:,.2f}'}")
 st.write(f"- Breakevens @ expiry: {', '.join(f'{b:.2f}' for b in breakevens) if breakevens else 'None'}")
 st.write(f"- Y-intercept @ expiry (left edge): {y_intercept:,.2f}")
 
 # ------------------- Risk: Broke Point -------------------
 st.subheader("Broke-point Analysis")
-equity_curve = init_balance + total_pnl_expiry
 # Find underlying prices where equity crosses zero
-sign_changes = np.where(np.diff(np.sign(equity_curve)) != 0)[0]
-broke_prices = [S_range[i] for i in sign_changes]
+broke_prices = expiry_payoff.crossings(-init_balance)
 if broke_prices:
     st.error(f"⚠️ Broke point(s): Underlying at {', '.join(f'{bp:.2f}' for bp in broke_prices)}")
 else:
-    st.success("✅ No broke point found within simulated price range.")
+    st.success("✅ No broke point found at any underlying price.")
 
-# Margin thresholds
-margin_call_prices = [S_range[i] for i in range(len(S_range)) if equity_curve[i] < total_MM]
-stop_out_prices    = [S_range[i] for i in range(len(S_range)) if equity_curve[i] < total_IM]
+# Margin thresholds: exact prices where expiry equity crosses MM / IM, at any underlying price
+margin_call_prices = expiry_payoff.crossings(total_MM - init_balance)
+stop_out_prices    = expiry_payoff.crossings(total_IM - init_balance)
 
 if margin_call_prices:
     st.warning(f"⚠️ Margin Call risk if price falls below {min(margin_call_prices):.2f}")
@@ -877,6 +839,53 @@ if broke:
 else:
     st.success("✅ Equity above margin requirement")
 
+# ------------------- Monte Carlo -------------------
+@st.cache_data(show_spinner="Simulating paths...", max_entries=16)
+def run_monte_carlo(df_legs, S0, multiplier, rf, sigma, returns, init_balance, total_IM, total_MM, n_paths, n_steps, horizon_days, seed, today):
+    return simulate_position(df_legs, S0, multiplier, rf, sigma=sigma, returns=returns, init_balance=init_balance,
+                             total_IM=total_IM, total_MM=total_MM, n_paths=n_paths, n_steps=n_steps,
+                             horizon=horizon_days / 365.0, seed=seed, today=today)
+
+with st.expander("🎲 Monte Carlo P/L distribution"):
+    leg_iv = pd.to_numeric(df_legs.loc[df_legs["Type"].isin(["Call", "Put"]), "IV"], errors="coerce").replace(0, np.nan).dropna()
+    hv = pd.to_numeric(df_market.get("Historical Vol (%)"), errors="coerce").dropna() if "Historical Vol (%)" in df_market.columns else pd.Series(dtype=float)
+    default_vol = float(leg_iv.mean()) if not leg_iv.empty else (float(hv.median()) if not hv.empty else 20.0)
+    mc_col1, mc_col2, mc_col3, mc_col4 = st.columns(4)
+    mc_vol = mc_col1.number_input("Underlying vol (%)", value=round(default_vol, 2), step=0.5, format="%.2f")
+    mc_paths = mc_col2.selectbox("Paths", [10_000, 100_000, 1_000_000], index=1)
+    mc_steps = mc_col3.number_input("Monitoring dates", value=20, min_value=1, max_value=250, step=1)
+    mc_seed = mc_col4.number_input("Seed", value=42, step=1)
+    exp_days = (pd.to_datetime(df_legs["Expiry"].dropna()) - pd.Timestamp(date.today())).dt.days
+    exp_days = exp_days[exp_days > 0]
+    mc_horizon = st.slider("Horizon (days)", 1, int(max(exp_days.max(), 2)) if not exp_days.empty else 365, int(exp_days.min()) if not exp_days.empty else 30)
+    S0_mc = S_manual if S_manual > 0 else spot_ref
+    mc_model = st.radio("Path model", ["Lognormal (vol above)", "Bootstrap (archived daily returns)"], horizontal=True)
+    mc_returns = None
+    if mc_model.startswith("Bootstrap"):
+        # underlying closes of the futures file's archived snapshots (python history.py data)
+        mc_returns = daily_log_returns(history_dir(Path(FUTURE_MARKET_PATH).parent), Path(FUTURE_MARKET_PATH).stem)
+        if mc_returns.size < 2:
+            st.warning("Bootstrap needs at least three archived dates of the futures file (python history.py data).")
+        else:
+            st.caption(f"{mc_returns.size} daily log returns from the snapshot history")
+
+    if st.button("Run simulation", disabled=mc_returns is not None and mc_returns.size < 2):
+        mc = run_monte_carlo(df_legs, S0_mc, multiplier, rf, None if mc_returns is not None else mc_vol / 100.0, mc_returns,
+                             init_balance, total_IM, total_MM, int(mc_paths), int(mc_steps), mc_horizon, int(mc_seed), date.today())
+        st.write(f"- Paths: {mc_paths:,} (antithetic, {'bootstrap' if mc_returns is not None else 'lognormal'}), horizon {mc['horizon_days']:.0f} days, start {S0_mc:,.2f}")
+        st.write(f"- Expected P/L: {mc['mean']:,.2f} (std {mc['std']:,.2f})")
+        st.write(f"- Probability of profit: {mc['prob_profit']:.1%}")
+        st.write(f"- VaR 95%: {mc['var_95']:,.2f} | Expected shortfall 95%: {mc['es_95']:,.2f}")
+        st.write(f"- P(equity < MM before horizon): {mc['prob_margin_call']:.1%} | P(equity < IM before horizon): {mc['prob_stop_out']:.1%}")
+        fig_mc, ax_mc = plt.subplots(figsize=(10, 4))
+        ax_mc.hist(mc["pnl"], bins=100, color="steelblue", alpha=0.8)
+        ax_mc.axvline(0, linestyle="--", color="black")
+        ax_mc.axvline(-mc["var_95"], linestyle="--", color="red", label="VaR 95%")
+        ax_mc.set_xlabel("P/L at horizon")
+        ax_mc.set_ylabel("Paths")
+        ax_mc.legend()
+        st.pyplot(fig_mc)
+
 # ------------------- Save & download -------------------
 BASE_DIR = Path(__file__).resolve().parent.parent
 st_dir = str(BASE_DIR / "output")
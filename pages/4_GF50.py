@@ -1,19 +1,19 @@
 # options_app.py
 import json
 import re
-import calendar
 from pathlib import Path
 from datetime import date
 import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.stats import norm
-import itertools
 
 import sys
 # Add parent directory (app/) to Python path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from market_data import load_frame, load_future_market, load_master, load_master_index, load_compiled_templates, load_template_matcher, load_template_resolver, read_json
+from pricing import position_payoff
+from payoff import PiecewisePayoff
 
 # Require login
 if "email" not in st.session_state:
@@ -44,94 +44,19 @@ def parse_num(x):
         except: return np.nan
     return np.nan
 
-def leg_type_from_series(series):
-    if not isinstance(series,str): return (None, np.nan)
-    if 'C' in series:
-        idx = series.rfind('C'); opt = 'Call'
-    elif 'P' in series:
-        idx = series.rfind('P'); opt = 'Put'
-    else:
-        return (None, np.nan)
-    strike_part = series[idx+1:]
-    try:
-        strike = float(strike_part)
-    except:
-        digits = ''.join(ch for ch in series if ch.isdigit())
-        strike = float(digits) if digits else np.nan
-    return (opt, strike)
-
-def choose_price_from_row(row):
-    last = parse_num(row.get('Last')) if isinstance(row, dict) else parse_num(row.Last)
-    bid = parse_num(row.get('Bid')) if isinstance(row, dict) else parse_num(getattr(row, "Bid", None))
-    offer = parse_num(row.get('Offer')) if isinstance(row, dict) else parse_num(getattr(row, "Offer", None))
-    if not np.isnan(last): return last
-    if not np.isnan(bid) and not np.isnan(offer): return (bid + offer) / 2.0
-    if not np.isnan(bid): return bid
-    if not np.isnan(offer): return offer
-    return np.nan
-
-def payoff_for_leg_intrinsic(opt_type, K, qty, premium, multiplier, S_arr):
-    if opt_type == 'Call':
-        intrinsic = np.maximum(S_arr - K, 0.0)
-    elif opt_type == 'Put':
-        intrinsic = np.maximum(K - S_arr, 0.0)
-    else:  # Future
-        intrinsic = S_arr
-    return (intrinsic - premium) * qty * multiplier
-
-def bs_price(opt_type, S, K, T, rf, sigma):
-    if T <= 0 or sigma <= 0 or np.isnan(sigma):
-        return max(S - K, 0.0) if opt_type == 'Call' else max(K - S, 0.0)
-    d1 = (np.log(S / K) + (rf + 0.5 * sigma**2) * T) / (sigma * np.sqrt(T))
-    d2 = d1 - sigma * np.sqrt(T)
-    if opt_type == 'Call':
-        return S * norm.cdf(d1) - K * np.exp(-rf * T) * norm.cdf(d2)
-    else:
-        return K * np.exp(-rf * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
-
-def payoff_for_leg_bs(opt_type, K, qty, premium, multiplier, S_arr, T, rf, sigma):
-    prices = np.array([bs_price(opt_type, s, K, T, rf, sigma) for s in S_arr])
-    return (prices - premium) * qty * multiplier
-
-# expiry parsing (month letter + 2-digit year)
-EXPIRY_ORDER = "FGHJKMNQUVXZ"
-MONTH_MAP = {"F":1,"G":2,"H":3,"J":4,"K":5,"M":6,"N":7,"Q":8,"U":9,"V":10,"X":11,"Z":12}
-def parse_expiry_code(series):
-    if not isinstance(series,str): return (None, np.nan, None)
-    if len(series) <= 7:
-        #future
-        letter = series[-3]
-        year2 = series[-2:]
-    else:
-        #option series
-        clean_series = series[:-4]
-        letter = clean_series[-3]
-        year2 = clean_series[-2:]
-    # m = re.search(r'([FGHJKMNQUVXZ])(\d{2})', series)
-    # if not m: return (None, np.nan, None)
-    # letter, year2 = m.group(1), m.group(2)
-    month = MONTH_MAP.get(letter, 1)
-    year = 2000 + int(year2)
-    cal = calendar.Calendar(firstweekday=0)
-    fridays = [d for d in cal.itermonthdates(year, month) if d.month == month and d.weekday() == 4]
-    # pick 3rd Friday if present else fallback to middle of month
-    expiry_date = fridays[2] if len(fridays) >= 3 else date(year, month, min(15,28))
-    idx = EXPIRY_ORDER.index(letter) + int(year2) * 12
-    return (letter + year2, idx, expiry_date)
-
 def years_to_expiry(expiry_date, today=None):
     if expiry_date is None or pd.isna(expiry_date): return np.nan
     today = today or date.today()
     delta = expiry_date - today
     return max(delta.days / 365.0, 0.0)
 
-def safe_load_json(path):
+def safe_load_frame(path, kind="raw"):
     try:
         if Path(path).exists():
-            return json.loads(Path(path).read_text(encoding="utf-8"))
+            return load_frame(path, kind)
     except Exception as e:
         st.warning(f"⚠️ Cannot read {path}: {e}")
-    return []
+    return pd.DataFrame()
 
 # ------------------- Load files & preview -------------------
 st.set_page_config(layout="wide", page_title="Options Strategy Scenario Tool",page_icon="📋")
@@ -153,23 +78,14 @@ with st.sidebar.expander("Data file paths (change if needed)"):
 
 # load strategy json
 try:
-    STRATEGY_TEMPLATES = json.loads(TEMPLATE_PATH.read_text(encoding="utf-8"))
+    STRATEGY_TEMPLATES = read_json(TEMPLATE_PATH)
 except Exception as e:
     STRATEGY_TEMPLATES = {}
     st.warning(f"Couldn't load strategy JSON: {e}")
 
 # load option market
 try:
-    df_market = pd.DataFrame(safe_load_json(OPTION_MARKET_PATH))
-    if not df_market.empty:
-        df_market.columns = [c.strip() for c in df_market.columns]
-        parsed = df_market["Series"].apply(leg_type_from_series)
-        df_market["TypeParsed"] = parsed.apply(lambda x: x[0])
-        df_market["Strike"] = parsed.apply(lambda x: x[1])
-        eparse = df_market["Series"].apply(parse_expiry_code)
-        df_market["ExpiryCode"] = eparse.apply(lambda x: x[0])
-        df_market["ExpiryIndex"] = eparse.apply(lambda x: x[1])
-        df_market['ExpiryDate'] = pd.to_datetime(df_market['ExpiryDate']).dt.date
+    df_market = safe_load_frame(OPTION_MARKET_PATH, "option")
 except Exception as e:
     st.error(f"Cannot read option market JSON: {e}")
     st.stop()
@@ -177,19 +93,23 @@ except Exception as e:
 
 # load future market (optional)
 try:
-    df_market_Future = pd.DataFrame(json.loads(FUTURE_MARKET_PATH.read_text(encoding="utf-8")))
-    eparse_f = df_market_Future["Series"].apply(parse_expiry_code)
-    df_market_Future["ExpiryCode"] = eparse_f.apply(lambda x: x[0])
-    df_market_Future["ExpiryIndex"] = eparse_f.apply(lambda x: x[1])
-    df_market_Future['ExpiryDate'] = pd.to_datetime(df_market_Future['ExpiryDate']).dt.date
+    df_market_Future = load_future_market(FUTURE_MARKET_PATH)
     
 except Exception:
     df_market_Future = pd.DataFrame()
 
 # margins
 # Load margins
-df_margin = pd.DataFrame(safe_load_json(OPTION_MARGIN_PATH))
-df_margin_Future = pd.DataFrame(safe_load_json(FUTURE_MARGIN_PATH))
+df_margin = safe_load_frame(OPTION_MARGIN_PATH)
+df_margin_Future = safe_load_frame(FUTURE_MARGIN_PATH)
+
+# instrument master: one row per tradable series with quotes, parsed fields and margins joined
+# once per file version; the leg loop gathers rows from it through the Series index
+df_master = load_master(OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+master_index = load_master_index(OPTION_MARKET_PATH, OPTION_MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+template_resolver = load_template_resolver(OPTION_MARKET_PATH, FUTURE_MARKET_PATH)
+compiled_templates = load_compiled_templates(TEMPLATE_PATH)
+template_matcher = load_template_matcher(TEMPLATE_PATH)
 
 
 # JSON preview for templates (stringify nested fields so Streamlit doesn't crash)
@@ -264,95 +184,15 @@ if template_choice == "Custom":
     selected_series = st.multiselect("Select series", all_series, default=all_series[:1])
 else:
     comps = STRATEGY_TEMPLATES.get(template_choice, {}).get("components", [])
+    # legs resolved from lookup tables built once per chain snapshot (templates.TemplateResolver,
+    # same seven-step fallback as before: exact match, nearest strike, nearest expiry, future, score)
+    resolved = template_resolver.resolve_template(compiled_templates, template_choice, atm_strike_idx, atm_exp_idx, spot_ref)
     used = set()
-    for comp in comps:
+    for comp, (chosen, target_strike, target_exp) in zip(comps, resolved):
         typ = comp.get("type")
         rs = int(comp.get("relative_strike", 0))
         re = int(comp.get("relative_expiry", 0))
 
-        chosen = None
-        target_strike = None
-        target_exp = None
-
-        # 1) compute target strike using index offsets on unique_strikes (ensures distinct offsets)
-        if atm_strike_idx is not None and unique_strikes.size:
-            target_idx = atm_strike_idx + rs
-            if 0 <= target_idx < len(unique_strikes):
-                target_strike = unique_strikes[target_idx]
-
-        # 2) compute target expiry by index (offset in unique_exp)
-        if atm_exp_idx is not None and unique_exp.size:
-            try:
-                base_pos = int(np.where(unique_exp == atm_exp_idx)[0][0])
-                targ_pos = base_pos + re
-                if 0 <= targ_pos < len(unique_exp):
-                    target_exp = unique_exp[targ_pos]
-            except Exception:
-                # fallback: try atm_exp_idx + re if present
-                candidate = atm_exp_idx + re
-                if candidate in unique_exp:
-                    target_exp = candidate
-
-        # 3) exact match: strike + expiry + type
-        if typ in ("Call", "Put") and target_strike is not None and target_exp is not None:
-            cands = df_market[
-                (np.isclose(df_market["Strike"], target_strike)) &
-                (df_market["TypeParsed"] == typ) &
-                (df_market["ExpiryIndex"] == target_exp)
-            ]
-            if not cands.empty:
-                chosen = cands.iloc[0]["Series"]
-
-        # 4) fallback: nearest strike on same expiry (bias downward for negative rs)
-        if chosen is None and typ in ("Call", "Put") and target_exp is not None:
-            cands_same_exp = df_market[df_market["ExpiryIndex"] == target_exp].copy()
-            if not cands_same_exp.empty:
-                base = target_strike if target_strike is not None else spot_ref
-                cands_same_exp["strike_dist"] = np.abs(cands_same_exp["Strike"].fillna(base) - base)
-                # tie-breaker preference: for negative rs prefer lower strike, for positive prefer higher
-                if rs < 0:
-                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) <= base, 0, 1)
-                else:
-                    cands_same_exp["pref"] = np.where(cands_same_exp["Strike"].fillna(base) >= base, 0, 1)
-                cands_sorted = cands_same_exp.sort_values(["strike_dist", "pref"])
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 5) fallback: same strike different expiry (nearest expiry)
-        if chosen is None and typ in ("Call", "Put") and target_strike is not None:
-            cands_same_strike = df_market[np.isclose(df_market["Strike"], target_strike)].copy()
-            if not cands_same_strike.empty and atm_exp_idx is not None:
-                cands_same_strike["exp_dist"] = np.abs(cands_same_strike["ExpiryIndex"].fillna(atm_exp_idx) - (target_exp if target_exp is not None else atm_exp_idx))
-                cands_sorted = cands_same_strike.sort_values("exp_dist")
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 6) Future matching by expiry
-        if chosen is None and typ == "Future" and not df_market_Future.empty and target_exp is not None:
-            cands = df_market_Future[df_market_Future["ExpiryIndex"] == target_exp]
-            if not cands.empty:
-                for s in cands["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
-        # 7) last resort: any candidate by type, nearest by strike+expiry score
-        if chosen is None and typ in ("Call", "Put"):
-            cands_any = df_market[df_market["TypeParsed"] == typ].copy()
-            if not cands_any.empty:
-                base_strike = target_strike if target_strike is not None else spot_ref
-                base_exp = target_exp if target_exp is not None else (atm_exp_idx if atm_exp_idx is not None else 0)
-                cands_any["score"] = np.abs(cands_any["Strike"].fillna(base_strike) - base_strike) + np.abs(cands_any["ExpiryIndex"].fillna(base_exp) - base_exp)
-                cands_sorted = cands_any.sort_values("score")
-                for s in cands_sorted["Series"].tolist():
-                    if s not in used:
-                        chosen = s
-                        break
-
         if chosen and chosen not in used:
             selected_series.append(chosen)
             used.add(chosen)
@@ -382,13 +222,15 @@ for s in selected_series:
     col1, col2, col3, col4 = st.columns([4, 2, 2, 2])
     # option series
     
-    if s in df_market["Series"].values if not df_market.empty else []   :
-        row = df_market[df_market["Series"] == s].iloc[0]
+    pos = master_index.get(s)
+    kind = master_index.kind[pos] if pos is not None else None
+    if kind == "Option":
+        row = df_master.iloc[pos]
         opt = row["TypeParsed"]
         strike = row["Strike"]
         expiry = row["ExpiryDate"]
         expiry_idx = row.get("ExpiryIndex", np.nan)
-        default_price = choose_price_from_row(row.to_dict() if hasattr(row, "to_dict") else row)
+        default_price = row["Price"]
         iv = parse_num(row.get("IV"))
         default_qty = qty_defaults[k] if (template_choice != "Custom" and k < len(qty_defaults)) else 1
 
@@ -404,12 +246,11 @@ for s in selected_series:
         # margin lookup
 
         margin_IM=margin_MM=np.nan
-        mrow=df_margin[df_margin.Series==s]
-        if not mrow.empty:
+        if not np.isnan(row["IM"]):
             if(qty>0):
                 margin_IM=0; margin_MM=0
             else:
-                margin_IM=parse_num(mrow.iloc[0].get("IM")); margin_MM=parse_num(mrow.iloc[0].get("MM"))
+                margin_IM=row["IM"]; margin_MM=row["MM"]
 
         trade_price = price_override if price_override and price_override > 0 else default_price
         premium_total = trade_price * qty * multiplier if not np.isnan(trade_price) else np.nan
@@ -429,11 +270,11 @@ for s in selected_series:
         })
 
     # future series
-    elif (not df_market_Future.empty) and (s in df_market_Future["Series"].values):
-        row = df_market_Future[df_market_Future["Series"] == s].iloc[0]
+    elif kind == "Future":
+        row = df_master.iloc[pos]
         expiry = row["ExpiryDate"]
         expiry_idx = row.get("ExpiryIndex", np.nan)
-        default_price = choose_price_from_row(row.to_dict() if hasattr(row, "to_dict") else row)
+        default_price = row["Price"]
         default_qty = qty_defaults[k] if (template_choice != "Custom" and k < len(qty_defaults)) else 1
 
         with col1:
@@ -445,10 +286,7 @@ for s in selected_series:
         with col4:
             st.write("Future")
 
-        mrow=df_margin_Future[df_margin_Future.Series==s]
-        margin_IM=margin_MM=np.nan
-        if not mrow.empty:
-            margin_IM=parse_num(mrow.iloc[0].get("IM")); margin_MM=parse_num(mrow.iloc[0].get("MM"))
+        margin_IM=row["IM"]; margin_MM=row["MM"]
 
         trade_price = price_override if price_override and price_override > 0 else default_price
         legs.append({
@@ -513,28 +351,11 @@ if S_manual and S_manual > 0:
     spread = max(mid * 0.4, 50)
     S_range = np.linspace(max(0.1, mid - spread), mid + spread, 401)
 
-total_pnl_expiry = np.zeros_like(S_range)
-total_pnl_before = np.zeros_like(S_range)
-for _, r in df_legs.iterrows():
-    qty = int(r["Qty"])
-    trade_price = parse_num(r["TradePrice"])
-    if r["Type"] in ("Call", "Put"):
-        total_pnl_expiry += payoff_for_leg_intrinsic(r["Type"], r["Strike"], qty, trade_price, multiplier, S_range)
-        sigma = (r["IV"] / 100.0) if (not pd.isna(r["IV"]) and r["IV"] != 0) else np.nan
-        if not np.isnan(sigma):
-            sigma = max(1e-6, sigma * (1.0 + vol_shift_pct / 100.0))
-        T_leg = years_to_expiry(r["Expiry"]) * T_scale if pd.notna(r["Expiry"]) else 0.25
-        total_pnl_before += payoff_for_leg_bs(r["Type"], r["Strike"], qty, trade_price, multiplier, S_range, T_leg, rf, sigma)
-    elif r["Type"] == "Future":
-        total_pnl_expiry += payoff_for_leg_intrinsic("Future", 0, qty, trade_price, multiplier, S_range)
-        total_pnl_before += payoff_for_leg_intrinsic("Future", 0, qty, trade_price, multiplier, S_range)
-    else:
-        # Missing placeholder (qty == 0) -> skip contributions
-        pass
+total_pnl_expiry, total_pnl_before = position_payoff(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct)
 
-# breakevens and intercepts
-sign_changes = np.where(np.diff(np.sign(total_pnl_expiry)) != 0)[0]
-breakevens = [float(S_range[i]) for i in sign_changes]
+# breakevens and extremes from the exact piecewise-linear expiry payoff (grid is for drawing only)
+expiry_payoff = PiecewisePayoff.from_legs(df_legs, multiplier)
+breakevens = expiry_payoff.breakevens
 y_intercept = float(total_pnl_expiry[0])
 # summary stats
 count_option = int((((((df_legs["Type"]=="Call") | (df_legs["Type"]=="Put"))).mul(df_legs["Qty"].abs()))).sum())
@@ -545,7 +366,7 @@ total_IM = (df_legs["Qty"].abs() * df_legs["IM"].fillna(0)).sum() if "IM" in df_
 total_MM = (df_legs["Qty"].abs() * df_legs["MM"].fillna(0)).sum() if "MM" in df_legs.columns else 0.0
 total_fee = fee_option * count_option * 2 + fee_future * count_future * 2
 
-est_pl = float(np.interp(est_price, S_range,total_pnl_expiry))
+est_pl = float(expiry_payoff(est_price))
 equity = init_balance + est_pl
 broke = equity < total_IM
 
@@ -556,7 +377,7 @@ fig, ax = plt.subplots(figsize=(10,6))
 ax.plot(S_range, total_pnl_expiry, label="At Expiry (intrinsic)", linewidth=2)
 ax.plot(S_range, total_pnl_before, label=f"Before Expiry (vol shift {vol_shift_pct:+.0f}%)", linestyle="--", linewidth=2)
 ax.axhline(0, linestyle="--", color="black")
-for bx in breakevens:
+for bx in (b for b in breakevens if S_range[0] <= b <= S_range[-1]):
     ax.axvline(bx, color="red", linestyle="--", alpha=0.6)
     ax.text(bx, 0, f"{bx:.1f}", color="red", ha="center", va="bottom")
 ax.text(S_range[0], y_intercept, f"Y={y_intercept:.0f}", color="blue", va="bottom")
@@ -569,12 +390,6 @@ st.pyplot(fig)
 # ------------------- Strategy detection (use relative expiry + strike-step by index) -------------------
 
 
-def _normalize_offsets(items):
-    if not items:
-        return items
-    min_exp = min([e for (_,_,_,e) in items])
-    return [(t,q,rs,e-min_exp) for (t,q,rs,e) in items]
-
 def _build_actual_pattern(df_legs_local, spot, strike_step_guess=None, atm_exp_idx_guess=None):
     strikes_present = df_legs_local["Strike"].dropna().unique()
     if len(strikes_present) == 0:
@@ -618,43 +433,8 @@ def detect_strategy(df_legs_local, spot, strike_step_guess=None, atm_exp_idx_gue
     if not actual:
         return None
 
-    actual_norm = _normalize_offsets(actual)
-
-    best_match = None
-    best_score = float("inf")
-
-    for name, template in STRATEGY_TEMPLATES.items():
-        comps = template.get("components", [])
-        tpl = [(leg.get("type"),
-                int(np.sign(int(leg.get("qty",0)))),
-                int(leg.get("relative_strike",0)),
-                int(leg.get("relative_expiry",0)))
-                for leg in comps]
-        tpl_norm = _normalize_offsets(tpl)
-
-        if len(tpl_norm) != len(actual_norm):
-            continue
-
-        best_tpl_score = float("inf")
-        for actual_perm in itertools.permutations(actual_norm, len(tpl_norm)):
-            score = 0
-            ok = True
-            for t_leg, a_leg in zip(tpl_norm, actual_perm):
-                t_type,t_sign,t_rs,t_re = t_leg
-                a_type,a_sign,a_rs,a_re = a_leg
-                if t_type != a_type or t_sign != a_sign:
-                    ok = False; break
-                # allow strike mismatch of ±1 (score = diff)
-                score += abs(t_rs - a_rs)
-                # allow expiry mismatch of ±1 (score = diff)
-                score += abs(t_re - a_re)
-            if ok and score < best_tpl_score:
-                best_tpl_score = score
-        if best_tpl_score < best_score:
-            best_score = best_tpl_score
-            best_match = name
-
-    return best_match
+    # best template by min-cost pairing of legs, remembered per leg set (templates.TemplateMatcher)
+    return template_matcher.detect(actual)
 
 
 
@@ -677,8 +457,8 @@ st.write(f"- Net premium (sum premium * qty * multiplier): {total_premium:,.2f}"
 st.write(f"- Total Initial Margin (IM) estimate: {total_IM:,.2f}")
 st.write(f"- Total Maintenance Margin (MM) estimate: {total_MM:,.2f}")
 st.write(f"- Estimated fees (round trip): {total_fee:,.2f}")
-st.write(f"- Max profit @ expiry: {total_pnl_expiry.max():,.2f}")
-st.write(f"- Max loss @ expiry: {total_pnl_expiry.min():,.2f}")
+st.write(f"- Max profit @ expiry: {'Unlimited' if np.isinf(expiry_payoff.max_profit) else f'{expiry_payoff.max_profit:,.2f}'}")
+st.write(f"- Max loss @ expiry: {'Unlimited' if np.isinf(expiry_payoff.max_loss) else f'{expiry_payoff.max_loss:,.2f}'}")
 st.write(f"- Breakevens @ expiry: {', '.join(f'{b:.2f}' for b in breakevens) if breakevens else 'None'}")
 st.write(f"- Y-intercept @ expiry (left edge): {y_intercept:,.2f}")
 
@@ -686,12 +466,11 @@ st.write(f"- Y-intercept @ expiry (left edge): {y_intercept:,.2f}")
 st.subheader("Broke-point Analysis")
 equity_curve = init_balance + total_pnl_expiry
 # Find underlying prices where equity crosses zero
-sign_changes = np.where(np.diff(np.sign(equity_curve)) != 0)[0]
-broke_prices = [S_range[i] for i in sign_changes]
+broke_prices = expiry_payoff.crossings(-init_balance)
 if broke_prices:
     st.error(f"⚠️ Broke point(s): Underlying at {', '.join(f'{bp:.2f}' for bp in broke_prices)}")
 else:
-    st.success("✅ No broke point found within simulated price range.")
+    st.success("✅ No broke point found at any underlying price.")
 
 # Margin thresholds
 margin_call_prices = [S_range[i] for i in range(len(S_range)) if equity_curve[i] < total_MM]
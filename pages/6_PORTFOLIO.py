@@ -2,11 +2,13 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import json
 from pathlib import Path
 from datetime import date
 import sys
 from supabase import create_client
+# Add parent directory (app/) to Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from market_data import load_master, load_master_index
 
 # --- Setup Supabase ---
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
@@ -29,44 +31,20 @@ user_role = st.session_state.get("role", "guest")
 
 # ---------- Market Loader ----------
 MARKET_PATH = Path("data/market_data_S50OPTION.json")  # change per index (SET50, GF, etc.)
-
-def load_market(path: Path) -> pd.DataFrame:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            market_raw = json.load(f)
-        df = pd.DataFrame(market_raw)
-
-        # Normalize columns
-        df.columns = [c.strip() for c in df.columns]
-
-        # --- Price ---
-        if "Last" in df.columns:
-            df["LastPrice"] = pd.to_numeric(df["Last"], errors="coerce")
-        elif "Close" in df.columns:
-            df["LastPrice"] = pd.to_numeric(df["Close"], errors="coerce")
-        elif "SettlePrice" in df.columns:
-            df["LastPrice"] = pd.to_numeric(df["SettlePrice"], errors="coerce")
-        else:
-            df["LastPrice"] = np.nan
-
-        # --- Margin ---
-        if "IM" not in df.columns:
-            df["IM"] = np.nan
-        if "MM" not in df.columns:
-            df["MM"] = np.nan
-
-        # Ensure numeric
-        df["IM"] = pd.to_numeric(df["IM"], errors="coerce")
-        df["MM"] = pd.to_numeric(df["MM"], errors="coerce")
-
-        return df
-
-    except Exception as e:
-        st.error(f"Cannot read market JSON: {e}")
-        return pd.DataFrame(columns=["Series", "LastPrice", "IM", "MM"])
-
-# Load once
-df_market = load_market(MARKET_PATH)
+MARGIN_PATH = Path("data/margin_data_option.json")
+FUTURE_MARKET_PATH = Path("data/market_data_future.json")
+FUTURE_MARGIN_PATH = Path("data/margin_data_future.json")
+
+# Load once: instrument master (quotes + margins per series, shared per file version) and its
+# Series -> row index, so each leg is a dict hit instead of a scan of the market table
+df_master = load_master(MARKET_PATH, MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+if df_master.empty:
+    st.error(f"Cannot read market JSON: {MARKET_PATH}")
+market_index = load_master_index(MARKET_PATH, MARGIN_PATH, FUTURE_MARKET_PATH, FUTURE_MARGIN_PATH)
+# "Last" as this page has always reported it: the Last column, else Close, else SettlePrice
+# (not the master's Price, which falls back to the bid / offer mid)
+last_column = next((c for c in ("Last", "Close", "SettlePrice") if c in df_master.columns), None)
+last_prices = pd.to_numeric(df_master[last_column], errors="coerce").to_numpy(dtype=float) if last_column else np.full(len(df_master), np.nan)
 
 # ---------- Portfolio UI ----------
 st.set_page_config(page_title="Portfolio Report", layout="wide", page_icon="📋")
@@ -106,10 +84,13 @@ for strat in strategies:
         entry_price = leg.get("TradePrice", 0.0)
 
         # lookup market
-        mrow = df_market[df_market["Series"] == s]
-        last_price = mrow["LastPrice"].iloc[0] if not mrow.empty else np.nan
-        im = mrow["IM"].iloc[0] if not mrow.empty else np.nan
-        mm = mrow["MM"].iloc[0] if not mrow.empty else np.nan
+        pos = market_index.get(s)
+        last_price = last_prices[pos] if pos is not None else np.nan
+        # margin per contract x |Qty| on short options and futures, none on long options (as the
+        # strategy pages and scanner.py count it)
+        charged = pos is not None and (market_index.kind[pos] == "Future" or qty < 0)
+        im = abs(qty) * market_index.im[pos] if charged else (0.0 if pos is not None else np.nan)
+        mm = abs(qty) * market_index.mm[pos] if charged else (0.0 if pos is not None else np.nan)
 
         # P/L
         pl = (last_price - entry_price) * qty if not pd.isna(last_price) else np.nan
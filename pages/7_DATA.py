@@ -1,7 +1,5 @@
 # options_app.py
-import json
 import re
-import calendar
 from pathlib import Path
 from datetime import date
 import streamlit as st
@@ -13,6 +11,7 @@ import itertools
 import sys
 # Add parent directory (app/) to Python path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from market_data import load_future_market, load_option_market
 
 # Require login
 if "email" not in st.session_state:
@@ -45,22 +44,6 @@ def parse_num(x):
         except: return np.nan
     return np.nan
 
-def leg_type_from_series(series):
-    if not isinstance(series,str): return (None, np.nan)
-    if 'C' in series:
-        idx = series.rfind('C'); opt = 'Call'
-    elif 'P' in series:
-        idx = series.rfind('P'); opt = 'Put'
-    else:
-        return (None, np.nan)
-    strike_part = series[idx+1:]
-    try:
-        strike = float(strike_part)
-    except:
-        digits = ''.join(ch for ch in series if ch.isdigit())
-        strike = float(digits) if digits else np.nan
-    return (opt, strike)
-
 def choose_price_from_row(row):
     last = parse_num(row.get('Last')) if isinstance(row, dict) else parse_num(row.Last)
     bid = parse_num(row.get('Bid')) if isinstance(row, dict) else parse_num(getattr(row, "Bid", None))
@@ -94,32 +77,6 @@ def payoff_for_leg_bs(opt_type, K, qty, premium, multiplier, S_arr, T, rf, sigma
     prices = np.array([bs_price(opt_type, s, K, T, rf, sigma) for s in S_arr])
     return (prices - premium) * qty * multiplier
 
-# expiry parsing (month letter + 2-digit year)
-EXPIRY_ORDER = "FGHJKMNQUVXZ"
-MONTH_MAP = {"F":1,"G":2,"H":3,"J":4,"K":5,"M":6,"N":7,"Q":8,"U":9,"V":10,"X":11,"Z":12}
-def parse_expiry_code(series):
-    if not isinstance(series,str): return (None, np.nan, None)
-    if len(series) <= 7:
-        #future
-        letter = series[-3]
-        year2 = series[-2:]
-    else:
-        #option series
-        clean_series = series[:-4]
-        letter = clean_series[-3]
-        year2 = clean_series[-2:]
-    # m = re.search(r'([FGHJKMNQUVXZ])(\d{2})', series)
-    # if not m: return (None, np.nan, None)
-    # letter, year2 = m.group(1), m.group(2)
-    month = MONTH_MAP.get(letter, 1)
-    year = 2000 + int(year2)
-    cal = calendar.Calendar(firstweekday=0)
-    fridays = [d for d in cal.itermonthdates(year, month) if d.month == month and d.weekday() == 4]
-    # pick 3rd Friday if present else fallback to middle of month
-    expiry_date = fridays[2] if len(fridays) >= 3 else date(year, month, min(15,28))
-    idx = EXPIRY_ORDER.index(letter) + int(year2) * 12
-    return (letter + year2, idx, expiry_date)
-
 def years_to_expiry(expiry_date, today=None):
     if expiry_date is None or pd.isna(expiry_date): return np.nan
     today = today or date.today()
@@ -150,50 +107,22 @@ with st.sidebar.expander("Data file paths (change if needed)"):
     FUTURE_MARKET_PATH5 = Path(st.text_input("GO FUTURE Market JSON path", str(DEFAULT_MARKET_FUTURE_PATH5)))
 # load option market
 try:
-    df_market = pd.DataFrame(json.loads(OPTION_MARKET_PATH.read_text(encoding="utf-8")))
-    df_market.columns = [c.strip() for c in df_market.columns]
+    df_market = load_option_market(OPTION_MARKET_PATH)
 except Exception as e:
     st.error(f"Cannot read option market JSON: {e}")
     st.stop()
 
-# parse numeric-ish columns where present
-# for col in df_market.columns:
-#     if col not in ("Series","Name","Contract Month","Contract Year"):
-#         df_market[col] = df_market[col].apply(parse_num)
-
-# add parsed fields: TypeParsed, Strike, ExpiryIndex, ExpiryDate
-parsed = df_market["Series"].apply(leg_type_from_series)
-df_market["TypeParsed"] = parsed.apply(lambda x: x[0])
-df_market["Strike"] = parsed.apply(lambda x: x[1])
-eparse = df_market["Series"].apply(parse_expiry_code)
-df_market["ExpiryCode"] = eparse.apply(lambda x: x[0])
-df_market["ExpiryIndex"] = eparse.apply(lambda x: x[1])
-# df_market["ExpiryDate"] = eparse.apply(lambda x: x[2])
-df_market['ExpiryDate'] = pd.to_datetime(df_market['ExpiryDate']).dt.date
-
 # load future market (optional)
 try:
-    df_market_Future = pd.DataFrame(json.loads(FUTURE_MARKET_PATH.read_text(encoding="utf-8")))
-    # for col in df_market_Future.columns:
-    #     if col != "Series":
-    #         df_market_Future[col] = df_market_Future[col].apply(parse_num)
-    eparse_f = df_market_Future["Series"].apply(parse_expiry_code)
-    df_market_Future["ExpiryCode"] = eparse_f.apply(lambda x: x[0])
-    df_market_Future["ExpiryIndex"] = eparse_f.apply(lambda x: x[1])
-    # df_market_Future["ExpiryDate"] = eparse_f.apply(lambda x: x[2])
-    df_market_Future['ExpiryDate'] = pd.to_datetime(df_market_Future['ExpiryDate']).dt.date
-
-    df_market_Future2 = pd.DataFrame(json.loads(FUTURE_MARKET_PATH2.read_text(encoding="utf-8")))
-    df_market_Future2['ExpiryDate'] = pd.to_datetime(df_market_Future2['ExpiryDate']).dt.date
-
-    df_market_Future3 = pd.DataFrame(json.loads(FUTURE_MARKET_PATH3.read_text(encoding="utf-8")))
-    df_market_Future3['ExpiryDate'] = pd.to_datetime(df_market_Future3['ExpiryDate']).dt.date
-
-    df_market_Future4 = pd.DataFrame(json.loads(FUTURE_MARKET_PATH4.read_text(encoding="utf-8")))
-    df_market_Future4['ExpiryDate'] = pd.to_datetime(df_market_Future4['ExpiryDate']).dt.date    
-
-    df_market_Future5 = pd.DataFrame(json.loads(FUTURE_MARKET_PATH5.read_text(encoding="utf-8")))
-    df_market_Future5['ExpiryDate'] = pd.to_datetime(df_market_Future5['ExpiryDate']).dt.date
+    df_market_Future = load_future_market(FUTURE_MARKET_PATH)
+
+    df_market_Future2 = load_future_market(FUTURE_MARKET_PATH2)
+
+    df_market_Future3 = load_future_market(FUTURE_MARKET_PATH3)
+
+    df_market_Future4 = load_future_market(FUTURE_MARKET_PATH4)    
+
+    df_market_Future5 = load_future_market(FUTURE_MARKET_PATH5)
 
 except Exception:
     df_market_Future = pd.DataFrame()
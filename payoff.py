@@ -0,0 +1,92 @@
+# payoff.py
+# Exact expiry payoff of a position. Calls, puts and futures are all linear between strikes,
+# so the P/L at expiry is a piecewise-linear function of the underlying with kinks at the
+# strikes. Breakevens, extremes and the tail slopes come straight from the knots
+# (O(legs log legs)) instead of scanning a price grid; the grid is only needed for drawing.
+import numpy as np
+import pandas as pd
+
+
+class PiecewisePayoff:
+    # P/L(S) for S >= 0: value at S = 0 plus slope changes at the sorted knots
+
+    def __init__(self, knots, slopes, value0):
+        # knots: sorted strikes; slopes: slope on [0, k1], [k1, k2], ..., [kn, inf) (len(knots) + 1)
+        self.knots = np.asarray(knots, dtype=float)
+        self.slopes = np.asarray(slopes, dtype=float)
+        self.x = np.concatenate([[0.0], self.knots])
+        self.values = value0 + np.concatenate([[0.0], np.cumsum(self.slopes[:-1] * np.diff(self.x))])
+
+    @classmethod
+    def from_arrays(cls, opt_types, strikes, qty, premium, multiplier):
+        # opt_types: "Call" / "Put" / "Future" per leg; futures use premium as the entry price
+        types = np.asarray(opt_types, dtype=object)
+        K = np.asarray(strikes, dtype=float)
+        w = np.asarray(qty, dtype=float) * multiplier
+        prem = np.asarray(premium, dtype=float)
+        is_call, is_put, is_fut = types == "Call", types == "Put", types == "Future"
+        opt = is_call | is_put
+
+        # at S = 0: puts are worth K, calls nothing, futures -entry; every leg pays its premium
+        value0 = float(np.sum(np.where(is_put, K * w, 0.0)) - np.sum((prem * w)[opt | is_fut]))
+        slope0 = float(np.sum(w[is_fut]) - np.sum(w[is_put]))
+        # each option adds qty * multiplier of slope at its strike (call 0 -> 1, put -1 -> 0)
+        order = np.argsort(K[opt], kind="stable")
+        knots = K[opt][order]
+        slopes = slope0 + np.concatenate([[0.0], np.cumsum(w[opt][order])])
+        return cls(knots, slopes, value0)
+
+    @classmethod
+    def from_legs(cls, df_legs, multiplier):
+        legs = df_legs[df_legs["Type"].isin(("Call", "Put", "Future"))]
+        premium = pd.to_numeric(legs["TradePrice"], errors="coerce").to_numpy(dtype=float)
+        strikes = np.where(legs["Type"] == "Future", 0.0, pd.to_numeric(legs["Strike"], errors="coerce"))
+        return cls.from_arrays(legs["Type"].to_numpy(dtype=object), strikes, legs["Qty"].to_numpy(dtype=float), premium, multiplier)
+
+    def __call__(self, S):
+        S = np.asarray(S, dtype=float)
+        # np.interp clamps at the last knot, so add the right-tail slope past it
+        out = np.interp(S, self.x, self.values) + np.maximum(S - self.x[-1], 0.0) * self.slopes[-1]
+        return float(out) if out.ndim == 0 else out
+
+    @property
+    def slope_left(self):
+        return float(self.slopes[0])
+
+    @property
+    def slope_right(self):
+        return float(self.slopes[-1])
+
+    def crossings(self, level=0.0):
+        # exact S >= 0 where P/L crosses (or touches) level
+        v = self.values - level
+        x = self.x
+        out = []
+        for i in range(len(x) - 1):
+            if v[i] == 0:
+                out.append(x[i])
+            elif v[i] * v[i + 1] < 0:
+                out.append(x[i] - v[i] * (x[i + 1] - x[i]) / (v[i + 1] - v[i]))
+        if v[-1] == 0:
+            out.append(x[-1])
+        elif v[-1] * self.slopes[-1] < 0:
+            out.append(x[-1] - v[-1] / self.slopes[-1])
+        return [float(b) for b in dict.fromkeys(out)]
+
+    @property
+    def breakevens(self):
+        return self.crossings(0.0)
+
+    @property
+    def max_profit(self):
+        return np.inf if self.slope_right > 0 else float(self.values.max())
+
+    @property
+    def max_loss(self):
+        return -np.inf if self.slope_right < 0 else float(self.values.min())
+
+    def argmax(self):
+        return np.inf if self.slope_right > 0 else float(self.x[np.argmax(self.values)])
+
+    def argmin(self):
+        return np.inf if self.slope_right < 0 else float(self.x[np.argmin(self.values)])
@@ -0,0 +1,331 @@
+# pricing.py
+# Vectorized option pricing shared by the strategy pages.
+# Every function broadcasts over its array arguments, so a whole spot grid
+# (or a legs x spots matrix) is priced with a single NumPy call.
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr  # same kernel as scipy.stats.norm.cdf, without the dispatch overhead
+
+OPTION_TYPES = ("Call", "Put")
+GREEKS = ("delta", "gamma", "vega", "theta", "rho")
+LEG_CACHE_SIZE = 512
+
+
+def _col(x, dtype=float):
+    # leg parameters become column vectors so they broadcast against a spot row
+    return np.asarray(x, dtype=dtype).reshape(-1, 1)
+
+
+def _scalar_or_array(x):
+    return float(x) if np.ndim(x) == 0 else x
+
+
+def intrinsic_value(opt_type, S, K):
+    is_call = np.asarray(opt_type) == "Call"
+    return np.where(is_call, np.maximum(S - K, 0.0), np.maximum(K - S, 0.0))
+
+
+def _bs_terms(opt_type, S, K, T, rf, sigma):
+    # shared d1/d2 intermediates; dead legs (T <= 0, sigma <= 0 or NaN) get dummy T/sigma and are masked later
+    is_call, S, K, T, sigma = np.broadcast_arrays(
+        np.asarray(opt_type) == "Call",
+        np.asarray(S, dtype=float), np.asarray(K, dtype=float),
+        np.asarray(T, dtype=float), np.asarray(sigma, dtype=float),
+    )
+    live = ~((T <= 0) | (sigma <= 0) | np.isnan(sigma))
+    T_ = np.where(live, T, 1.0)
+    sig = np.where(live, sigma, 1.0)
+    sqrtT = np.sqrt(T_)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(S / K) + (rf + 0.5 * sig**2) * T_) / (sig * sqrtT)
+    d2 = d1 - sig * sqrtT
+    # w = +1 for calls, -1 for puts: put = K e^{-rT} N(-d2) - S N(-d1)
+    w = np.where(is_call, 1.0, -1.0)
+    return dict(is_call=is_call, S=S, K=K, T=T_, sigma=sig, sqrtT=sqrtT, live=live,
+                d1=d1, d2=d2, w=w, disc=K * np.exp(-rf * T_))
+
+
+def _bs_value(t):
+    price = t["w"] * (t["S"] * ndtr(t["w"] * t["d1"]) - t["disc"] * ndtr(t["w"] * t["d2"]))
+    intrinsic = np.where(t["is_call"], np.maximum(t["S"] - t["K"], 0.0), np.maximum(t["K"] - t["S"], 0.0))
+    return np.where(t["live"], price, intrinsic)
+
+
+def bs_price(opt_type, S, K, T, rf, sigma):
+    # Black-Scholes; T <= 0, sigma <= 0 or NaN sigma fall back to intrinsic (masked, not branched)
+    return _scalar_or_array(_bs_value(_bs_terms(opt_type, S, K, T, rf, sigma)))
+
+
+def bs_price_greeks(opt_type, S, K, T, rf, sigma):
+    # price plus the five Greeks from one set of d1/d2 terms.
+    # Units: vega / rho per 1 vol / rate point, theta per calendar day.
+    # Dead legs carry the intrinsic delta (0 / +-1) and zero for the other Greeks.
+    t = _bs_terms(opt_type, S, K, T, rf, sigma)
+    w, live = t["w"], t["live"]
+    Nd2 = ndtr(w * t["d2"])
+    pdf_d1 = np.exp(-0.5 * t["d1"] ** 2) / np.sqrt(2.0 * np.pi)
+    S_pdf = t["S"] * pdf_d1
+    itm = np.where(t["is_call"], t["S"] > t["K"], t["S"] < t["K"])
+    out = {
+        "price": _bs_value(t),
+        "delta": np.where(live, w * ndtr(w * t["d1"]), w * itm),
+        "gamma": np.where(live, pdf_d1 / (t["S"] * t["sigma"] * t["sqrtT"]), 0.0),
+        "vega": np.where(live, S_pdf * t["sqrtT"] / 100.0, 0.0),
+        "theta": np.where(live, (-S_pdf * t["sigma"] / (2.0 * t["sqrtT"]) - w * rf * t["disc"] * Nd2) / 365.0, 0.0),
+        "rho": np.where(live, w * t["T"] * t["disc"] * Nd2 / 100.0, 0.0),
+    }
+    return {k: _scalar_or_array(v) for k, v in out.items()}
+
+
+def payoff_for_leg_intrinsic(opt_type, K, qty, premium, multiplier, S_arr):
+    if opt_type == 'Call':
+        intrinsic = np.maximum(S_arr - K, 0.0)
+    elif opt_type == 'Put':
+        intrinsic = np.maximum(K - S_arr, 0.0)
+    else:  # Future
+        intrinsic = S_arr
+    return (intrinsic - premium) * qty * multiplier
+
+
+def payoff_for_leg_bs(opt_type, K, qty, premium, multiplier, S_arr, T, rf, sigma):
+    prices = bs_price(opt_type, S_arr, K, T, rf, sigma)
+    return (prices - premium) * qty * multiplier
+
+
+def payoff_matrix_bs(opt_types, K, qty, premium, multiplier, S_arr, T, rf, sigma, price_fn=bs_price):
+    # legs x spots P/L before expiry, one broadcast call for the whole position
+    # (price_fn: any pricer with bs_price's signature, see models.spot_pricer)
+    S_row = np.asarray(S_arr, dtype=float).reshape(1, -1)
+    prices = price_fn(np.asarray(opt_types).reshape(-1, 1), S_row, _col(K), _col(T), rf, _col(sigma))
+    return (prices - _col(premium)) * _col(qty) * multiplier
+
+
+def payoff_matrix_intrinsic(opt_types, K, qty, premium, multiplier, S_arr):
+    # legs x spots P/L at expiry; futures legs pay S - entry
+    S_row = np.asarray(S_arr, dtype=float).reshape(1, -1)
+    types = np.asarray(opt_types).reshape(-1, 1)
+    K = _col(K)
+    value = np.where(types == "Call", np.maximum(S_row - K, 0.0),
+                     np.where(types == "Put", np.maximum(K - S_row, 0.0), S_row))
+    return (value - _col(premium)) * _col(qty) * multiplier
+
+
+def years_to_expiry(expiry, today=None):
+    # vectorized counterpart of the pages' scalar helper (NaN for missing dates, floored at 0)
+    today = pd.Timestamp(today or date.today())
+    exp = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(expiry, dtype=object))), errors="coerce")
+    years = np.maximum((exp - today).dt.days.to_numpy(dtype=float) / 365.0, 0.0)
+    return _scalar_or_array(years[0]) if np.ndim(expiry) == 0 else years
+
+
+def leg_arrays(df_legs, T_scale=1.0, vol_shift_pct=0.0, today=None):
+    # per-leg parameter arrays for the option legs of df_legs, following the page conventions:
+    # IV in percent (0/NaN -> no vol -> intrinsic), missing expiry -> 0.25y (not time-scaled)
+    opts = df_legs[df_legs["Type"].isin(OPTION_TYPES)]
+    iv = pd.to_numeric(opts["IV"], errors="coerce").to_numpy(dtype=float)
+    sigma = np.where(iv != 0, iv / 100.0, np.nan)
+    sigma = np.where(np.isnan(sigma), np.nan, np.maximum(1e-6, sigma * (1.0 + vol_shift_pct / 100.0)))
+    expiry = opts["Expiry"].to_numpy(dtype=object)
+    has_exp = pd.notna(expiry)
+    T = np.full(len(opts), 0.25)
+    if has_exp.any():
+        T[has_exp] = years_to_expiry(expiry[has_exp], today) * T_scale
+    return {
+        "dated": has_exp,
+        "type": opts["Type"].to_numpy(dtype=object),
+        "strike": pd.to_numeric(opts["Strike"], errors="coerce").to_numpy(dtype=float),
+        "qty": opts["Qty"].to_numpy(dtype=int),
+        "premium": pd.to_numeric(opts["TradePrice"], errors="coerce").to_numpy(dtype=float),
+        "T": T,
+        "sigma": sigma,
+    }
+
+
+def _future_legs(df_legs):
+    futs = df_legs[df_legs["Type"] == "Future"]
+    return futs["Qty"].to_numpy(dtype=int), pd.to_numeric(futs["TradePrice"], errors="coerce").to_numpy(dtype=float)
+
+
+def _bumped_greeks(price_fn, opt_type, S, K, T, rf, sigma):
+    # bs_price_greeks for an arbitrary pricer: central differences in S, sigma and rf, one-day theta.
+    # Relative spot bump of 1% keeps gamma stable on lattice models.
+    h = 0.01 * S
+    up, mid, dn = price_fn(opt_type, S + h, K, T, rf, sigma), price_fn(opt_type, S, K, T, rf, sigma), price_fn(opt_type, S - h, K, T, rf, sigma)
+    return {
+        "price": mid,
+        "delta": (up - dn) / (2.0 * h),
+        "gamma": (up - 2.0 * mid + dn) / h**2,
+        "vega": (price_fn(opt_type, S, K, T, rf, sigma + 0.01) - price_fn(opt_type, S, K, T, rf, sigma - 0.01)) / 2.0,
+        "theta": price_fn(opt_type, S, K, np.maximum(T - 1 / 365.0, 0.0), rf, sigma) - mid,
+        "rho": (price_fn(opt_type, S, K, T, rf + 0.01, sigma) - price_fn(opt_type, S, K, T, rf - 0.01, sigma)) / 2.0,
+    }
+
+
+@lru_cache(maxsize=LEG_CACHE_SIZE)
+def _unit_leg_curves(opt_type, K, T, sigma, rf, grid, price_fn, with_greeks):
+    # price (and Greek) curves of one long unit of a leg over the spot grid; grid is the grid's raw
+    # bytes. Qty, premium and multiplier are applied by the caller, so editing a leg's size or
+    # trade price never reprices, and changing one leg reprices only that leg.
+    S = np.frombuffer(grid, dtype=float)
+    if with_greeks:
+        res = bs_price_greeks(opt_type, S, K, T, rf, sigma) if price_fn is bs_price else _bumped_greeks(price_fn, opt_type, S, K, T, rf, sigma)
+    else:
+        res = {"price": price_fn(opt_type, S, K, T, rf, sigma)}
+    res = {k: np.broadcast_to(np.asarray(v, dtype=float), S.shape) for k, v in res.items()}
+    for v in res.values():
+        v.flags.writeable = False
+    return res
+
+
+def _leg_curves(legs, S_range, rf, price_fn, with_greeks=False):
+    # legs x spots stacks of the cached unit curves; NaN sigma is keyed as -1 (no vol -> intrinsic)
+    # so that "no IV" legs hit the cache too
+    grid = np.ascontiguousarray(S_range, dtype=float).tobytes()
+    sigma = np.where(np.isnan(legs["sigma"]), -1.0, legs["sigma"])
+    curves = [_unit_leg_curves(str(t), float(k), float(T), float(sg), float(rf), grid, price_fn, with_greeks)
+              for t, k, T, sg in zip(legs["type"], legs["strike"], legs["T"], sigma)]
+    return {name: np.stack([c[name] for c in curves]) for name in curves[0]}
+
+
+def _position_curves(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, today, price_fn, with_greeks):
+    # (P/L at expiry, P/L before expiry, Greek curves or None) over S_range: option legs from the
+    # cached unit curves, futures linear in both P/L curves and contributing delta only.
+    # "Missing" placeholder legs contribute nothing.
+    total_pnl_expiry = np.zeros_like(S_range, dtype=float)
+    total_pnl_before = np.zeros_like(S_range, dtype=float)
+    greeks = {g: np.zeros_like(S_range, dtype=float) for g in GREEKS} if with_greeks else None
+
+    legs = leg_arrays(df_legs, T_scale, vol_shift_pct, today)
+    if legs["type"].size:
+        res = _leg_curves(legs, S_range, rf, price_fn, with_greeks=with_greeks)
+        scale = _col(legs["qty"]) * multiplier
+        total_pnl_expiry += payoff_matrix_intrinsic(legs["type"], legs["strike"], legs["qty"], legs["premium"], multiplier, S_range).sum(axis=0)
+        total_pnl_before += ((res["price"] - _col(legs["premium"])) * scale).sum(axis=0)
+        if with_greeks:
+            for g in GREEKS:
+                greeks[g] += (res[g] * scale).sum(axis=0)
+
+    fut_qty, fut_price = _future_legs(df_legs)
+    if fut_qty.size:
+        fut_pnl = payoff_matrix_intrinsic(np.full(fut_qty.size, "Future", dtype=object), np.zeros(fut_qty.size),
+                                          fut_qty, fut_price, multiplier, S_range).sum(axis=0)
+        total_pnl_expiry += fut_pnl
+        total_pnl_before += fut_pnl
+        if with_greeks:
+            greeks["delta"] += float(fut_qty.sum()) * multiplier
+    return total_pnl_expiry, total_pnl_before, greeks
+
+
+def position_payoff(df_legs, S_range, multiplier, rf, T_scale=1.0, vol_shift_pct=0.0, today=None, price_fn=bs_price):
+    # (P/L at expiry, P/L before expiry) over S_range for every leg in df_legs;
+    # "Missing" placeholder legs contribute nothing
+    return _position_curves(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, today, price_fn, False)[:2]
+
+
+def position_payoff_greeks(df_legs, S_range, multiplier, rf, T_scale=1.0, vol_shift_pct=0.0, today=None, price_fn=bs_price):
+    # position_payoff plus position-level Greek curves from the same per-leg cached curves.
+    # Returns (pnl_expiry, pnl_before, greeks); greeks maps name -> curve over S_range,
+    # already scaled by qty * multiplier. Futures only contribute delta.
+    # Closed-form Greeks for Black-Scholes, bumped revaluation for any other price_fn.
+    return _position_curves(df_legs, S_range, multiplier, rf, T_scale, vol_shift_pct, today, price_fn, True)
+
+
+def implied_vol(opt_type, price, S, K, T, rf, tol=1e-6, max_iter=100, sigma_lo=1e-4, sigma_hi=5.0):
+    # Batched implied volatility: safeguarded Newton on every series at once, falling back to
+    # bisection whenever the Newton step leaves the [lo, hi] bracket or vega vanishes.
+    # Prices outside the no-arbitrage bounds, T <= 0 or missing inputs give NaN.
+    out_shape = np.broadcast(np.asarray(opt_type), np.asarray(price), np.asarray(S), np.asarray(K), np.asarray(T)).shape
+    is_call, price, S, K, T = (np.ravel(a) for a in np.broadcast_arrays(
+        np.asarray(opt_type) == "Call", np.asarray(price, dtype=float),
+        np.asarray(S, dtype=float), np.asarray(K, dtype=float), np.asarray(T, dtype=float)))
+    with np.errstate(invalid="ignore"):
+        disc = K * np.exp(-rf * T)
+        lower = np.where(is_call, np.maximum(S - disc, 0.0), np.maximum(disc - S, 0.0))
+        upper = np.where(is_call, S, disc)
+        ok = (T > 0) & (S > 0) & (K > 0) & (price > lower) & (price < upper)
+
+    n = price.size
+    lo = np.full(n, sigma_lo)
+    hi = np.full(n, sigma_hi)
+    # Brenner-Subrahmanyam ATM guess, clipped into the bracket
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.clip(np.sqrt(2.0 * np.pi / T) * price / S, 0.05, 1.0)
+    sigma = np.where(ok, sigma, np.nan)
+    converged = np.zeros(n, dtype=bool)
+    active = np.flatnonzero(ok)
+    types = np.where(is_call, "Call", "Put")
+
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        t = _bs_terms(types[active], S[active], K[active], T[active], rf, sigma[active])
+        diff = _bs_value(t) - price[active]
+        vega = t["S"] * np.exp(-0.5 * t["d1"] ** 2) / np.sqrt(2.0 * np.pi) * t["sqrtT"]
+        sig = sigma[active]
+        # the BS price is increasing in sigma, so the sign of diff tightens the bracket
+        hi[active] = np.where(diff > 0, sig, hi[active])
+        lo[active] = np.where(diff < 0, sig, lo[active])
+        done = (np.abs(diff) < tol) | (hi[active] - lo[active] < 1e-12)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = sig - diff / vega
+        bad = ~np.isfinite(newton) | (newton <= lo[active]) | (newton >= hi[active])
+        sigma[active] = np.where(done, sig, np.where(bad, 0.5 * (lo[active] + hi[active]), newton))
+        converged[active[done]] = True
+        active = active[~done]
+
+    return _scalar_or_array(np.where(converged, sigma, np.nan).reshape(out_shape))
+
+
+def chain_quote_price(df_market):
+    # quote used for IV: Last, else Bid/Offer mid, else Prior SP (zeros count as "no quote").
+    # Returns (price, source label) arrays aligned with df_market.
+    def col(name):
+        if name not in df_market.columns:
+            return np.full(len(df_market), np.nan)
+        v = pd.to_numeric(df_market[name], errors="coerce").to_numpy(dtype=float)
+        return np.where(v > 0, v, np.nan)
+
+    last, bid, offer, prior = col("Last"), col("Bid"), col("Offer"), col("Prior SP")
+    mid = (bid + offer) / 2.0
+    price = np.where(~np.isnan(last), last, np.where(~np.isnan(mid), mid, prior))
+    source = np.where(~np.isnan(last), "Last", np.where(~np.isnan(mid), "Mid", np.where(~np.isnan(prior), "Prior SP", "")))
+    return price, source
+
+
+def chain_implied_vols(df_market, rf, today=None):
+    # solve IV (in percent, like "IV LAST") for every option row of an enriched market frame
+    # in one batched call; needs TypeParsed, Strike, ExpiryDate and UNDERLYING PRICE
+    price, source = chain_quote_price(df_market)
+    S = pd.to_numeric(df_market["UNDERLYING PRICE"], errors="coerce").to_numpy(dtype=float)
+    K = pd.to_numeric(df_market["Strike"], errors="coerce").to_numpy(dtype=float)
+    T = years_to_expiry(df_market["ExpiryDate"].to_numpy(dtype=object), today)
+    types = df_market["TypeParsed"].to_numpy(dtype=object)
+    is_opt = np.isin(types, OPTION_TYPES)
+    iv = np.full(len(df_market), np.nan)
+    if is_opt.any():
+        iv[is_opt] = implied_vol(types[is_opt].astype(str), price[is_opt], S[is_opt], K[is_opt], T[is_opt], rf) * 100.0
+    return pd.DataFrame({"IV SOLVED": iv, "IV SOURCE": np.where(np.isnan(iv), "", source)}, index=df_market.index)
+
+
+def position_pnl_grid(df_legs, S_range, days_elapsed, multiplier, rf, vol_shift_pct=0.0, today=None, price_fn=bs_price):
+    # P/L of the whole position on a (days elapsed x spot) grid, one legs x days x spots broadcast.
+    # Each option leg's time left is its own T minus the elapsed days, so legs that expire inside
+    # the grid switch to intrinsic from that column on.
+    S_arr = np.asarray(S_range, dtype=float)
+    days = np.asarray(days_elapsed, dtype=float)
+    grid = np.zeros((days.size, S_arr.size))
+
+    legs = leg_arrays(df_legs, 1.0, vol_shift_pct, today)
+    if legs["type"].size:
+        T = np.maximum(legs["T"].reshape(-1, 1) - days.reshape(1, -1) / 365.0, 0.0)[:, :, None]
+        prices = price_fn(legs["type"].reshape(-1, 1, 1), S_arr.reshape(1, 1, -1),
+                          legs["strike"].reshape(-1, 1, 1), T, rf, legs["sigma"].reshape(-1, 1, 1))
+        grid += ((prices - legs["premium"].reshape(-1, 1, 1)) * legs["qty"].reshape(-1, 1, 1) * multiplier).sum(axis=0)
+
+    fut_qty, fut_price = _future_legs(df_legs)
+    if fut_qty.size:
+        grid += ((S_arr.reshape(1, -1) - _col(fut_price)) * _col(fut_qty) * multiplier).sum(axis=0)
+    return grid
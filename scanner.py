@@ -0,0 +1,263 @@
+# scanner.py
+# Whole-chain strategy scanner: every template of st_template.json instantiated at every ATM
+# strike and expiry anchor of the loaded chain, with expiry max profit / max loss / breakevens,
+# net premium, IM / MM, fees and return on capital for all instances.
+# An instance is valid when every component exists exactly at its strike / expiry offset (the
+# exact-match lookup of templates.TemplateResolver, no nearest-strike fallbacks), so a template
+# is instantiated over all anchors at once with array lookups, and its metrics are computed in
+# one batch over (instances x legs) arrays with the same piecewise-linear expiry payoff as
+# payoff.PiecewisePayoff. Templates are read from templates.CompiledTemplates (one leg array per
+# field), and full chains spread the templates over a process pool. Legs are priced with
+# pricing.chain_quote_price (zero Bid / Offer / Last mean "no quote"); series with neither a
+# last nor a two-sided quote count as missing, so instances using them are not produced. Templates whose legs span
+# several expiries (calendars, diagonals) are left out: their P/L at the first expiry depends on
+# the value of the later legs, which single-expiry metrics cannot give.
+# Scan from the command line (repo root):
+#   python scanner.py [--group "Directional Strategies (Bullish)"] [--by ReturnOnMargin] [--top 20]
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from instruments import InstrumentIndex
+from pricing import chain_quote_price
+from templates import TYPE_CODES, CompiledTemplates
+
+POOL_MIN_ANCHORS = 5_000  # chains with fewer strike x expiry anchors scan in-process (pool start-up costs ~1 s)
+RESULT_COLUMNS = ["Template", "Group", "ATMStrike", "ExpiryIndex", "Legs", "NetPremium", "MaxProfit",
+                  "MaxLoss", "Breakevens", "IM", "MM", "Fees", "Capital", "ReturnOnMargin"]
+PNL_TOLERANCE = 1e-9  # relative to a position's largest |P/L| at the knots; smaller values are 0
+
+
+class ChainScan:
+    # the arrays a scan needs, picklable for the worker processes
+    # resolver: templates.TemplateResolver of the chain; master: instruments.build_master frame
+
+    def __init__(self, resolver, master, multiplier, fee_option=0.0, fee_future=0.0):
+        index = InstrumentIndex(master)
+        self.series = index.series
+        opt_type = master["TypeParsed"].to_numpy(dtype=object) if "TypeParsed" in master.columns else np.full(len(master), None, dtype=object)
+        self.type = np.array([TYPE_CODES.get("Future" if k == "Future" else t, -1) for k, t in zip(index.kind, opt_type)], dtype=np.intp)
+        self.strike, self.im, self.mm = index.strike, index.im, index.mm
+        price, source = chain_quote_price(master)
+        self.price = np.where(np.isin(source, ("Last", "Mid")), price, np.nan)
+        # master position of each chain row / of the first future of each chain expiry (-1: none
+        # or not quoted)
+        self.exact = resolver.exact
+        self.option_pos = self._quoted(np.array([index.pos.get(s, -1) for s in resolver.series], dtype=np.intp))
+        self.future_pos = self._quoted(np.array([index.pos.get(resolver.futures.get(e, [None])[0], -1) for e in resolver.expiries], dtype=np.intp))
+        self.strikes, self.expiries = resolver.strikes, resolver.expiries
+        self.multiplier, self.fee_option, self.fee_future = multiplier, fee_option, fee_future
+
+    def _quoted(self, pos):
+        return np.where((pos >= 0) & np.isfinite(self.price[np.maximum(pos, 0)]), pos, -1) if len(self.price) else pos
+
+    @property
+    def n_anchors(self):
+        return len(self.strikes) * len(self.expiries)
+
+    def instances(self, compiled, i):
+        # (anchor strike positions, anchor expiry positions, master positions (instances, legs))
+        # of every exact instantiation of template i, one per distinct leg set
+        rows = compiled.rows(i)
+        types, rs, re = compiled.type[rows], compiled.rel_strike[rows], compiled.rel_expiry[rows]
+        a_strike, a_exp = np.divmod(np.arange(self.n_anchors), len(self.expiries)) if self.n_anchors else (np.empty(0, np.intp),) * 2
+        if not len(types):
+            return a_strike[:0], a_exp[:0], np.empty((0, 0), dtype=np.intp)
+        si = a_strike[:, None] + rs[None, :]
+        ei = a_exp[:, None] + re[None, :]
+        ok = (ei >= 0) & (ei < len(self.expiries)) & (((si >= 0) & (si < len(self.strikes))) | (types == 2))
+        si, ei = np.where(ok, si, 0), np.where(ok, ei, 0)
+        pos = np.full(si.shape, -1, dtype=np.intp)
+        for t in (0, 1):
+            cols = types == t
+            if cols.any() and self.exact.size:
+                rows = self.exact[t, si[:, cols], ei[:, cols]]
+                pos[:, cols] = np.where(rows >= 0, self.option_pos[np.maximum(rows, 0)], -1)
+        if (types == 2).any() and self.future_pos.size:
+            pos[:, types == 2] = self.future_pos[ei[:, types == 2]]
+        pos[~ok] = -1
+        valid = (pos >= 0).all(axis=1)
+        if pos.shape[1] > 1:
+            ordered = np.sort(pos, axis=1)
+            valid &= (ordered[:, 1:] != ordered[:, :-1]).all(axis=1)
+        a_strike, a_exp, pos = a_strike[valid], a_exp[valid], pos[valid]
+        # templates without a strike offset (futures only) repeat across strike anchors
+        _, first = np.unique(pos, axis=0, return_index=True)
+        first = np.sort(first)
+        return a_strike[first], a_exp[first], pos[first]
+
+    def scan(self, compiled, i):
+        # one row per instance of template i, columns RESULT_COLUMNS (none for a template whose
+        # legs span several expiries)
+        if np.unique(compiled.rel_expiry[compiled.rows(i)]).size > 1:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        a_strike, a_exp, pos = self.instances(compiled, i)
+        if not len(pos):
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        qty1 = compiled.qty[compiled.rows(i)].astype(float)
+        qty = np.broadcast_to(qty1, pos.shape)
+        types = self.type[pos]
+        is_opt = (types == 0) | (types == 1)
+        strikes = np.where(is_opt, self.strike[pos], 0.0)
+        max_profit, max_loss, premium, breakevens = expiry_metrics(types, strikes, qty, self.price[pos], self.multiplier)
+        # margins: short options and futures carry IM / MM per contract, long options none; a
+        # charged leg without a margin record leaves the instance's IM / MM NaN (not free)
+        charged = (types == 2) | (is_opt & (qty < 0))
+        im = np.sum(np.where(charged, np.abs(qty) * self.im[pos], 0.0), axis=1)
+        mm = np.sum(np.where(charged, np.abs(qty) * self.mm[pos], 0.0), axis=1)
+        contracts_opt = np.sum(np.where(is_opt, np.abs(qty), 0.0), axis=1)
+        contracts_fut = np.sum(np.where(types == 2, np.abs(qty), 0.0), axis=1)
+        fees = self.fee_option * contracts_opt * 2 + self.fee_future * contracts_fut * 2
+        # capital: margin plus the premium paid; return: max profit net of fees per unit of it
+        # (NaN for unbounded profit, so those rows rank after every finite one)
+        capital = im + np.maximum(premium, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rom = np.where((capital > 0) & np.isfinite(max_profit), (max_profit - fees) / capital, np.nan)
+        legs = [" / ".join(f"{int(q):+d} {s}" for s, q in zip(self.series[row], qty1)) for row in pos]
+        return pd.DataFrame({
+            "Template": compiled.names[i],
+            "Group": compiled.groups[i],
+            "ATMStrike": self.strikes[a_strike],
+            "ExpiryIndex": self.expiries[a_exp],
+            "Legs": legs,
+            "NetPremium": premium,
+            "MaxProfit": max_profit,
+            "MaxLoss": max_loss,
+            "Breakevens": [tuple(float(b) for b in row[~np.isnan(row)]) for row in breakevens],
+            "IM": im,
+            "MM": mm,
+            "Fees": fees,
+            "Capital": capital,
+            "ReturnOnMargin": rom,
+        }, columns=RESULT_COLUMNS)
+
+
+_WORKER = {}
+
+
+def _init_worker(chain, compiled):
+    _WORKER["chain"], _WORKER["compiled"] = chain, compiled
+
+
+def _scan_in_worker(indices):
+    return [_WORKER["chain"].scan(_WORKER["compiled"], i) for i in indices]
+
+
+def expiry_metrics(types, strikes, qty, price, multiplier):
+    # expiry P/L of many positions at once; arguments are (instances, legs) arrays, padded legs
+    # have qty 0. types: TYPE_CODES; futures use price as the entry. Returns max profit, max loss
+    # (+-inf when unbounded), net premium and the breakevens as one NaN-padded ascending row per
+    # instance.
+    w = qty * multiplier
+    is_call, is_put, is_fut = types == 0, types == 1, types == 2
+    opt = is_call | is_put
+    # P/L is linear between option strikes: evaluate it at S = 0 and at every strike
+    x = np.sort(np.concatenate([np.zeros((len(types), 1)), np.where(opt, strikes, 0.0)], axis=1), axis=1)
+    S = x[:, :, None]
+    leg = np.where(is_call[:, None, :], np.maximum(S - strikes[:, None, :], 0.0) - price[:, None, :],
+          np.where(is_put[:, None, :], np.maximum(strikes[:, None, :] - S, 0.0) - price[:, None, :],
+          np.where(is_fut[:, None, :], S - price[:, None, :], 0.0)))
+    values = np.sum(leg * w[:, None, :], axis=2)  # NaN for an unquoted leg
+    # float noise from offsetting legs (e.g. 2e-13 on a flat butterfly wing) is exactly 0
+    tol = PNL_TOLERANCE * np.nanmax(np.abs(values), axis=1, initial=1.0)[:, None]
+    values = np.where(np.abs(values) <= tol, 0.0, values)
+    slope_right = np.sum(np.where(is_call | is_fut, w, 0.0), axis=1)
+    max_profit = np.where(slope_right > 0, np.inf, values.max(axis=1))
+    max_loss = np.where(slope_right < 0, -np.inf, values.min(axis=1))
+    premium = np.sum(np.where(opt, price * w, 0.0), axis=1)
+    premium = np.where(np.abs(premium) <= tol[:, 0], 0.0, premium)
+
+    # breakevens: sign changes between knots, the right tail, and zero knots where P/L leaves 0
+    # on at least one side (inside a flat zero stretch, e.g. S = 0 under a zero-cost wing, is none)
+    v0, v1 = values[:, :-1], values[:, 1:]
+    x0, x1 = x[:, :-1], x[:, 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = np.where(v0 * v1 < 0, x0 - v0 * (x1 - x0) / (v1 - v0), np.nan)
+        tail = np.where(values[:, -1] * slope_right < 0, x[:, -1] - values[:, -1] / slope_right, np.nan)
+    left = np.concatenate([np.zeros((len(values), 1)), v0], axis=1) != 0
+    right = np.concatenate([v1, slope_right[:, None]], axis=1) != 0
+    edge = (values == 0) & (left | right)
+    cands = np.concatenate([np.where(edge, x, np.nan), between, tail[:, None]], axis=1)
+    cands = np.sort(cands, axis=1)
+    # drop repeats (a zero knot shared by two strikes)
+    cands[:, 1:][cands[:, 1:] == cands[:, :-1]] = np.nan
+    return max_profit, max_loss, premium, np.sort(cands, axis=1)
+
+
+def scan_chain(resolver, master, templates, multiplier, fee_option=0.0, fee_future=0.0, workers=None):
+    # every exact instantiation of every template over the chain, columns RESULT_COLUMNS, in
+    # template order. templates: a templates.CompiledTemplates (or the parsed template file).
+    # NetPremium is premium paid (negative for a credit); IM / MM count short options and
+    # futures, as the pages do (NaN when a charged leg has no margin record); Capital is IM plus
+    # premium paid; ReturnOnMargin is (MaxProfit - Fees) / Capital, NaN for unbounded profit or
+    # unknown capital. Multi-expiry templates are skipped.
+    # workers: process count (None: os.cpu_count() for chains of POOL_MIN_ANCHORS or more
+    # anchors, else in-process).
+    compiled = templates if isinstance(templates, CompiledTemplates) else CompiledTemplates(templates)
+    chain = ChainScan(resolver, master, multiplier, fee_option, fee_future)
+    n = len(compiled)
+    if workers is None:
+        workers = (os.cpu_count() or 1) if chain.n_anchors >= POOL_MIN_ANCHORS else 1
+    if workers <= 1 or n <= 1:
+        parts = [chain.scan(compiled, i) for i in range(n)]
+    else:
+        chunks = [range(i, n, workers) for i in range(workers)]
+        # spawn, not fork: the pages run inside a threaded server
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(chain, compiled)) as pool:
+            done = dict(zip(range(workers), pool.map(_scan_in_worker, chunks)))
+        # back into template order
+        parts = [done[i % workers][i // workers] for i in range(n)]
+    parts = [df for df in parts if len(df)]
+    if not parts:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def rank_instances(df, by="ReturnOnMargin", ascending=False, group=None, expiry=None, credit_only=False, top=None):
+    # filtered, sorted view of scan_chain's result (NaN last)
+    if group is not None:
+        df = df[df["Group"] == group]
+    if expiry is not None:
+        df = df[df["ExpiryIndex"] == expiry]
+    if credit_only:
+        df = df[df["NetPremium"] < 0]
+    df = df.sort_values(by, ascending=ascending, na_position="last", kind="stable").reset_index(drop=True)
+    return df.head(top) if top else df
+
+
+def main(argv=None):
+    from market_data import load_compiled_templates, load_master, load_template_resolver
+
+    data = Path(__file__).resolve().parent / "data"
+    parser = argparse.ArgumentParser(description="Rank every template instantiation over an option chain")
+    parser.add_argument("--market", default=str(data / "market_data_S50OPTION.json"))
+    parser.add_argument("--margin", default=str(data / "margin_data_option.json"))
+    parser.add_argument("--future-market", default=str(data / "market_data_S50.json"))
+    parser.add_argument("--future-margin", default=str(data / "margin_data_future.json"))
+    parser.add_argument("--templates", default=str(data / "st_template.json"))
+    parser.add_argument("--multiplier", type=float, default=200.0)
+    parser.add_argument("--group")
+    parser.add_argument("--expiry", type=int)
+    parser.add_argument("--credit-only", action="store_true")
+    parser.add_argument("--by", default="ReturnOnMargin", choices=RESULT_COLUMNS)
+    parser.add_argument("--ascending", action="store_true")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    resolver = load_template_resolver(args.market, args.future_market)
+    master = load_master(args.market, args.margin, args.future_market, args.future_margin)
+    df = scan_chain(resolver, master, load_compiled_templates(args.templates), args.multiplier, workers=args.workers)
+    print(f"{len(df):,} instances")
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_colwidth", 60):
+        print(rank_instances(df, args.by, args.ascending, args.group, args.expiry, args.credit_only, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# scenarios.py
+# Scenario cube: P/L of a whole position over spot x IV shift x time scale in one vectorized
+# evaluation. The UI slices the returned tensor instead of rerunning the page for every
+# what-if. Cubes live in an LRU cache keyed by a canonical (order-independent) form of the legs
+# and the pricer (models.spot_pricer returns one function object per model and basis).
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from pricing import bs_price, leg_arrays
+
+LEG_KEY_COLUMNS = ("Series", "Type", "Strike", "Qty", "TradePrice", "IV", "Expiry")
+
+
+def _canon(v):
+    if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NaT:
+        return None
+    if isinstance(v, (np.integer, int)) and not isinstance(v, bool):
+        return int(v)
+    if isinstance(v, (np.floating, float)):
+        return round(float(v), 10)
+    if hasattr(v, "isoformat"):
+        return v.isoformat()[:10]
+    return str(v)
+
+
+def legs_key(df_legs):
+    # canonical, hashable form of the legs that affect pricing: sorted so leg order doesn't matter
+    cols = [c for c in LEG_KEY_COLUMNS if c in df_legs.columns]
+    rows = sorted((tuple(_canon(v) for v in row) for row in df_legs[cols].itertuples(index=False)), key=repr)
+    return tuple(cols), tuple(rows)
+
+
+def _legs_from_key(key):
+    cols, rows = key
+    df = pd.DataFrame(list(rows), columns=list(cols))
+    if "Expiry" in df.columns:
+        df["Expiry"] = pd.to_datetime(df["Expiry"], errors="coerce").dt.date
+    return df
+
+
+def position_scenario_cube(df_legs, spots, vol_shifts_pct, time_scales, multiplier, rf, today=None, price_fn=bs_price):
+    # P/L tensor of shape (len(spots), len(vol_shifts_pct), len(time_scales)).
+    # Vol shift and time scale follow the page's sidebar semantics (sigma * (1 + shift/100),
+    # T * scale); futures are linear in spot and unaffected by either. price_fn: any pricer with
+    # bs_price's signature (see models.spot_pricer).
+    S = np.asarray(spots, dtype=float)
+    v = np.asarray(vol_shifts_pct, dtype=float)
+    ts = np.asarray(time_scales, dtype=float)
+    cube = np.zeros((S.size, v.size, ts.size))
+
+    legs = leg_arrays(df_legs, 1.0, 0.0, today)
+    if legs["type"].size:
+        # axes: legs x spot x vol x time
+        sigma = legs["sigma"].reshape(-1, 1) * (1.0 + v.reshape(1, -1) / 100.0)
+        sigma = np.where(np.isnan(sigma), np.nan, np.maximum(1e-6, sigma))[:, None, :, None]
+        T = np.where(legs["dated"].reshape(-1, 1), legs["T"].reshape(-1, 1) * ts.reshape(1, -1), legs["T"].reshape(-1, 1))[:, None, None, :]
+        prices = price_fn(legs["type"].reshape(-1, 1, 1, 1), S.reshape(1, -1, 1, 1),
+                          legs["strike"].reshape(-1, 1, 1, 1), T, rf, sigma)
+        cube += ((prices - legs["premium"].reshape(-1, 1, 1, 1)) * legs["qty"].reshape(-1, 1, 1, 1) * multiplier).sum(axis=0)
+
+    futs = df_legs[df_legs["Type"] == "Future"]
+    if not futs.empty:
+        qty = futs["Qty"].to_numpy(dtype=float)
+        entry = pd.to_numeric(futs["TradePrice"], errors="coerce").to_numpy(dtype=float)
+        cube += ((S.reshape(-1, 1) - entry.reshape(1, -1)) * qty * multiplier).sum(axis=1)[:, None, None]
+    return cube
+
+
+@lru_cache(maxsize=64)
+def _cached_cube(key, spots, vol_shifts_pct, time_scales, multiplier, rf, today, price_fn):
+    cube = position_scenario_cube(_legs_from_key(key), spots, vol_shifts_pct, time_scales, multiplier, rf, today, price_fn)
+    cube.flags.writeable = False  # shared between callers
+    return cube
+
+
+def scenario_cube(df_legs, spots, vol_shifts_pct, time_scales, multiplier, rf, today=None, price_fn=bs_price):
+    # cached entry point: repeated what-ifs on the same legs and axes are a dict lookup
+    return _cached_cube(legs_key(df_legs), tuple(np.asarray(spots, dtype=float).tolist()),
+                        tuple(np.asarray(vol_shifts_pct, dtype=float).tolist()),
+                        tuple(np.asarray(time_scales, dtype=float).tolist()),
+                        float(multiplier), float(rf), today or date.today(), price_fn)
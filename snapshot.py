@@ -0,0 +1,85 @@
+# snapshot.py
+# Typed columnar snapshots of the market JSON files.
+# The JSON feeds mix numbers, numeric strings ("830.4", "133435"), "" and null in the same
+# column. A snapshot stores every column as one .npy file with a real dtype (float64 / int64 /
+# datetime64[D] / fixed-width unicode) plus a meta.json, so it opens with np.load(mmap_mode="r")
+# instead of being parsed: numeric columns are zero-copy views of the file.
+#
+#   data/snapshots/<json stem>/meta.json   {"source": [mtime_ns, size], "kind": ..., "columns": [...]}
+#   data/snapshots/<json stem>/<i>.npy     column i
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+MISSING = ("", "-", "--", "NA", "NaN", "nan", "None")
+DATE_COLUMNS = ("ExpiryDate",)
+SNAPSHOT_DIRNAME = "snapshots"
+
+
+def snapshot_dir(json_path):
+    json_path = Path(json_path)
+    return json_path.parent / SNAPSHOT_DIRNAME / json_path.stem
+
+
+def _missing(col):
+    return col.isna() | col.astype(str).str.strip().isin(MISSING)
+
+
+def typed_column(name, col):
+    # one column -> (numpy array, dtype tag). Numeric strings become numbers; a column is numeric
+    # only if every non-missing value parses, and int64 only if it is also complete and integral.
+    if name in DATE_COLUMNS:
+        return pd.to_datetime(col, errors="coerce").to_numpy(dtype="datetime64[D]"), "date"
+    if pd.api.types.is_bool_dtype(col):
+        return col.to_numpy(dtype=bool), "bool"
+    missing = _missing(col)
+    num = pd.to_numeric(col.where(~missing).astype(str).str.replace(",", "", regex=False).where(~missing), errors="coerce")
+    if num.notna().sum() == (~missing).sum():
+        values = num.to_numpy(dtype=float)
+        # floats stay floats even when integral (strikes parsed as 750.0 keep their dtype)
+        written_as_int = col.map(lambda v: isinstance(v, (int, np.integer)) or (isinstance(v, str) and not any(ch in v for ch in ".eE"))).all()
+        if written_as_int and not missing.any() and np.all(np.mod(values, 1.0) == 0.0):
+            return values.astype(np.int64), "int"
+        return values, "float"
+    return col.where(~missing, "").astype(str).to_numpy(dtype=str), "str"
+
+
+def column_values(values, tag):
+    # stored array -> DataFrame column values; pages work with datetime.date objects
+    # (same as .dt.date on the JSON path)
+    if tag == "date":
+        values = pd.to_datetime(np.asarray(values)).date
+        return np.where(pd.isna(values), None, values)
+    return values
+
+
+def write_snapshot(df, out_dir, source, kind):
+    # source: (mtime_ns, size) of the JSON the frame came from, checked by read_snapshot
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        values, tag = typed_column(name, df[name])
+        np.save(out_dir / f"{i}.npy", values, allow_pickle=False)
+        columns.append({"name": name, "type": tag})
+    meta = {"source": list(source), "kind": kind, "rows": int(len(df)), "columns": columns}
+    (out_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=1), encoding="utf-8")
+    return out_dir
+
+
+def read_meta(out_dir):
+    path = Path(out_dir) / "meta.json"
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+
+def read_snapshot(out_dir, mmap=True):
+    # DataFrame over the column files; numeric columns stay memory-mapped (read-only)
+    out_dir = Path(out_dir)
+    meta = read_meta(out_dir)
+    data = {}
+    for i, col in enumerate(meta["columns"]):
+        values = np.load(out_dir / f"{i}.npy", mmap_mode="r" if mmap else None, allow_pickle=False)
+        data[col["name"]] = column_values(values, col["type"])
+    return pd.DataFrame(data, copy=False)
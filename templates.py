@@ -0,0 +1,320 @@
+# templates.py
+# Strategy templates (st_template.json) against a loaded option chain.
+# TemplateResolver picks the series for each template component exactly as the pages' seven-step
+# cascade does (exact strike/expiry/type, nearest strike on the target expiry, same strike on the
+# nearest expiry, futures by expiry, nearest by strike + expiry score), but from lookup tables
+# built once per snapshot instead of DataFrame filters and sorts per component:
+#   - a dense (type, strike index, expiry index) -> first row array, so exact hits are one lookup
+#   - per expiry, the strikes in sorted order, walked outwards from a searchsorted probe
+#   - per strike and per type, the row positions, so the remaining fallbacks sort a few values
+# Ties break the way the DataFrame sorts broke them (row order, or the same argsort).
+# TemplateMatcher names the template a set of legs matches (the pages' detect_strategy): leg
+# signatures are precomputed once per template file, an exact match is one multiset lookup, and
+# the fuzzy strike / expiry score is a min-cost assignment instead of trying every permutation.
+# CompiledTemplates is the template file as flat per-component arrays (type code, qty, relative
+# strike, relative expiry) with per-template offsets; the resolver, matcher and scanner read
+# templates from it instead of walking the nested dicts.
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+OPTION_TYPES = ("Call", "Put")
+TYPE_CODES = {"Call": 0, "Put": 1, "Future": 2}  # other component types compile to -1
+DETECT_CACHE = 1024  # leg sets remembered per TemplateMatcher
+
+
+class CompiledTemplates:
+    # built from the parsed template file ({name: {"group", "components": [...]}, ...}); the
+    # components of template i are rows offsets[i]:offsets[i + 1] of the component arrays
+
+    def __init__(self, templates):
+        self.names = list(templates)
+        self.position = {name: i for i, name in enumerate(self.names)}
+        self.groups = [templates[name].get("group") for name in self.names]
+        comps = [templates[name].get("components", []) for name in self.names]
+        self.offsets = np.concatenate([[0], np.cumsum([len(c) for c in comps])]).astype(np.intp)
+        flat = [c for cs in comps for c in cs]
+        self.type_name = np.array([c.get("type") for c in flat], dtype=object)
+        self.type = np.array([TYPE_CODES.get(t, -1) for t in self.type_name], dtype=np.intp)
+        self.qty = np.array([int(c.get("qty", 0)) for c in flat], dtype=np.int64)
+        self.rel_strike = np.array([int(c.get("relative_strike", 0)) for c in flat], dtype=np.int64)
+        self.rel_expiry = np.array([int(c.get("relative_expiry", 0)) for c in flat], dtype=np.int64)
+        # rel_expiry from each template's nearest expiry (the offsets detection compares)
+        self.template_of = np.repeat(np.arange(len(self.names)), np.diff(self.offsets))
+        first_exp = np.zeros(len(self.names), dtype=np.int64)
+        nonempty = np.diff(self.offsets) > 0
+        if nonempty.any():
+            first_exp[nonempty] = np.minimum.reduceat(self.rel_expiry, self.offsets[:-1][nonempty])
+        self.norm_expiry = self.rel_expiry - first_exp[self.template_of]
+
+    def __len__(self):
+        return len(self.names)
+
+    def rows(self, i):
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def size(self, i):
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+
+def _column(df, name, dtype=None):
+    if name not in df.columns:
+        return np.full(len(df), np.nan) if dtype is float else np.full(len(df), None, dtype=object)
+    return df[name].to_numpy(dtype=dtype)
+
+
+def _expiry_column(df):
+    # ExpiryIndex with its own dtype (int64 when complete), so distances keep the dtype the
+    # DataFrame arithmetic gave them
+    if "ExpiryIndex" not in df.columns:
+        return np.full(len(df), np.nan)
+    col = df["ExpiryIndex"]
+    if col.dtype.kind in "iuf":
+        return col.to_numpy()
+    return pd.to_numeric(col, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _filled(values, fill):
+    # Series.fillna(fill) for a numeric array
+    if values.dtype.kind != "f":
+        return values
+    return np.where(np.isnan(values), fill, values)
+
+
+class TemplateResolver:
+    # built from the enriched option chain (load_option_market) and future table (load_future_market)
+
+    def __init__(self, options, futures=None):
+        futures = futures if futures is not None else pd.DataFrame()
+        self.series = _column(options, "Series", object)
+        self.strike = _column(options, "Strike", float)
+        self.expiry = _expiry_column(options)
+        kind = _column(options, "TypeParsed", object)
+        self.type_code = np.full(len(options), -1, dtype=np.intp)
+        for t, name in enumerate(OPTION_TYPES):
+            self.type_code[kind == name] = t
+
+        # the pages' unique_strikes / unique_exp
+        self.strikes = np.array(sorted(options["Strike"].dropna().unique())) if "Strike" in options.columns else np.array([])
+        self.expiries = np.array(sorted(options["ExpiryIndex"].dropna().unique())) if "ExpiryIndex" in options.columns else np.array([])
+        self.exp_pos = {}
+        for e, value in enumerate(self.expiries):
+            self.exp_pos.setdefault(value, e)
+
+        n_strikes, n_exp = len(self.strikes), len(self.expiries)
+        rows = np.arange(len(options))
+        has_strike = ~np.isnan(self.strike)
+        strike_i = np.full(len(options), -1, dtype=np.intp)
+        strike_i[has_strike] = np.searchsorted(self.strikes, self.strike[has_strike])
+        exp_i = np.array([self.exp_pos.get(v, -1) for v in self.expiry], dtype=np.intp)
+
+        # strikes np.isclose to each target strike (normally just itself)
+        close = np.isclose(self.strikes[None, :], self.strikes[:, None]) if n_strikes else np.zeros((0, 0), dtype=bool)
+        self.strike_rows = [rows[np.isin(strike_i, np.flatnonzero(c))] for c in close]
+
+        # exact[t, i, e]: first row of type t, expiry e and a strike close to strikes[i]
+        exact = np.full((len(OPTION_TYPES), n_strikes, n_exp), len(options), dtype=np.intp)
+        ok = (self.type_code >= 0) & (strike_i >= 0) & (exp_i >= 0)
+        np.minimum.at(exact, (self.type_code[ok], strike_i[ok], exp_i[ok]), rows[ok])
+        if n_strikes and not np.array_equal(close, np.eye(n_strikes, dtype=bool)):
+            exact = np.stack([np.where(c[None, :, None], exact, len(options)).min(axis=1) for c in close], axis=1)
+        exact[exact == len(options)] = -1
+        self.exact = exact
+
+        # per expiry: rows with a strike sorted by strike, and rows without one
+        self.exp_strikes, self.exp_rows, self.exp_nan_rows = [], [], []
+        for e in range(n_exp):
+            at = rows[(exp_i == e) & has_strike]
+            at = at[np.argsort(self.strike[at], kind="stable")]
+            self.exp_strikes.append(self.strike[at])
+            self.exp_rows.append(at)
+            self.exp_nan_rows.append(rows[(exp_i == e) & ~has_strike])
+
+        self.type_rows = [rows[self.type_code == t] for t in range(len(OPTION_TYPES))]
+
+        # futures by expiry, in table order
+        self.futures = {}
+        if not futures.empty and "ExpiryIndex" in futures.columns:
+            for s, e in zip(futures["Series"], futures["ExpiryIndex"]):
+                if not pd.isna(e):
+                    self.futures.setdefault(e, []).append(s)
+
+    def targets(self, rs, re, atm_strike_idx, atm_exp_idx):
+        # (target strike, its index, target expiry, its index) for offsets rs / re from the ATM
+        # strike and expiry; None where the offset leaves the chain
+        target_strike = strike_i = target_exp = None
+        if atm_strike_idx is not None and self.strikes.size:
+            i = atm_strike_idx + rs
+            if 0 <= i < len(self.strikes):
+                target_strike, strike_i = self.strikes[i], i
+        if atm_exp_idx is not None and self.expiries.size:
+            base = self.exp_pos.get(atm_exp_idx)
+            if base is not None:
+                if 0 <= base + re < len(self.expiries):
+                    target_exp = self.expiries[base + re]
+            elif atm_exp_idx + re in self.exp_pos:
+                target_exp = atm_exp_idx + re
+        exp_i = self.exp_pos[target_exp] if target_exp is not None else None
+        return target_strike, strike_i, target_exp, exp_i
+
+    def _first_unused(self, rows, used):
+        for r in rows:
+            s = self.series[r]
+            if s not in used:
+                return s
+        return None
+
+    def _by_strike_distance(self, e, base, rs):
+        # rows of expiry e ordered by |strike - base|, then the side rs leans to (lower strikes
+        # for rs < 0, higher otherwise), then row order; rows without a strike count as base
+        strikes, rows, nan_rows = self.exp_strikes[e], self.exp_rows[e], self.exp_nan_rows[e]
+        lo = hi = int(np.searchsorted(strikes, base))  # strikes[:lo] < base <= strikes[hi:]
+        while True:
+            d = min(abs(strikes[lo - 1] - base) if lo > 0 else np.inf,
+                    abs(strikes[hi] - base) if hi < len(strikes) else np.inf,
+                    0 if len(nan_rows) else np.inf)
+            if d == np.inf:
+                return
+            group = [(0, r) for r in nan_rows] if d == 0 else []
+            nan_rows = nan_rows if d else ()
+            while lo > 0 and abs(strikes[lo - 1] - base) == d:
+                lo -= 1
+                group.append((0 if rs < 0 else 1, rows[lo]))
+            while hi < len(strikes) and abs(strikes[hi] - base) == d:
+                group.append((0 if rs >= 0 or strikes[hi] == base else 1, rows[hi]))
+                hi += 1
+            for _, r in sorted(group):
+                yield r
+
+    def _by_expiry_distance(self, strike_i, target_exp, atm_exp_idx):
+        # rows at the target strike ordered by |expiry - target| (same argsort as sort_values)
+        rows = self.strike_rows[strike_i]
+        dist = np.abs(_filled(self.expiry[rows], atm_exp_idx) - (target_exp if target_exp is not None else atm_exp_idx))
+        return rows[np.argsort(dist, kind="quicksort")]
+
+    def _by_score(self, t, base_strike, base_exp):
+        rows = self.type_rows[t]
+        score = np.abs(_filled(self.strike[rows], base_strike) - base_strike) + np.abs(_filled(self.expiry[rows], base_exp) - base_exp)
+        return rows[np.argsort(score, kind="quicksort")]
+
+    def choose(self, typ, rs, targets, atm_exp_idx, spot_ref, used):
+        # series for one component (or None); used: series already taken by earlier components
+        target_strike, strike_i, target_exp, exp_i = targets
+        option = typ in OPTION_TYPES
+        # 3) exact strike + expiry + type (taken even if an earlier component has it)
+        if option and strike_i is not None and exp_i is not None:
+            r = self.exact[OPTION_TYPES.index(typ), strike_i, exp_i]
+            if r >= 0:
+                return self.series[r]
+        # 4) nearest strike on the target expiry, any type
+        chosen = None
+        if option and exp_i is not None and len(self.exp_rows[exp_i]) + len(self.exp_nan_rows[exp_i]):
+            base = target_strike if target_strike is not None else spot_ref
+            chosen = self._first_unused(self._by_strike_distance(exp_i, base, rs), used)
+        # 5) same strike on the nearest expiry, any type
+        if chosen is None and option and strike_i is not None and atm_exp_idx is not None:
+            chosen = self._first_unused(self._by_expiry_distance(strike_i, target_exp, atm_exp_idx), used)
+        # 6) future on the target expiry
+        if chosen is None and typ == "Future" and target_exp is not None:
+            chosen = next((s for s in self.futures.get(target_exp, ()) if s not in used), None)
+        # 7) nearest of the type by strike distance + expiry distance
+        if chosen is None and option:
+            base_strike = target_strike if target_strike is not None else spot_ref
+            base_exp = target_exp if target_exp is not None else (atm_exp_idx if atm_exp_idx is not None else 0)
+            chosen = self._first_unused(self._by_score(OPTION_TYPES.index(typ), base_strike, base_exp), used)
+        return chosen
+
+    def resolve_legs(self, types, rel_strikes, rel_expiries, atm_strike_idx, atm_exp_idx, spot_ref):
+        # [(series or None, target strike, target expiry)] per component, each component seeing
+        # the series taken by the ones before it (as the page loop's `used` set)
+        used, out = set(), []
+        for typ, rs, re in zip(types, rel_strikes.tolist(), rel_expiries.tolist()):
+            targets = self.targets(rs, re, atm_strike_idx, atm_exp_idx)
+            chosen = self.choose(typ, rs, targets, atm_exp_idx, spot_ref, used)
+            if chosen and chosen not in used:
+                used.add(chosen)
+            out.append((chosen, targets[0], targets[2]))
+        return out
+
+    def resolve_template(self, compiled, name, atm_strike_idx, atm_exp_idx, spot_ref):
+        # resolve_legs for template `name` of a CompiledTemplates ([] for an unknown name)
+        i = compiled.position.get(name)
+        if i is None:
+            return []
+        rows = compiled.rows(i)
+        return self.resolve_legs(compiled.type_name[rows], compiled.rel_strike[rows], compiled.rel_expiry[rows],
+                                 atm_strike_idx, atm_exp_idx, spot_ref)
+
+    def resolve(self, components, atm_strike_idx, atm_exp_idx, spot_ref):
+        # resolve_legs for a list of component dicts
+        return self.resolve_legs([c.get("type") for c in components],
+                                 np.array([int(c.get("relative_strike", 0)) for c in components], dtype=np.int64),
+                                 np.array([int(c.get("relative_expiry", 0)) for c in components], dtype=np.int64),
+                                 atm_strike_idx, atm_exp_idx, spot_ref)
+
+
+def normalize_offsets(legs):
+    # expiry offsets relative to the nearest expiry among the legs
+    if not legs:
+        return legs
+    min_exp = min(e for _, _, _, e in legs)
+    return [(t, q, rs, e - min_exp) for t, q, rs, e in legs]
+
+
+def _multiset(legs):
+    return frozenset(Counter(legs).items())
+
+
+class TemplateMatcher:
+    # built from a CompiledTemplates
+
+    def __init__(self, compiled):
+        self.names = compiled.names
+        # (type, sign of qty, relative strike, expiry offset from the template's nearest expiry)
+        legs = list(zip(compiled.type_name, np.sign(compiled.qty).tolist(), compiled.rel_strike.tolist(),
+                        compiled.norm_expiry.tolist()))
+        self.legs = [legs[compiled.rows(i)] for i in range(len(compiled))]
+        # exact leg multiset -> first template with it
+        self.exact = {}
+        # (type, sign) multiset -> templates with it, in file order; only these can match at all
+        self.candidates = {}
+        for i, legs in enumerate(self.legs):
+            self.exact.setdefault(_multiset(legs), self.names[i])
+            self.candidates.setdefault(_multiset([leg[:2] for leg in legs]), []).append(i)
+        self._best = lru_cache(maxsize=DETECT_CACHE)(self._detect)
+
+    def detect(self, legs):
+        # name of the best template for legs [(type, sign of qty, relative strike, relative expiry)]
+        # (offsets in strike steps / expiries from the ATM leg), or None. The score of a template
+        # is the least total |strike offset| + |expiry offset| difference over pairings of its
+        # components with the legs of the same type and sign; the first template with the lowest
+        # score wins, as in the permutation search it replaces.
+        if not legs:
+            return None
+        return self._best(_multiset(normalize_offsets([tuple(leg) for leg in legs])))
+
+    def _detect(self, key):
+        if key in self.exact:
+            return self.exact[key]
+        legs = [leg for leg, n in key for _ in range(n)]
+        best, best_score = None, np.inf
+        for i in self.candidates.get(_multiset([leg[:2] for leg in legs]), ()):
+            score = self._score(self.legs[i], legs)
+            if score < best_score:
+                best, best_score = self.names[i], score
+        return best
+
+    @staticmethod
+    def _score(tpl, legs):
+        # min-cost assignment of template components to legs; pairs of another type or sign
+        # cost more than any valid pairing (the multisets agree, so one always exists)
+        t = np.array([leg[2:] for leg in tpl], dtype=float)
+        a = np.array([leg[2:] for leg in legs], dtype=float)
+        cost = np.abs(t[:, None, :] - a[None, :, :]).sum(axis=2)
+        same = np.array([[x[:2] == y[:2] for y in legs] for x in tpl])
+        cost[~same] = cost.sum() + 1
+        rows, cols = linear_sum_assignment(cost)
+        return cost[rows, cols].sum()
@@ -0,0 +1,121 @@
+# validation.py
+# JSON-schema checks for the data files (schemas/*.schema.json), run by the loader once per file
+# version before anything is cached, so a malformed scrape is rejected with a message naming
+# the file and record instead of surfacing later as a KeyError or NaN margins.
+# Validators are compiled once per schema. Arrays of records are validated per record shape:
+# records with the same keys and JSON types (and the same values for the few properties whose
+# constraints depend on the value, e.g. ExpiryDate's pattern) validate identically, so one
+# representative per shape is checked and a large chain costs a pass over its dicts.
+import fnmatch
+import json
+from functools import lru_cache
+from pathlib import Path
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+SCHEMA_DIR = Path(__file__).resolve().parent / "schemas"
+# file name pattern -> schema name (schemas/<name>.schema.json); other files are not validated
+SCHEMA_FOR = (
+    ("market_data_*", "market"),
+    ("margin_data_*", "margin"),
+    ("st_template*", "template"),
+)
+# keywords that only look at the JSON type of a value
+TYPE_ONLY_KEYWORDS = {"type", "title", "description", "$comment"}
+
+
+def schema_name_for(path):
+    name = Path(path).name
+    for pattern, schema in SCHEMA_FOR:
+        if fnmatch.fnmatch(name, pattern):
+            return schema
+    return None
+
+
+@lru_cache(maxsize=None)
+def load_schema(name):
+    return json.loads((SCHEMA_DIR / f"{name}.schema.json").read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=None)
+def _compiled(name, part):
+    # part: "document" (the schema without "items") or "items" (the per-record schema)
+    schema = load_schema(name)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    if part == "items":
+        sub = dict(schema["items"])
+        if "$schema" in schema:
+            sub["$schema"] = schema["$schema"]
+        return cls(sub)
+    return cls({k: v for k, v in schema.items() if k != "items"})
+
+
+@lru_cache(maxsize=None)
+def _value_keys(name):
+    # properties whose constraints depend on the value, not only on its JSON type
+    # ("integer" does too: 1.0 is an integer, 1.5 is not)
+    props = load_schema(name).get("items", {}).get("properties", {})
+    keys = set()
+    for key, sub in props.items():
+        types = sub.get("type", [])
+        types = [types] if isinstance(types, str) else types
+        if set(sub) - TYPE_ONLY_KEYWORDS or "integer" in types:
+            keys.add(key)
+    return tuple(sorted(keys))
+
+
+def _shape(record, value_keys):
+    # keys, JSON types, and the values of value_keys (a missing key reads as None; the key
+    # tuple tells it apart from an explicit null)
+    return tuple(record), tuple(map(type, record.values())), tuple(map(record.get, value_keys))
+
+
+def _fail(path, error, where=""):
+    loc = "/".join(str(p) for p in error.absolute_path)
+    raise ValueError(f"{path}: {where}{error.message}" + (f" (at {loc})" if loc else ""))
+
+
+def validate_document(doc, name, path="<data>"):
+    # raise ValueError naming the first problem if doc does not match schema `name`
+    error = best_match(_compiled(name, "document").iter_errors(doc))
+    if error is not None:
+        _fail(path, error)
+    if isinstance(doc, list) and "items" in load_schema(name):
+        validate_records(doc, name, path)
+
+
+def validate_records(records, name, path="<data>", start=0):
+    # per-record check of a list against schema `name`'s "items", one representative per shape;
+    # start: index of records[0] in the whole file (for chunked readers)
+    validator, value_keys = _compiled(name, "items"), _value_keys(name)
+    seen = set()
+    for i, record in enumerate(records):
+        shape = _shape(record, value_keys) if isinstance(record, dict) else (type(record),)
+        try:
+            if shape in seen:
+                continue
+        except TypeError:  # unhashable value in a value-keyed property: check this record itself
+            shape = None
+        error = best_match(validator.iter_errors(record))
+        if error is not None:
+            series = record.get("Series") if isinstance(record, dict) else None
+            _fail(path, error, f"record {start + i}" + (f" ({series})" if series else "") + ": ")
+        if shape is not None:
+            seen.add(shape)
+
+
+def validate_file_data(doc, path):
+    # validate parsed JSON against the schema for its file name (no-op for other files)
+    name = schema_name_for(path)
+    if name is not None:
+        validate_document(doc, name, path)
+
+
+def record_checker(path):
+    # check(records, start) for chunked readers of `path`, or None if the file has no schema
+    name = schema_name_for(path)
+    if name is None or "items" not in load_schema(name):
+        return None
+    return lambda records, start=0: validate_records(records, name, path, start)
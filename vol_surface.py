@@ -0,0 +1,117 @@
+# vol_surface.py
+# Per-expiry volatility smile fitted once per market snapshot.
+# Each expiry gets a raw-SVI fit of total variance w(k) = a + b (rho (k - m) + sqrt((k - m)^2 + s^2))
+# in log-moneyness k = ln(K / F). Expiries with too few quotes fall back to a flat smile at
+# their median IV; expiries with no quotes interpolate total variance between neighbours.
+# Fits are cached on the snapshot's data, so every page and session reuses the same parameters.
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+
+from pricing import years_to_expiry
+
+MIN_POINTS_SVI = 5
+IV_BOUNDS = (1.0, 200.0)  # percent; quotes outside are ignored
+
+
+def _svi(params, k):
+    a, b, rho, m, s = params
+    return a + b * (rho * (k - m) + np.sqrt((k - m) ** 2 + s**2))
+
+
+def _fit_svi(k, w):
+    x0 = [max(float(w.min()) * 0.9, 1e-6), 0.1, -0.3, 0.0, 0.1]
+    lower = [0.0, 0.0, -0.999, -1.0, 1e-4]
+    upper = [max(float(w.max()) * 2.0, 1e-4), 5.0, 0.999, 1.0, 2.0]
+    res = least_squares(lambda p: _svi(p, k) - w, x0, bounds=(lower, upper), method="trf")
+    return tuple(float(v) for v in res.x) if res.success else None
+
+
+def chain_vol_points(df_market, rf, today=None):
+    # (expiry, T, forward, strike, iv%) per quoted option; IV LAST first, else IV SOLVED when present
+    iv = pd.to_numeric(df_market.get("IV LAST"), errors="coerce")
+    if "IV SOLVED" in df_market.columns:
+        iv = iv.fillna(pd.to_numeric(df_market["IV SOLVED"], errors="coerce"))
+    pts = pd.DataFrame({
+        "expiry": pd.to_datetime(df_market["ExpiryDate"], errors="coerce").dt.date,
+        "strike": pd.to_numeric(df_market["Strike"], errors="coerce"),
+        "spot": pd.to_numeric(df_market["UNDERLYING PRICE"], errors="coerce"),
+        "iv": iv,
+    })
+    pts = pts[df_market["TypeParsed"].isin(("Call", "Put"))].dropna()
+    pts = pts[(pts["iv"] > IV_BOUNDS[0]) & (pts["iv"] < IV_BOUNDS[1])]
+    pts["T"] = years_to_expiry(pts["expiry"].to_numpy(dtype=object), today)
+    pts = pts[pts["T"] > 0]
+    pts["forward"] = pts["spot"] * np.exp(rf * pts["T"])
+    return pts
+
+
+@lru_cache(maxsize=16)
+def _fit_cached(records):
+    # records: tuple of (expiry, T, forward, strike, iv) rows -- the snapshot's fit inputs are the key
+    pts = pd.DataFrame(list(records), columns=["expiry", "T", "forward", "strike", "iv"])
+    surface = {}
+    for expiry, grp in pts.groupby("expiry"):
+        T = float(grp["T"].iloc[0])
+        F = float(grp["forward"].median())
+        k = np.log(grp["strike"].to_numpy(dtype=float) / F)
+        w = (grp["iv"].to_numpy(dtype=float) / 100.0) ** 2 * T
+        params = _fit_svi(k, w) if len(grp) >= MIN_POINTS_SVI else None
+        surface[expiry] = {
+            "T": T,
+            "forward": F,
+            "svi": params,
+            "flat_var": float(np.median(w)),
+            "n_points": int(len(grp)),
+        }
+    return surface
+
+
+def fit_vol_surface(df_market, rf, today=None):
+    # {expiry date: {"T", "forward", "svi" (a, b, rho, m, s) or None, "flat_var", "n_points"}}
+    pts = chain_vol_points(df_market, rf, today)
+    records = tuple(pts[["expiry", "T", "forward", "strike", "iv"]].itertuples(index=False, name=None))
+    return _fit_cached(records)
+
+
+def _total_variance(entry, k):
+    if entry["svi"] is None:
+        return np.full_like(k, entry["flat_var"], dtype=float)
+    return np.maximum(_svi(entry["svi"], k), 1e-8)
+
+
+def surface_iv(surface, expiry, strike, rf=0.0, spot=None, today=None):
+    # IV in percent for arrays of (expiry date, strike); NaN if the surface is empty.
+    # Expiries between fitted ones interpolate total variance linearly in T at the same k;
+    # outside the fitted range the nearest expiry's smile is used.
+    expiry = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(expiry, dtype=object))), errors="coerce").dt.date.to_numpy(dtype=object)
+    strike = np.atleast_1d(np.asarray(strike, dtype=float))
+    out = np.full(strike.shape, np.nan)
+    if not surface:
+        return out
+    fitted = sorted(surface.values(), key=lambda e: e["T"])
+    Ts = np.array([e["T"] for e in fitted])
+    T_q = years_to_expiry(expiry, today)
+    ok = np.isfinite(T_q) & (T_q > 0) & np.isfinite(strike)
+
+    for exp_val in pd.unique(expiry[ok]):
+        idx = np.flatnonzero(ok & (expiry == exp_val))
+        T = float(T_q[idx[0]])
+        if exp_val in surface:
+            e = surface[exp_val]
+            out[idx] = np.sqrt(_total_variance(e, np.log(strike[idx] / e["forward"])) / e["T"]) * 100.0
+            continue
+        j = int(np.searchsorted(Ts, T))
+        lo, hi = fitted[max(j - 1, 0)], fitted[min(j, len(fitted) - 1)]
+        F = spot * np.exp(rf * T) if spot else lo["forward"]
+        k = np.log(strike[idx] / F)
+        if lo is hi or not (lo["T"] < T < hi["T"]):
+            e = lo if abs(lo["T"] - T) <= abs(hi["T"] - T) else hi
+            out[idx] = np.sqrt(_total_variance(e, k) / e["T"]) * 100.0
+        else:
+            x = (T - lo["T"]) / (hi["T"] - lo["T"])
+            w = (1 - x) * _total_variance(lo, k) + x * _total_variance(hi, k)
+            out[idx] = np.sqrt(w / T) * 100.0
+    return out